@@ -5,10 +5,12 @@
 """
 
 import os
+import re
 import sys
+import json
 import tempfile
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import traceback
 import speech_recognition as sr
@@ -31,24 +33,98 @@ except ImportError:
         print("无法导入摄影代理模块")
         sys.exit(1)
 
+# data目录已加入路径，与摄影代理共用同一个配置模块
+from config import Config
+from session_registry import SessionRegistry
+from sensor_input import parse_sensor_data
+
 # 创建Flask应用
 app = Flask(__name__)
 CORS(app)  # 允许跨域访问
 
 # 全局变量
-photography_agent = None
+photography_agent = None  # 共享的重量级资源（AI客户端、知识库、缓存）
+session_registry = None  # 每个客户端独立的轻量会话状态
+
+# 会话ID格式：字母、数字、下划线和短横线，最长64个字符
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
 
 def init_agent():
-    """初始化摄影代理"""
-    global photography_agent
+    """初始化摄影代理和会话注册表"""
+    global photography_agent, session_registry
     try:
         photography_agent = PhotographyAgent()
+        session_registry = SessionRegistry()
         return True
     except Exception as e:
         print(f"摄影代理初始化失败: {e}")
         traceback.print_exc()
         return False
 
+# 允许上传的图片格式
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+
+# 文件上传限制 (16MB)
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+def validate_upload_filename(filename):
+    """检查上传文件名，合法时返回None，否则返回错误信息（同步和异步服务器共用）"""
+    if filename == '':
+        return '未选择文件'
+    if not ('.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS):
+        return '不支持的文件格式，请上传图片文件'
+    return None
+
+def resolve_llm_mode(mode):
+    """解析AI调用模式，返回 (mode, error_message)"""
+    mode = mode or Config.LLM_MODE
+    if mode not in Config.LLM_MODES:
+        return None, f"不支持的AI调用模式: {mode}，可选: {', '.join(Config.LLM_MODES)}"
+    return mode, None
+
+def lookup_session(session_id):
+    """按会话ID获取会话，返回 (session, error_message)"""
+    session_id = session_id or Config.DEFAULT_SESSION_ID
+    if not SESSION_ID_PATTERN.match(session_id):
+        return None, '会话ID格式无效（仅支持字母、数字、下划线和短横线，最长64个字符）'
+    return session_registry.get_session(session_id), None
+
+def read_sensor_params(*sources):
+    """从表单/查询参数中读取设备传感器数据（roll / pitch / sensor_timestamp），返回 (sensor, error_message)"""
+    def pick(key):
+        return next((source.get(key) for source in sources if source.get(key) not in (None, '')), None)
+    # 读数随画面一起上传，收到时即是最新的，无需再判断是否过期
+    return parse_sensor_data(pick('roll'), pick('pitch'), pick('sensor_timestamp'))
+
+def format_sse(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# SSE响应头：禁止缓存和反向代理缓冲，保证每条建议立即送达
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def get_client_session():
+    """
+    获取当前请求对应的会话
+    会话ID可通过 X-Session-ID 请求头、session_id 查询参数/表单字段/JSON字段提供，
+    未提供时使用默认会话。返回 (session, error_response)
+    """
+    json_body = request.get_json(silent=True) if request.is_json else None
+    session, error_message = lookup_session(
+        request.headers.get('X-Session-ID')
+        or request.args.get('session_id')
+        or request.form.get('session_id')
+        or (json_body.get('session_id') if isinstance(json_body, dict) else None)
+    )
+    if error_message:
+        return None, (jsonify({
+            'status': 'error',
+            'message': error_message,
+            'timestamp': datetime.now().isoformat()
+        }), 400)
+    return session, None
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
     """
@@ -83,88 +159,93 @@ def analyze_image():
 
         file = request.files['image']
         print(f"File received: {file.filename}")
-        print(f"File size: {len(file.read())//1024}KB")
-        file.seek(0)  # Reset file pointer after reading size
         
-        # 检查文件名
-        if file.filename == '':
-            print("ERROR: Empty filename")
+        # 检查文件名和文件类型
+        filename_error = validate_upload_filename(file.filename)
+        if filename_error:
+            print(f"ERROR: Invalid upload: {file.filename!r}")
+            return jsonify({
+                'status': 'error',
+                'message': filename_error,
+                'timestamp': datetime.now().isoformat()
+            }), 400
+
+        session, error_response = get_client_session()
+        if error_response:
+            return error_response
+        print(f"Session: {session.session_id}")
+
+        # AI调用模式（可按请求选择，便于对比两次调用和合并调用）
+        mode, mode_error = resolve_llm_mode(request.form.get('mode') or request.args.get('mode'))
+        if mode_error:
+            print(f"ERROR: {mode_error}")
             return jsonify({
                 'status': 'error',
-                'message': '未选择文件',
+                'message': mode_error,
                 'timestamp': datetime.now().isoformat()
             }), 400
+        print(f"LLM mode: {mode}")
 
-        # 检查文件类型
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
-        if not ('.' in file.filename and 
-                file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-            print(f"ERROR: Unsupported file type: {file.filename}")
+        # 设备传感器水平数据（可选，提供时跳过画面水平检测）
+        sensor, sensor_error = read_sensor_params(request.form, request.args)
+        if sensor_error:
+            print(f"ERROR: {sensor_error}")
             return jsonify({
                 'status': 'error',
-                'message': '不支持的文件格式，请上传图片文件',
+                'message': sensor_error,
                 'timestamp': datetime.now().isoformat()
             }), 400
+        if sensor:
+            print(f"Sensor: roll={sensor['roll']}, pitch={sensor['pitch']}")
 
+        # 一次性读取上传内容，后续解码和base64编码都复用这份字节（不再写临时文件）
+        image_bytes = file.read()
+        print(f"File size: {len(image_bytes)//1024}KB")
         print("File validation passed - processing image...")
         
-        # 保存临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            print(f"Saving to temporary file: {tmp_file.name}")
-            file.save(tmp_file.name)
-            
-            try:
-                print("Calling photography agent for analysis...")
-                
-                # DEBUG: Show current user intent context
-                print("=" * 80)
-                print("ANALYZING IMAGE WITH CURRENT CONTEXT:")
-                if photography_agent.user_photography_intent:
-                    print(f"User Photography Intent: '{photography_agent.user_photography_intent}'")
-                    print("Will provide targeted suggestions based on user's stated goal")
-                else:
-                    print("No specific photography intent set - providing general suggestions")
-                print("=" * 80)
-                
-                start_time = datetime.now()
-                
-                # 调用摄影代理分析图片
-                guidance_json = photography_agent.get_guidance(tmp_file.name)
-                
-                # Parse the JSON string into a dictionary
-                import json
-                guidance = json.loads(guidance_json)
-                
-                end_time = datetime.now()
-                processing_time = (end_time - start_time).total_seconds()
-                
-                print(f"Analysis completed in {processing_time:.2f} seconds")
-                print(f"Generated {len(guidance.get('suggestions', []))} suggestions")
-                print("Sending response to client...")
-                
-                # 获取消息历史摘要
-                history_summary = photography_agent.get_message_history_summary()
-                
-                # 返回成功响应
-                response = jsonify({
-                    'status': 'success',
-                    'data': guidance,
-                    'message_history': history_summary,
-                    'timestamp': datetime.now().isoformat(),
-                    'filename': file.filename
-                })
-                
-                print("SUCCESS: Response sent successfully!")
-                print("-" * 60)
-                return response
-                
-            finally:
-                # 清理临时文件
-                try:
-                    os.unlink(tmp_file.name)
-                    print("Temporary file cleaned up")
-                except Exception as cleanup_error:
-                    print(f"Warning: Could not clean up temporary file: {cleanup_error}")
+        print("Calling photography agent for analysis...")
+        
+        # DEBUG: Show current user intent context
+        print("=" * 80)
+        print("ANALYZING IMAGE WITH CURRENT CONTEXT:")
+        if session.user_photography_intent:
+            print(f"User Photography Intent: '{session.user_photography_intent}'")
+            print("Will provide targeted suggestions based on user's stated goal")
+        else:
+            print("No specific photography intent set - providing general suggestions")
+        print("=" * 80)
+        
+        start_time = datetime.now()
+        
+        # 调用摄影代理分析图片
+        guidance_json = photography_agent.get_guidance(image_bytes, mode=mode, session=session, sensor=sensor)
+        
+        # Parse the JSON string into a dictionary
+        guidance = json.loads(guidance_json)
+        
+        end_time = datetime.now()
+        processing_time = (end_time - start_time).total_seconds()
+        
+        print(f"Analysis completed in {processing_time:.2f} seconds")
+        print(f"Generated {len(guidance.get('suggestions', []))} suggestions")
+        print("Sending response to client...")
+        
+        # 获取消息历史摘要
+        history_summary = session.get_message_history_summary()
+        
+        # 返回成功响应
+        response = jsonify({
+            'status': 'success',
+            'data': guidance,
+            'message_history': history_summary,
+            'session_id': session.session_id,
+            'timestamp': datetime.now().isoformat(),
+            'filename': file.filename
+        })
+        
+        print("SUCCESS: Response sent successfully!")
+        print("-" * 60)
+        return response
 
     except Exception as e:
         print(f"API错误: {e}")
@@ -175,18 +256,173 @@ def analyze_image():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_image_stream():
+    """
+    流式图片分析API（Server-Sent Events）
+    每条建议生成完整后立即推送，事件: analysis → suggestion ×N → done / error
+    """
+    print(f"\nSTREAMING FRAME ANALYSIS REQUEST - {datetime.now().strftime('%H:%M:%S')}")
+
+    if not photography_agent:
+        return jsonify({
+            'status': 'error',
+            'message': '摄影代理未初始化',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+    if 'image' not in request.files:
+        return jsonify({
+            'status': 'error',
+            'message': '请上传图片文件',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+
+    file = request.files['image']
+    filename_error = validate_upload_filename(file.filename)
+    if filename_error:
+        return jsonify({
+            'status': 'error',
+            'message': filename_error,
+            'timestamp': datetime.now().isoformat()
+        }), 400
+
+    session, error_response = get_client_session()
+    if error_response:
+        return error_response
+
+    sensor, sensor_error = read_sensor_params(request.form, request.args)
+    if sensor_error:
+        return jsonify({
+            'status': 'error',
+            'message': sensor_error,
+            'timestamp': datetime.now().isoformat()
+        }), 400
+
+    image_bytes = file.read()
+    print(f"Session: {session.session_id}, File size: {len(image_bytes)//1024}KB")
+
+    def generate():
+        start_time = datetime.now()
+        for event, data in photography_agent.stream_guidance(image_bytes, session=session, sensor=sensor):
+            if event == 'suggestion':
+                elapsed = (datetime.now() - start_time).total_seconds()
+                print(f"Streamed suggestion {data['step']} after {elapsed:.2f}s")
+            if event == 'done':
+                data = {'status': 'success', 'data': data, 'session_id': session.session_id,
+                        'timestamp': datetime.now().isoformat()}
+            yield format_sse(event, data)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def circuit_breaker_states():
+    """各熔断器当前状态 {名称: closed/open/half_open}（只读内存，不访问模型服务）"""
+    if not photography_agent or not photography_agent.llm.circuit_breakers:
+        return {}
+    breakers = photography_agent.llm.circuit_breakers.get_stats()['breakers']
+    return {name: stats['state'] for name, stats in breakers.items()}
+
+def health_payload():
+    """健康检查结果（同步和异步服务器共用）
+    
+    模型服务降级时仍返回 status=ok（本地建议照常可用），通过 llm_status 和 circuit_breakers 反映熔断状态
+    """
+    agent_status = 'ready' if photography_agent else 'not_initialized'
+    breaker_states = circuit_breaker_states()
+    return {
+        'status': 'ok',
+        'agent_status': agent_status,
+        'llm_status': 'degraded' if any(state != 'closed' for state in breaker_states.values()) else 'ok',
+        'circuit_breakers': breaker_states,
+        'active_sessions': len(session_registry) if session_registry else 0,
+        'cache': photography_agent.cache.get_stats() if photography_agent else None,
+        'frame_gate': photography_agent.frame_gate.get_stats() if photography_agent else None,
+        'level_cascade': photography_agent.level_cascade.get_stats() if photography_agent else None,
+        'timestamp': datetime.now().isoformat(),
+        'version': '1.0.0'
+    }
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
     print(f"\nHEALTH CHECK - {datetime.now().strftime('%H:%M:%S')} - Client: {request.remote_addr}")
-    agent_status = 'ready' if photography_agent else 'not_initialized'
-    print(f"Agent Status: {agent_status}")
+    payload = health_payload()
+    print(f"Agent Status: {payload['agent_status']}, LLM Status: {payload['llm_status']}")
+    
+    return jsonify(payload)
+
+def circuit_breaker_payload():
+    """熔断器详细状态和最近的状态转换，返回 (payload, status_code)"""
+    if not photography_agent:
+        return {
+            'status': 'error',
+            'message': '摄影代理未初始化',
+            'timestamp': datetime.now().isoformat()
+        }, 500
+    return {
+        'status': 'success',
+        'data': photography_agent.llm.circuit_breakers.get_stats() if photography_agent.llm.circuit_breakers else None,
+        'timestamp': datetime.now().isoformat()
+    }, 200
+
+@app.route('/api/circuit-breakers', methods=['GET'])
+def get_circuit_breakers():
+    """熔断器状态接口：每个 模型:调用类型 的状态、窗口内错误率/慢调用比例和最近的状态转换"""
+    payload, status_code = circuit_breaker_payload()
+    return jsonify(payload), status_code
+
+@app.route('/api/circuit-breakers/reset', methods=['POST'])
+def reset_circuit_breakers():
+    """手动重置熔断器（JSON字段 name 指定熔断器，不提供时重置全部）"""
+    if not photography_agent or not photography_agent.llm.circuit_breakers:
+        return jsonify({
+            'status': 'error',
+            'message': '熔断器未启用',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+    
+    data = request.get_json(silent=True)
+    data = {} if data is None else data
+    name = data.get('name') if isinstance(data, dict) else None
+    if not isinstance(data, dict) or not isinstance(name, (str, type(None))):
+        return jsonify({
+            'status': 'error',
+            'message': '请求体必须是JSON对象，name为熔断器名称字符串',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    if not photography_agent.llm.circuit_breakers.reset(name):
+        return jsonify({
+            'status': 'error',
+            'message': f'熔断器不存在: {name}',
+            'timestamp': datetime.now().isoformat()
+        }), 404
     
     return jsonify({
-        'status': 'ok',
-        'agent_status': agent_status,
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
+        'status': 'success',
+        'message': f'已重置熔断器: {name}' if name else '已重置全部熔断器',
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """运行统计接口：缓存、帧差门控、水平检查级联策略和模型调用网关的详细统计（含最近的级联决策，用于调整阈值）"""
+    if not photography_agent:
+        return jsonify({
+            'status': 'error',
+            'message': '摄影代理未初始化',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+    return jsonify({
+        'status': 'success',
+        'cache': photography_agent.cache.get_stats(),
+        'frame_gate': photography_agent.frame_gate.get_stats(),
+        'level_cascade': photography_agent.level_cascade.get_stats(include_recent=True),
+        'image_payload': photography_agent.image_payloads.get_stats(),
+        'llm_gateway': photography_agent.llm.get_stats(),
+        'sessions': session_registry.get_stats() if session_registry else None,
+        'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/info', methods=['GET'])
@@ -196,13 +432,23 @@ def api_info():
         'name': '摄影指导API',
         'version': '1.0.0',
         'description': '提供图片分析和摄影建议的API服务',
+        'sessions': {
+            'description': '每个客户端拥有独立的消息历史和拍摄意图，未提供会话ID时使用默认会话',
+            'header': 'X-Session-ID',
+            'parameter': 'session_id（查询参数、表单字段或JSON字段）',
+            'format': '字母、数字、下划线和短横线，最长64个字符'
+        },
         'endpoints': {
             '/api/analyze': {
                 'method': 'POST',
                 'description': '分析图片并返回摄影建议',
                 'content_type': 'multipart/form-data',
                 'parameters': {
-                    'image': '图片文件 (支持: png, jpg, jpeg, gif, bmp, webp)'
+                    'image': '图片文件 (支持: png, jpg, jpeg, gif, bmp, webp)',
+                    'mode': '可选，AI调用模式: two_call（默认，水平检查和建议分开请求）/ combined（一次请求同时返回）/ local（不调用模型，根据画面特征本地生成建议）',
+                    'roll': '可选，设备横滚角（度，右侧抬高为正）；提供时直接用于水平校正，跳过画面水平检测',
+                    'pitch': '可选，设备俯仰角（度，仰拍为正）',
+                    'sensor_timestamp': '可选，传感器读数时间（Unix时间，秒或毫秒），仅作记录'
                 },
                 'response': {
                     'status': 'success/error',
@@ -211,15 +457,53 @@ def api_info():
                     'filename': '上传的文件名'
                 }
             },
+            '/api/analyze/stream': {
+                'method': 'POST',
+                'description': '流式分析图片，每条建议生成后立即以Server-Sent Events推送',
+                'content_type': 'multipart/form-data',
+                'parameters': {
+                    'image': '图片文件 (支持: png, jpg, jpeg, gif, bmp, webp)',
+                    'roll / pitch / sensor_timestamp': '可选，设备传感器数据（同 /api/analyze）'
+                },
+                'response': 'text/event-stream，事件: analysis（画面分析）/ suggestion（单条建议）/ done（完整结果）/ error'
+            },
+            '/api/ws/camera': {
+                'method': 'WebSocket（仅异步服务器模式）',
+                'description': '实时相机通道：只分析最新一帧，分析进行中到达的旧帧会被丢弃',
+                'parameters': {
+                    'session_id': '查询参数，会话ID',
+                    'binary message': '一帧JPEG画面',
+                    'text message': 'JSON控制消息: {"type": "config", "mode": ...} / {"type": "intent", "intent": ...} / {"type": "sensor", "roll": ..., "pitch": ..., "timestamp": ...} / {"type": "ping"}'
+                },
+                'response': 'JSON消息: {"type": "guidance", "data": 摄影建议, "frame_id": 帧编号, "frames": 帧统计}'
+            },
             '/api/health': {
                 'method': 'GET',
-                'description': '健康检查',
+                'description': '健康检查（异步服务器模式下在事件循环中直接返回，不经过WSGI线程池）',
                 'response': {
                     'status': 'ok',
                     'agent_status': 'ready/not_initialized',
+                    'llm_status': 'ok/degraded（有熔断器处于open或half_open，此时使用本地建议）',
+                    'circuit_breakers': '各熔断器状态 {模型:调用类型: closed/open/half_open}',
                     'timestamp': 'ISO格式时间戳'
                 }
             },
+            '/api/circuit-breakers': {
+                'method': 'GET',
+                'description': '熔断器状态：每个 模型:调用类型 的状态、窗口内错误率和慢调用比例、被拒绝的调用数、最近的状态转换'
+            },
+            '/api/circuit-breakers/reset': {
+                'method': 'POST',
+                'description': '手动重置熔断器为closed',
+                'content_type': 'application/json',
+                'parameters': {
+                    'name': '可选，熔断器名称（模型:调用类型），不提供时重置全部'
+                }
+            },
+            '/api/stats': {
+                'method': 'GET',
+                'description': '运行统计：缓存命中率、帧差门控复用率、水平检查级联策略的决策分布/AI耗时/按置信度分段的不一致率及最近决策、AI图片载荷的压缩效果、模型调用网关按调用类型的延迟分位数/响应缓存与请求合并/token用量、服务商prompt缓存命中、熔断器状态和模型路由（各调用类型候选模型的延迟/错误率和选择次数）'
+            },
             '/api/info': {
                 'method': 'GET',
                 'description': 'API信息和使用说明'
@@ -336,10 +620,15 @@ def get_message_history():
             'timestamp': datetime.now().isoformat()
         }), 500
     
-    history_summary = photography_agent.get_message_history_summary()
+    session, error_response = get_client_session()
+    if error_response:
+        return error_response
+    
+    history_summary = session.get_message_history_summary()
     return jsonify({
         'status': 'success',
         'data': history_summary,
+        'session_id': session.session_id,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -353,10 +642,15 @@ def clear_message_history():
             'timestamp': datetime.now().isoformat()
         }), 500
     
-    photography_agent.clear_message_history()
+    session, error_response = get_client_session()
+    if error_response:
+        return error_response
+    
+    session.clear_message_history()
     return jsonify({
         'status': 'success',
         'message': '消息历史已清空',
+        'session_id': session.session_id,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -370,10 +664,15 @@ def start_conversation():
             'timestamp': datetime.now().isoformat()
         }), 500
     
-    greeting_message = photography_agent.start_conversation()
+    session, error_response = get_client_session()
+    if error_response:
+        return error_response
+    
+    greeting_message = session.start_conversation()
     return jsonify({
         'status': 'success',
         'message': greeting_message,
+        'session_id': session.session_id,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -396,6 +695,10 @@ def set_photography_intent():
                 'timestamp': datetime.now().isoformat()
             }), 400
         
+        session, error_response = get_client_session()
+        if error_response:
+            return error_response
+        
         intent = data['intent'].strip()
         if not intent:
             return jsonify({
@@ -410,16 +713,17 @@ def set_photography_intent():
         print(f"User Input: '{intent}'")
         print("=" * 80)
         
-        confirmation_message = photography_agent.set_photography_intent(intent)
+        confirmation_message = session.set_photography_intent(intent)
         
         # DEBUG: Confirm intent was set
-        print(f"Intent successfully set in agent: '{photography_agent.user_photography_intent}'")
+        print(f"Intent successfully set in session {session.session_id}: '{session.user_photography_intent}'")
         print("=" * 80)
         
         return jsonify({
             'status': 'success',
             'message': confirmation_message,
             'intent': intent,
+            'session_id': session.session_id,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -557,6 +861,10 @@ def voice_conversation():
             'timestamp': datetime.now().isoformat()
         }), 400
     
+    session, error_response = get_client_session()
+    if error_response:
+        return error_response
+    
     audio_file = request.files['audio']
     
     try:
@@ -591,14 +899,14 @@ def voice_conversation():
         # 步骤2: 处理用户意图
         response_text = ""
         
-        if not photography_agent.session_started:
+        if not session.session_started:
             # 如果会话未开始，先开始会话
-            photography_agent.start_conversation()
+            session.start_conversation()
             response_text = f"收到您的话：{user_text}。让我为您设置拍摄意图。"
-            photography_agent.set_photography_intent(user_text)
+            session.set_photography_intent(user_text)
         else:
             # 设置拍摄意图
-            response_text = photography_agent.set_photography_intent(user_text)
+            response_text = session.set_photography_intent(user_text)
         
         # 步骤3: 文字转语音
         tts = gTTS(text=response_text, lang='zh', slow=False)
@@ -614,7 +922,8 @@ def voice_conversation():
             'user_text': user_text,
             'response_text': response_text,
             'audio_base64': audio_base64,
-            'intent_set': photography_agent.user_photography_intent,
+            'intent_set': session.user_photography_intent,
+            'session_id': session.session_id,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -650,15 +959,27 @@ if __name__ == '__main__':
     print("PHOTOGRAPHY GUIDANCE API SERVER")
     print("="*70)
     print("Starting at:", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    print("Initializing photography agent...")
+    uvicorn = None
+    if Config.SERVER_MODE == 'async':
+        try:
+            import uvicorn
+        except ImportError:
+            print("WARNING: uvicorn未安装，回退到Flask多线程服务器（pip install -r requirements.txt）")
     
-    # 初始化摄影代理
-    if not init_agent():
-        print("FAILED: Unable to initialize photography agent")
-        print("Please check your photography_agent.py file")
-        sys.exit(1)
-    
-    print("SUCCESS: Photography agent initialized!")
+    if uvicorn:
+        # 异步模式下由 asgi_server 的 lifespan 在每个worker进程中初始化摄影代理；
+        # 这里的 api_server 是 __main__ 模块，与uvicorn导入的 api_server 不是同一个，不在这里初始化
+        print("Photography agent will be initialized by each uvicorn worker")
+    else:
+        print("Initializing photography agent...")
+        
+        # 初始化摄影代理
+        if not init_agent():
+            print("FAILED: Unable to initialize photography agent")
+            print("Please check your photography_agent.py file")
+            sys.exit(1)
+        
+        print("SUCCESS: Photography agent initialized!")
     print("\nSERVER CONFIGURATION:")
     print("   Address: http://localhost:5002")
     print("   Image Analysis: POST /api/analyze")
@@ -676,13 +997,23 @@ if __name__ == '__main__':
     print("="*70)
     print("SERVER STARTING...\n")
     
-    # 设置文件上传限制 (16MB)
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    if uvicorn:
+        # 生产模式：ASGI服务器，/api/analyze 在事件循环中异步等待AI响应，
+        # 其余接口通过WSGI适配层复用Flask路由
+        print(f"ASYNC SERVER MODE: uvicorn workers={Config.SERVER_WORKERS}")
+        uvicorn.run(
+            'asgi_server:app',
+            host=Config.SERVER_HOST,
+            port=Config.SERVER_PORT,
+            workers=Config.SERVER_WORKERS,
+            app_dir=current_dir
+        )
+        sys.exit(0)
     
-    # 启动服务器
+    # 开发模式：Flask自带服务器
     app.run(
-        host='0.0.0.0',
-        port=5002,
-        debug=True,
+        host=Config.SERVER_HOST,
+        port=Config.SERVER_PORT,
+        debug=Config.SERVER_MODE == 'dev',
         threaded=True
-    )
\ No newline at end of file
+    )
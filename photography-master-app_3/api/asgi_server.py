@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+摄影指导 API 异步服务器（生产模式）
+/api/analyze 在事件循环中异步等待AI响应，单个进程即可同时处理大量相机帧请求；
+/api/ws/camera 提供实时相机WebSocket通道（只分析最新一帧）；
+/api/health 和 /api/circuit-breakers 在事件循环中直接返回，模型服务故障占满线程池时也能及时响应；
+其余接口通过WSGI适配层复用 api_server.py 中的Flask路由。
+
+启动: python api_server.py（SERVER_MODE=async，默认）
+或:   uvicorn asgi_server:app --host 0.0.0.0 --port 5002
+"""
+
+import json
+import asyncio
+import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+# api_server 负责把 data 目录加入路径，并持有共享的摄影代理和会话注册表
+import api_server
+from frame_slot import LatestFrameSlot
+from sensor_input import is_sensor_fresh, sensor_age
+
+
+def error_response(message, status_code):
+    """返回与Flask接口一致的错误响应"""
+    return JSONResponse({
+        'status': 'error',
+        'message': message,
+        'timestamp': datetime.now().isoformat()
+    }, status_code=status_code)
+
+
+async def analyze_image(request):
+    """
+    图片分析API（异步版本）
+    请求和响应格式与 api_server.analyze_image 相同
+    """
+    print("\n" + "="*60)
+    print("NEW CAMERA FRAME ANALYSIS REQUEST (async)")
+    print("="*60)
+    print(f"Time: {datetime.now().strftime('%H:%M:%S')}")
+    print(f"Client IP: {request.client.host if request.client else 'unknown'}")
+
+    try:
+        photography_agent = api_server.photography_agent
+        if not photography_agent:
+            print("ERROR: Photography agent not initialized")
+            return error_response('摄影代理未初始化', 500)
+
+        # 文件上传限制与Flask的 MAX_CONTENT_LENGTH 保持一致
+        content_length = request.headers.get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > api_server.MAX_UPLOAD_SIZE:
+            return error_response('上传文件过大，请压缩后重试', 413)
+
+        form = await request.form()
+        file = form.get('image')
+        if file is None or isinstance(file, str):
+            print("ERROR: No image file in request")
+            return error_response('请上传图片文件', 400)
+
+        filename = file.filename or ''
+        print(f"File received: {filename}")
+        filename_error = api_server.validate_upload_filename(filename)
+        if filename_error:
+            print(f"ERROR: Invalid upload: {filename!r}")
+            return error_response(filename_error, 400)
+
+        session, session_error = api_server.lookup_session(
+            request.headers.get('x-session-id')
+            or request.query_params.get('session_id')
+            or form.get('session_id')
+        )
+        if session_error:
+            return error_response(session_error, 400)
+        print(f"Session: {session.session_id}")
+
+        mode, mode_error = api_server.resolve_llm_mode(form.get('mode') or request.query_params.get('mode'))
+        if mode_error:
+            print(f"ERROR: {mode_error}")
+            return error_response(mode_error, 400)
+        print(f"LLM mode: {mode}")
+
+        sensor, sensor_error = api_server.read_sensor_params(form, request.query_params)
+        if sensor_error:
+            print(f"ERROR: {sensor_error}")
+            return error_response(sensor_error, 400)
+        if sensor:
+            print(f"Sensor: roll={sensor['roll']}, pitch={sensor['pitch']}")
+
+        image_bytes = await file.read()
+        print(f"File size: {len(image_bytes)//1024}KB")
+        if session.user_photography_intent:
+            print(f"User Photography Intent: '{session.user_photography_intent}'")
+
+        start_time = datetime.now()
+        guidance = json.loads(await photography_agent.get_guidance_async(
+            image_bytes, mode=mode, session=session, sensor=sensor
+        ))
+        processing_time = (datetime.now() - start_time).total_seconds()
+
+        print(f"Analysis completed in {processing_time:.2f} seconds")
+        print(f"Generated {len(guidance.get('suggestions', []))} suggestions")
+
+        return JSONResponse({
+            'status': 'success',
+            'data': guidance,
+            'message_history': session.get_message_history_summary(),
+            'session_id': session.session_id,
+            'timestamp': datetime.now().isoformat(),
+            'filename': filename
+        })
+
+    except Exception as e:
+        print(f"API错误: {e}")
+        traceback.print_exc()
+        return error_response(f'服务器内部错误: {str(e)}', 500)
+
+
+async def analyze_image_stream(request):
+    """
+    流式图片分析API（Server-Sent Events，异步版本）
+    事件格式与 api_server.analyze_image_stream 相同
+    """
+    print(f"\nSTREAMING FRAME ANALYSIS REQUEST (async) - {datetime.now().strftime('%H:%M:%S')}")
+
+    photography_agent = api_server.photography_agent
+    if not photography_agent:
+        return error_response('摄影代理未初始化', 500)
+
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > api_server.MAX_UPLOAD_SIZE:
+        return error_response('上传文件过大，请压缩后重试', 413)
+
+    form = await request.form()
+    file = form.get('image')
+    if file is None or isinstance(file, str):
+        return error_response('请上传图片文件', 400)
+
+    filename_error = api_server.validate_upload_filename(file.filename or '')
+    if filename_error:
+        return error_response(filename_error, 400)
+
+    session, session_error = api_server.lookup_session(
+        request.headers.get('x-session-id')
+        or request.query_params.get('session_id')
+        or form.get('session_id')
+    )
+    if session_error:
+        return error_response(session_error, 400)
+
+    sensor, sensor_error = api_server.read_sensor_params(form, request.query_params)
+    if sensor_error:
+        return error_response(sensor_error, 400)
+
+    image_bytes = await file.read()
+    print(f"Session: {session.session_id}, File size: {len(image_bytes)//1024}KB")
+
+    async def generate():
+        start_time = datetime.now()
+        async for event, data in photography_agent.stream_guidance_async(image_bytes, session=session, sensor=sensor):
+            if event == 'suggestion':
+                elapsed = (datetime.now() - start_time).total_seconds()
+                print(f"Streamed suggestion {data['step']} after {elapsed:.2f}s")
+            if event == 'done':
+                data = {'status': 'success', 'data': data, 'session_id': session.session_id,
+                        'timestamp': datetime.now().isoformat()}
+            yield api_server.format_sse(event, data)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=api_server.SSE_HEADERS)
+
+
+async def camera_websocket(websocket: WebSocket):
+    """
+    实时相机WebSocket通道
+    - 二进制消息：一帧JPEG画面
+    - 文本消息：JSON控制消息，如 {"type": "config", "mode": "combined"}、{"type": "intent", "intent": "人像"}
+      或 {"type": "sensor", "roll": 3.2, "pitch": -5.0, "timestamp": 1700000000000}（设备传感器水平数据，随后的帧都使用最新读数）
+    服务器只保留最新一帧待分析画面，分析进行中到达的旧帧直接丢弃，分析完成后推送建议。
+    """
+    session, session_error = api_server.lookup_session(
+        websocket.headers.get('x-session-id') or websocket.query_params.get('session_id')
+    )
+    if session_error:
+        await websocket.close(code=1008, reason='invalid session id')
+        return
+
+    await websocket.accept()
+    print(f"\nLIVE CAMERA CONNECTED - Session: {session.session_id}")
+
+    slot = LatestFrameSlot()
+    options = {'mode': None, 'sensor': None}
+
+    async def send(payload) -> bool:
+        """推送一条消息；客户端已断开时返回False，不抛出异常"""
+        try:
+            await websocket.send_json(payload)
+            return True
+        except (WebSocketDisconnect, RuntimeError) as e:
+            print(f"实时连接已断开，停止推送 (会话: {session.session_id}): {e}")
+            return False
+
+    async def send_error(message) -> bool:
+        return await send({
+            'type': 'error',
+            'status': 'error',
+            'message': message,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    stale_sensor = None
+
+    def fresh_sensor(sensor):
+        """分析时检查最近一次传感器读数是否过期（按服务器收到读数的时间），过期的读数只记录一次日志"""
+        nonlocal stale_sensor
+        if not sensor:
+            return None
+        if is_sensor_fresh(sensor, api_server.Config.SENSOR_MAX_AGE_SECONDS):
+            return sensor
+        if stale_sensor is not sensor:
+            stale_sensor = sensor
+            print(f"传感器读数已过期（{sensor_age(sensor):.1f}秒前收到），改用画面检测，"
+                  f"直到收到新的读数 (会话: {session.session_id})")
+        return None
+
+    async def analysis_loop():
+        """依次分析槽位中的最新帧，并推送结果；推送失败（客户端已断开）时关闭槽位并退出"""
+        try:
+            await analyze_frames()
+        finally:
+            slot.close()
+
+    async def analyze_frames():
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                return
+            photography_agent = api_server.photography_agent
+            if not photography_agent:
+                if not await send_error('摄影代理未初始化'):
+                    return
+                continue
+
+            session.touch()  # 长连接期间保持会话活跃，避免被TTL清理
+            start_time = datetime.now()
+            try:
+                guidance = json.loads(await photography_agent.get_guidance_async(
+                    frame['image_bytes'], mode=frame['options'].get('mode'), session=session,
+                    sensor=fresh_sensor(frame['options'].get('sensor'))
+                ))
+            except Exception as e:
+                print(f"实时分析错误: {e}")
+                traceback.print_exc()
+                if not await send_error(f'服务器内部错误: {str(e)}'):
+                    return
+                continue
+
+            processing_time = (datetime.now() - start_time).total_seconds()
+            print(f"Live frame #{frame['frame_id']} analyzed in {processing_time:.2f}s "
+                  f"(dropped so far: {slot.dropped_count})")
+            sent = await send({
+                'type': 'guidance',
+                'status': 'success',
+                'data': guidance,
+                'frame_id': frame['frame_id'],
+                'frames': slot.get_stats(),
+                'session_id': session.session_id,
+                'timestamp': datetime.now().isoformat()
+            })
+            if not sent:
+                return
+
+    async def handle_control(text):
+        """处理文本控制消息"""
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError:
+            await send_error('控制消息必须是JSON格式')
+            return
+        if not isinstance(message, dict):
+            await send_error('控制消息必须是JSON对象')
+            return
+
+        message_type = message.get('type')
+        if message_type == 'config':
+            mode, mode_error = api_server.resolve_llm_mode(message.get('mode'))
+            if mode_error:
+                await send_error(mode_error)
+                return
+            options['mode'] = mode
+            await send({'type': 'config', 'mode': mode, 'session_id': session.session_id})
+        elif message_type == 'intent':
+            intent = str(message.get('intent', '')).strip()
+            if not intent:
+                await send_error('请提供拍摄意图')
+                return
+            response_message = session.set_photography_intent(intent)
+            await send({
+                'type': 'intent',
+                'intent': intent,
+                'ai_response': response_message,
+                'session_id': session.session_id
+            })
+        elif message_type == 'sensor':
+            sensor, sensor_error = api_server.parse_sensor_data(
+                message.get('roll'), message.get('pitch'), message.get('timestamp')
+            )
+            if sensor_error:
+                await send_error(sensor_error)
+                return
+            options['sensor'] = sensor
+        elif message_type == 'ping':
+            await send({'type': 'pong', 'frames': slot.get_stats()})
+        else:
+            await send_error(f'未知的控制消息类型: {message_type}')
+
+    worker = asyncio.create_task(analysis_loop())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes') is not None:
+                image_bytes = message['bytes']
+                if len(image_bytes) > api_server.MAX_UPLOAD_SIZE:
+                    await send_error('上传文件过大，请压缩后重试')
+                    continue
+                slot.put(image_bytes, options)
+            elif message.get('text') is not None:
+                await handle_control(message['text'])
+            if worker.done():
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        slot.close()
+        worker.cancel()
+        # 等待分析任务结束并取出其异常，避免任务在连接关闭后残留或出现“异常未被获取”的警告
+        result, = await asyncio.gather(worker, return_exceptions=True)
+        if isinstance(result, Exception):
+            print(f"实时分析任务异常退出 (会话: {session.session_id}): {result}")
+        stats = slot.get_stats()
+        print(f"LIVE CAMERA DISCONNECTED - Session: {session.session_id}, "
+              f"received {stats['received_frames']}, analyzed {stats['processed_frames']}, "
+              f"dropped {stats['dropped_frames']}")
+
+
+async def health_check(request):
+    """健康检查（不经过WSGI线程池；缓存统计会查询SQLite，放到线程中执行避免阻塞事件循环）"""
+    return JSONResponse(await asyncio.to_thread(api_server.health_payload))
+
+
+async def get_circuit_breakers(request):
+    """熔断器状态（只读内存中的状态，不经过WSGI线程池）"""
+    payload, status_code = api_server.circuit_breaker_payload()
+    return JSONResponse(payload, status_code=status_code)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """启动时初始化摄影代理（每个worker进程各自初始化）"""
+    if not api_server.photography_agent and not api_server.init_agent():
+        raise RuntimeError("摄影代理初始化失败")
+    print("SUCCESS: Photography agent initialized (async server)")
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/api/analyze', analyze_image, methods=['POST']),
+        Route('/api/analyze/stream', analyze_image_stream, methods=['POST']),
+        WebSocketRoute('/api/ws/camera', camera_websocket),
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/circuit-breakers', get_circuit_breakers, methods=['GET']),
+        # 其余接口（统计、会话、语音等）仍由Flask处理
+        Mount('/', app=WSGIMiddleware(api_server.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+会话历史图片的共享存储
+历史消息不再各自保存base64字符串，而是保存图片的引用键（内容的SHA-256和代数），原始字节（比base64小约1/4）
+统一存放在进程内共享的 BlobStore 中：
+
+- 按内容寻址：相同的图片（例如多个会话中由同一帧生成的缩略图）只保存一份
+- 引用计数：历史消息写入图片时 put（引用+1），图片被降级、消息被截断或会话被清理时 release（引用-1），
+  引用归零的图片立即释放
+- 字节预算：总字节数超出 max_bytes 时按最近使用顺序淘汰最久未使用的图片（即使仍被引用），
+  引用它的历史消息发送时退化为纯文字
+- 代数：put 返回的键是 内容哈希:代数，每次新存入（包括被淘汰后再次存入）代数加一。
+  被淘汰的图片的旧引用 release 时被忽略，不会减掉之后重新存入的同一图片的引用
+- base64编码在构建请求时才进行（见 ConversationHistory.messages）
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class BlobStore:
+    """按内容寻址、引用计数、有字节上限的图片存储（线程安全）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # 内容哈希 -> [字节, 引用计数, 代数]，按最近使用顺序排列（最旧的在前）
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self._generation = 0
+
+        # 统计信息
+        self.puts = 0
+        self.dedup_hits = 0
+        self.evicted = 0
+
+    def put(self, data: bytes) -> str:
+        """保存图片并增加引用，返回引用键（内容哈希:代数）"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.puts += 1
+            entry = self._blobs.get(digest)
+            if entry is not None:
+                entry[1] += 1
+                self._blobs.move_to_end(digest)
+                self.dedup_hits += 1
+                return f"{digest}:{entry[2]}"
+
+            self._generation += 1
+            self._blobs[digest] = [data, 1, self._generation]
+            self.total_bytes += len(data)
+            self._evict_over_budget(keep=digest)
+            return f"{digest}:{self._generation}"
+
+    @staticmethod
+    def _parse(key: str) -> tuple:
+        digest, generation = key.rsplit(':', 1)
+        return digest, int(generation)
+
+    def _entry(self, key: str):
+        """键对应的当前存储项；图片已被淘汰、或淘汰后重新存入（代数不同）时返回None（调用方持有锁）"""
+        digest, generation = self._parse(key)
+        entry = self._blobs.get(digest)
+        return entry if entry is not None and entry[2] == generation else None
+
+    def get(self, key: str):
+        """获取图片字节，已被淘汰时返回None（淘汰后重新存入的相同内容也可以读到）"""
+        digest, _ = self._parse(key)
+        with self._lock:
+            entry = self._blobs.get(digest)
+            if entry is None:
+                return None
+            self._blobs.move_to_end(digest)
+            return entry[0]
+
+    def release(self, key: str):
+        """减少引用，引用归零时释放图片（图片已被淘汰的旧引用直接忽略）"""
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._blobs[self._parse(key)[0]]
+                self.total_bytes -= len(entry[0])
+
+    def shared_size(self, key: str) -> float:
+        """按引用数分摊到每个引用的字节数（估算单个会话占用的内存；旧引用不再占用）"""
+        with self._lock:
+            entry = self._entry(key)
+            return len(entry[0]) / entry[1] if entry else 0
+
+    def _evict_over_budget(self, keep: str):
+        while self.total_bytes > self.max_bytes and len(self._blobs) > 1:
+            digest, entry = next(iter(self._blobs.items()))
+            if digest == keep:
+                self._blobs.move_to_end(digest)
+                continue
+            del self._blobs[digest]
+            self.total_bytes -= len(entry[0])
+            self.evicted += 1
+
+    def get_stats(self):
+        """获取存储统计信息"""
+        with self._lock:
+            references = sum(entry[1] for entry in self._blobs.values())
+            return {
+                'blobs': len(self._blobs),
+                'references': references,
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'puts': self.puts,
+                'dedup_hits': self.dedup_hits,
+                'evicted': self.evicted
+            }
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+AI缓存持久化后端
+PerceptualCache 在内存中做近似查找（L1），后端负责持久化和多进程共享：
+- sqlite: 默认后端，WAL模式的嵌入式数据库，多个worker进程可同时读写同一个文件；
+  写入先合并到内存队列，由后台线程定期批量提交，请求线程不等待磁盘IO。
+  近似查找与 PerceptualCache 相同，使用多索引哈希：每条记录的哈希分段写入带索引的 cache_bands 表，
+  查询时只取出与查询哈希某一段相同的候选记录计算汉明距离，不遍历整个命名空间
+- memory: 不持久化（测试或临时运行）
+"""
+
+import json
+import time
+import atexit
+import sqlite3
+import threading
+
+from perceptual_cache import hamming_distance, hash_blocks
+
+# TTL清理和LRU裁剪的最小间隔（秒）：不在每次批量写入时都做，裁剪期间条数可能短暂超出上限
+MAINTENANCE_INTERVAL = 30.0
+
+
+def signed_int64(value: int) -> int:
+    """把无符号的段值转换为SQLite INTEGER能保存的有符号64位整数（只有一段时段值可能超过2^63）"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class MemoryCacheBackend:
+    """不持久化的空后端"""
+
+    name = 'memory'
+
+    def load_recent(self, limit: int, min_timestamp: float) -> list:
+        return []
+
+    def find(self, namespace: str, phash: int, max_distance: int, min_timestamp: float):
+        return None
+
+    def put(self, record: dict):
+        pass
+
+    def touch(self, namespace: str, phash: int):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+
+class SQLiteCacheBackend:
+    """SQLite缓存后端：哈希分段和访问时间都建立索引，支持TTL清理和按条数的LRU裁剪，写入由后台线程合并提交
+
+    max_distance 决定哈希的分段方式（与 PerceptualCache 的阈值相同），查询时的阈值不能超过它。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float, max_distance: int = 6,
+                 flush_interval: float = 1.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.flush_interval = flush_interval
+        self._blocks = hash_blocks(max_distance)
+        self._last_maintenance = 0.0
+
+        # 待写入的记录和访问时间更新，同一个键只保留最后一次（合并写入）
+        self._pending_puts = {}
+        self._pending_touches = {}
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # 读连接供请求线程使用（加锁串行化），写连接只在后台线程中使用
+        self._read_conn = self._connect()
+        self._read_lock = threading.Lock()
+        self._init_schema()
+
+        self.flush_count = 0
+        self.written_count = 0
+
+        self._writer = threading.Thread(target=self._writer_loop, name="cache-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        """打开连接：WAL模式允许多进程并发读、单写，busy_timeout避免写锁冲突直接报错"""
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        # 删除或覆盖记录时级联删除它的哈希分段
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def _init_schema(self):
+        with self._read_lock, self._read_conn:
+            self._read_conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    phash TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, phash)
+                )
+            ''')
+            self._read_conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)'
+            )
+            self._read_conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_cache_created ON cache_entries (created_at)'
+            )
+            self._read_conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_bands (
+                    namespace TEXT NOT NULL,
+                    band INTEGER NOT NULL,
+                    value INTEGER NOT NULL,
+                    phash TEXT NOT NULL,
+                    PRIMARY KEY (namespace, band, value, phash),
+                    FOREIGN KEY (namespace, phash) REFERENCES cache_entries (namespace, phash) ON DELETE CASCADE
+                ) WITHOUT ROWID
+            ''')
+            # 级联删除按记录查找分段
+            self._read_conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_bands_entry ON cache_bands (namespace, phash)'
+            )
+            self._read_conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+            )
+            row = self._read_conn.execute("SELECT value FROM cache_meta WHERE key = 'band_distance'").fetchone()
+            if row is None or int(row[0]) != self.max_distance:
+                # 首次使用或阈值变化：按新的分段方式重建（旧版本数据库没有分段表时也在这里补齐）
+                self._read_conn.execute('DELETE FROM cache_bands')
+                entries = self._read_conn.execute('SELECT namespace, phash FROM cache_entries').fetchall()
+                self._read_conn.executemany(
+                    'INSERT OR IGNORE INTO cache_bands (namespace, band, value, phash) VALUES (?, ?, ?, ?)',
+                    [band for namespace, phash in entries for band in self._band_rows(namespace, phash)]
+                )
+                self._read_conn.execute(
+                    "INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('band_distance', ?)",
+                    (str(self.max_distance),)
+                )
+
+    def _band_values(self, phash: int) -> list:
+        """哈希各段的 (段序号, 段值)"""
+        return [(i, signed_int64((phash >> offset) & mask)) for i, (offset, mask) in enumerate(self._blocks)]
+
+    def _band_rows(self, namespace: str, phash: str) -> list:
+        """记录（phash为16位十六进制字符串）在分段表中的行"""
+        return [(namespace, band, value, phash) for band, value in self._band_values(int(phash, 16))]
+
+    def load_recent(self, limit: int, min_timestamp: float) -> list:
+        """读取最近访问的未过期记录（按访问时间从旧到新，便于按顺序放入LRU）"""
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                'SELECT namespace, phash, result, created_at FROM cache_entries '
+                'WHERE created_at >= ? ORDER BY accessed_at DESC LIMIT ?',
+                (min_timestamp, limit)
+            ).fetchall()
+        return [self._row_to_record(row) for row in reversed(rows)]
+
+    def find(self, namespace: str, phash: int, max_distance: int, min_timestamp: float):
+        """在同一命名空间中查找汉明距离最近的记录（L1未命中时使用，可读到其他worker写入的结果）
+
+        只取出与查询哈希至少一段相同的候选记录（max_distance 不超过分段用的阈值时不会漏掉）
+        """
+        bands = self._band_values(phash)
+        # 每段一个走主键的等值查询（写成 OR 时SQLite只用到命名空间前缀，会扫描整个命名空间）
+        band_queries = ' UNION '.join(['SELECT phash FROM cache_bands WHERE namespace = ? AND band = ? AND value = ?']
+                                      * len(bands))
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                'SELECT namespace, phash, result, created_at FROM cache_entries '
+                f'WHERE namespace = ? AND created_at >= ? AND phash IN ({band_queries})',
+                [namespace, min_timestamp] + [item for band, value in bands for item in (namespace, band, value)]
+            ).fetchall()
+
+        best_row, best_distance = None, None
+        for row in rows:
+            distance = hamming_distance(phash, int(row[1], 16))
+            if distance <= max_distance and (best_distance is None or distance < best_distance):
+                best_row, best_distance = row, distance
+        return self._row_to_record(best_row) if best_row else None
+
+    def _row_to_record(self, row) -> dict:
+        namespace, phash, result, created_at = row
+        return {'namespace': namespace, 'phash': phash, 'result': json.loads(result), 'timestamp': created_at}
+
+    def put(self, record: dict):
+        """排队写入一条记录（phash为16位十六进制字符串；立即返回，由后台线程提交）"""
+        with self._pending_lock:
+            self._pending_puts[(record['namespace'], record['phash'])] = record
+
+    def touch(self, namespace: str, phash: int):
+        """排队更新访问时间（LRU裁剪依据）"""
+        with self._pending_lock:
+            self._pending_touches[(namespace, f"{phash:016x}")] = time.time()
+
+    def _writer_loop(self):
+        """后台写线程：每隔 flush_interval 把这段时间内的写入合并到一个事务提交"""
+        conn = self._connect()
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._flush_pending(conn)
+            self._flush_pending(conn)
+        finally:
+            conn.close()
+
+    def _flush_pending(self, conn, maintain: bool = False):
+        """把待写入的记录和访问时间在一个事务中提交；距上次清理超过 MAINTENANCE_INTERVAL
+        （或 maintain 为True）时顺便清理过期和超出条数的记录"""
+        with self._pending_lock:
+            puts, self._pending_puts = self._pending_puts, {}
+            touches, self._pending_touches = self._pending_touches, {}
+        if not puts and not touches and not maintain:
+            return
+
+        now = time.time()
+        maintain = maintain or now - self._last_maintenance >= MAINTENANCE_INTERVAL
+        try:
+            with conn:
+                if puts:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO cache_entries (namespace, phash, result, created_at, accessed_at) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [
+                            (namespace, phash, json.dumps(record['result'], ensure_ascii=False),
+                             record['timestamp'], record['timestamp'])
+                            for (namespace, phash), record in puts.items()
+                        ]
+                    )
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO cache_bands (namespace, band, value, phash) VALUES (?, ?, ?, ?)',
+                        [band for namespace, phash in puts for band in self._band_rows(namespace, phash)]
+                    )
+                if touches:
+                    conn.executemany(
+                        'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND phash = ?',
+                        [(accessed_at, namespace, phash) for (namespace, phash), accessed_at in touches.items()]
+                    )
+                if maintain:
+                    self._maintain(conn, now)
+            self.flush_count += 1
+            self.written_count += len(puts)
+        except sqlite3.Error as e:
+            print(f"缓存写入失败: {e}")
+
+    def _maintain(self, conn, now: float):
+        """TTL清理和LRU裁剪：先从 accessed_at 索引取出第 max_entries 新的访问时间，再删除更早访问的记录
+        （访问时间相同的记录一起保留；分段随记录级联删除）"""
+        conn.execute('DELETE FROM cache_entries WHERE created_at < ?', (now - self.ttl_seconds,))
+        row = conn.execute(
+            'SELECT accessed_at FROM cache_entries ORDER BY accessed_at DESC LIMIT 1 OFFSET ?',
+            (max(self.max_entries - 1, 0),)
+        ).fetchone()
+        if row is not None:
+            conn.execute('DELETE FROM cache_entries WHERE accessed_at < ?', (row[0],))
+        self._last_maintenance = now
+
+    def flush(self):
+        """立即提交待写入的数据并清理过期和超出条数的记录（同步执行，使用独立连接）"""
+        conn = self._connect()
+        try:
+            self._flush_pending(conn, maintain=True)
+        finally:
+            conn.close()
+
+    def close(self):
+        """停止后台线程并提交剩余写入"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._writer.join(timeout=5)
+
+    def get_stats(self):
+        with self._read_lock:
+            stored = self._read_conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        with self._pending_lock:
+            pending = len(self._pending_puts)
+        return {
+            'backend': self.name,
+            'path': self.path,
+            'stored_entries': stored,
+            'pending_writes': pending,
+            'flushes': self.flush_count,
+            'written_entries': self.written_count
+        }
+
+
+def create_cache_backend(name: str, path: str, max_entries: int, ttl_seconds: float, max_distance: int = 6,
+                         flush_interval: float = 1.0):
+    """按名称创建缓存后端（sqlite / memory）"""
+    if name == 'memory':
+        return MemoryCacheBackend()
+    if name == 'sqlite':
+        return SQLiteCacheBackend(path, max_entries, ttl_seconds, max_distance, flush_interval)
+    raise ValueError(f"不支持的缓存后端: {name}")
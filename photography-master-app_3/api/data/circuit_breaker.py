@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+模型调用熔断器
+上游模型服务变慢或出错时，如果每一帧都等到超时才退回本地建议，线程池和连接池会被注定失败的请求占满，
+健康检查等接口也随之变慢。熔断器按 (模型, 调用类型) 分别统计最近一段时间的调用结果：
+
+- closed（正常）：记录每次调用的成功/失败和延迟；时间窗口内调用数达到 min_requests，
+  且错误率或慢调用比例超过阈值时转为 open
+- open（熔断）：直接拒绝调用（抛出 CircuitOpenError），调用方立即使用本地建议；open_seconds 后转为 half_open
+- half_open（探测）：只放行 half_open_probes 个探测请求，探测全部成功转为 closed，任一失败重新转为 open；
+  探测请求被调用方取消（如客户端断开）时既不算成功也不算失败，归还探测名额（abandon）
+
+状态转换记录在最近的转换列表中，通过 /api/circuit-breakers 查看或手动重置。
+"""
+
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 每个熔断器保留的最近状态转换记录数
+RECENT_TRANSITIONS = 20
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"熔断器 {name} 已打开，{retry_after:.1f}秒后探测恢复")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个 (模型, 调用类型) 的熔断器（线程安全）"""
+
+    def __init__(self, name: str, window_seconds: float = 30.0, min_requests: int = 10,
+                 error_rate_threshold: float = 0.5, slow_call_seconds: float = 8.0,
+                 slow_rate_threshold: float = 0.8, open_seconds: float = 15.0, half_open_probes: int = 2):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = None
+        self._state_since = time.time()
+        self._outcomes = deque()  # (时间, 是否失败, 是否慢调用)
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self.transitions = deque(maxlen=RECENT_TRANSITIONS)
+
+        # 统计信息
+        self.rejected = 0
+
+    def allow(self):
+        """检查是否允许调用；熔断时抛出 CircuitOpenError"""
+        with self._lock:
+            now = time.time()
+            if self.state == OPEN:
+                if now - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.open_seconds - (now - self.opened_at))
+                self._transition(HALF_OPEN, '熔断时间已到，开始探测')
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.half_open_probes:
+                    if now - self._state_since < self.open_seconds:
+                        self.rejected += 1
+                        raise CircuitOpenError(self.name, 0.0)
+                    # 探测请求长时间没有结果（如流式请求被客户端中断），重新放行探测
+                    self._probes_started = 0
+                    self._state_since = now
+                self._probes_started += 1
+
+    def abandon(self):
+        """已放行的调用被调用方取消（如客户端断开）：不计入成功或失败，half_open 时归还探测名额"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes_started > 0:
+                self._probes_started -= 1
+
+    def rejecting(self) -> bool:
+        """当前是否处于熔断时间内（只读，不改变状态；调用方可据此跳过准备请求的开销）"""
+        with self._lock:
+            return self.state == OPEN and time.time() - self.opened_at < self.open_seconds
+
+    def record(self, success: bool, latency: float = None):
+        """记录一次调用结果"""
+        with self._lock:
+            now = time.time()
+            if self.state == HALF_OPEN:
+                if not success:
+                    self._transition(OPEN, '探测请求失败')
+                    return
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_probes:
+                    self._transition(CLOSED, '探测请求全部成功')
+                return
+            if self.state == OPEN:
+                # 熔断前已经发出的请求，结果不再计入
+                return
+
+            slow = latency is not None and latency >= self.slow_call_seconds
+            self._outcomes.append((now, not success, slow))
+            self._prune(now)
+            self._check_thresholds()
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _rates(self):
+        total = len(self._outcomes)
+        if not total:
+            return 0.0, 0.0
+        errors = sum(1 for _, failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+        return errors / total, slow / total
+
+    def _check_thresholds(self):
+        if len(self._outcomes) < self.min_requests:
+            return
+        error_rate, slow_rate = self._rates()
+        if error_rate >= self.error_rate_threshold:
+            self._transition(OPEN, f"错误率 {error_rate:.0%} 超过阈值")
+        elif slow_rate >= self.slow_rate_threshold:
+            self._transition(OPEN, f"慢调用比例 {slow_rate:.0%} 超过阈值")
+
+    def _transition(self, state: str, reason: str):
+        previous = self.state
+        self.state = state
+        self._state_since = time.time()
+        if state == OPEN:
+            self.opened_at = self._state_since
+        if state in (OPEN, HALF_OPEN):
+            self._probes_started = 0
+            self._probes_succeeded = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+            self.opened_at = None
+        self.transitions.append({'from': previous, 'to': state, 'reason': reason, 'time': self._state_since})
+        print(f"熔断器 {self.name}: {previous} -> {state} ({reason})")
+
+    def reset(self):
+        """手动重置为closed"""
+        with self._lock:
+            if self.state != CLOSED:
+                self._transition(CLOSED, '手动重置')
+            self._outcomes.clear()
+
+    def get_stats(self):
+        """获取熔断器状态"""
+        with self._lock:
+            self._prune(time.time())
+            error_rate, slow_rate = self._rates()
+            retry_after = None
+            if self.state == OPEN:
+                retry_after = round(max(0.0, self.open_seconds - (time.time() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'window_requests': len(self._outcomes),
+                'error_rate': round(error_rate, 3),
+                'slow_rate': round(slow_rate, 3),
+                'retry_after': retry_after,
+                'rejected': self.rejected,
+                'transitions': list(self.transitions)
+            }
+
+
+class CircuitBreakerRegistry:
+    """按名称（模型:调用类型）创建和查找熔断器"""
+
+    def __init__(self, enabled: bool = True, **settings):
+        self.enabled = enabled
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str, call_type: str) -> CircuitBreaker:
+        name = f"{model}:{call_type}"
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, **self.settings)
+            return breaker
+
+    def reset(self, name: str = None) -> bool:
+        """重置指定熔断器（name为空时重置全部），找不到时返回False"""
+        with self._lock:
+            breakers = list(self._breakers.values()) if name is None else [self._breakers.get(name)]
+        if None in breakers:
+            return False
+        for breaker in breakers:
+            breaker.reset()
+        return True
+
+    def get_stats(self):
+        """获取所有熔断器的状态"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            'enabled': self.enabled,
+            'settings': self.settings,
+            'breakers': {name: breaker.get_stats() for name, breaker in breakers.items()}
+        }
@@ -4,6 +4,12 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+
+def model_list(value: str) -> list:
+    """解析逗号分隔的模型列表（去掉空白和空项）"""
+    return [model.strip() for model in value.split(',') if model.strip()]
+
+
 class Config:
     # OpenRouter API 配置
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
@@ -18,14 +24,132 @@ class Config:
     MAX_TOKENS = 300  # 进一步减少token数量
     TEMPERATURE = 1.0  # 提高创造性，避免过于保守
     
+    # AI调用模式: two_call（水平检查和建议分两次请求）/ combined（一次请求同时返回）/ local（不调用模型，本地规则生成建议）
+    LLM_MODES = ('two_call', 'combined', 'local')
+    LLM_MODE = os.getenv('LLM_MODE', 'two_call')
+    LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', '16'))  # 并发AI请求的线程数
+    
+    # 模型调用网关（见 llm_gateway.py）：共享的keep-alive连接池、按调用类型的参数、响应缓存
+    LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', '32'))
+    LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', '16'))
+    LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv('LLM_POOL_KEEPALIVE_EXPIRY', '60'))  # 空闲连接保活时间（秒）
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+    LLM_RESPONSE_CACHE_ENTRIES = int(os.getenv('LLM_RESPONSE_CACHE_ENTRIES', '256'))  # 完全相同请求的响应缓存条数
+    LLM_RESPONSE_CACHE_TTL = float(os.getenv('LLM_RESPONSE_CACHE_TTL', '60'))
+    # 每种调用类型的请求参数；timeout 为单次尝试的超时，deadline 为包含重试和对冲的总时间
+    LLM_CALL_PROFILES = {
+        'level': {'max_tokens': 10, 'temperature': 0.1,  # 只需要一个词，降低随机性确保回答稳定
+                  'timeout': float(os.getenv('LLM_LEVEL_TIMEOUT', '6')),
+                  'deadline': float(os.getenv('LLM_LEVEL_DEADLINE', '8'))},
+        'suggestions': {'max_tokens': 350, 'temperature': 0.7,
+                        'timeout': float(os.getenv('LLM_SUGGESTIONS_TIMEOUT', '10')),
+                        'deadline': float(os.getenv('LLM_SUGGESTIONS_DEADLINE', '12'))},
+        'combined': {'max_tokens': 400, 'temperature': 0.7,  # 比单独的建议请求多留出水平字段的空间
+                     'timeout': float(os.getenv('LLM_COMBINED_TIMEOUT', '10')),
+                     'deadline': float(os.getenv('LLM_COMBINED_DEADLINE', '12'))},
+    }
+    # 模型路由（见 model_router.py）：每种调用类型按优先级排序的候选模型（逗号分隔），按观测到的延迟和错误率选择。
+    # 默认只使用 MODEL_NAME；需要时由运维显式加入其他候选模型，例如只需回答一个词的水平检查可以
+    # LLM_LEVEL_MODELS="google/gemini-2.0-flash-lite-001,<MODEL_NAME>"，把主模型的容量留给建议请求
+    LLM_ROUTES = {
+        'level': model_list(os.getenv('LLM_LEVEL_MODELS', MODEL_NAME)),
+        'suggestions': model_list(os.getenv('LLM_SUGGESTIONS_MODELS', MODEL_NAME)),
+        'combined': model_list(os.getenv('LLM_COMBINED_MODELS', MODEL_NAME)),
+    }
+    LLM_ROUTER_EXPLORE_RATE = float(os.getenv('LLM_ROUTER_EXPLORE_RATE', '0.05'))  # 改选其他候选模型以更新统计的请求比例
+    # 重试：带抖动的指数退避，剩余时间不足 LLM_MIN_ATTEMPT_SECONDS 时不再重试
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.25'))
+    LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '2'))
+    LLM_MIN_ATTEMPT_SECONDS = float(os.getenv('LLM_MIN_ATTEMPT_SECONDS', '1'))
+    # 对冲请求：超过最近成功请求的p95延迟时发出相同的第二个请求，先返回的生效
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'true').lower() == 'true'
+    LLM_HEDGE_QUANTILE = float(os.getenv('LLM_HEDGE_QUANTILE', '0.95'))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))  # 样本不足时不对冲
+    LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+    
+    # 熔断器（见 circuit_breaker.py）：按 模型:调用类型 统计最近的错误率和慢调用比例，超过阈值时直接使用本地建议
+    CIRCUIT_BREAKER_ENABLED = os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+    CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', '30'))  # 统计错误率的时间窗口
+    CIRCUIT_MIN_REQUESTS = int(os.getenv('CIRCUIT_MIN_REQUESTS', '10'))  # 窗口内调用数不足时不熔断
+    CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))  # 错误率阈值
+    CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', '8'))  # 超过该时间视为慢调用
+    CIRCUIT_SLOW_RATE = float(os.getenv('CIRCUIT_SLOW_RATE', '0.8'))  # 慢调用比例阈值
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '15'))  # 熔断多久后放行探测请求
+    CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', '2'))  # 探测成功多少次后恢复
+    
+    # 服务器配置: async（uvicorn + ASGI，异步等待AI响应）/ dev（Flask自带调试服务器）
+    SERVER_MODE = os.getenv('SERVER_MODE', 'async')
+    SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = int(os.getenv('SERVER_PORT', '5002'))
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1'))  # 会话保存在进程内存中，多进程时需客户端粘性路由
+    
     # Agent 配置
     MAX_ADVICE_ITEMS = 5
     PRIORITY_ADVICE_COUNT = 3
     
+    # 会话配置（每个客户端独立的消息历史和拍摄意图）
+    MAX_HISTORY_LENGTH = 10  # 每个会话保持最近10条消息
+    DEFAULT_SESSION_ID = "default"  # 客户端未提供会话ID时使用
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '1800'))  # 会话闲置30分钟后过期
+    MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '1000'))
+    SESSION_MAX_TOTAL_BYTES = int(os.getenv('SESSION_MAX_TOTAL_BYTES', str(256 * 1024 * 1024)))  # 所有会话总内存上限
+    
+    # 会话历史预算（见 conversation_history.py）
+    HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '3000'))  # 每次请求附带的历史消息估算token上限
+    HISTORY_MAX_IMAGE_BYTES = int(os.getenv('HISTORY_MAX_IMAGE_BYTES', str(128 * 1024)))  # 每个会话历史图片的总字节上限
+    HISTORY_FULL_IMAGE_TURNS = int(os.getenv('HISTORY_FULL_IMAGE_TURNS', '1'))  # 保留原图的最近画面轮数
+    HISTORY_THUMBNAIL_TURNS = int(os.getenv('HISTORY_THUMBNAIL_TURNS', '2'))  # 之后保留缩略图的轮数，更早的只保留文字摘要
+    HISTORY_THUMBNAIL_SIDE = int(os.getenv('HISTORY_THUMBNAIL_SIDE', '192'))  # 缩略图最长边（像素）
+    HISTORY_BLOB_STORE_MAX_BYTES = int(os.getenv('HISTORY_BLOB_STORE_MAX_BYTES', str(64 * 1024 * 1024)))  # 所有会话共享的历史图片存储上限
+    
+    # AI建议缓存配置（按画面感知哈希查找近似重复帧）
+    CACHE_PHASH_MAX_DISTANCE = int(os.getenv('CACHE_PHASH_MAX_DISTANCE', '6'))  # 64位dHash允许的最大汉明距离
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '500'))
+    CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', '86400'))  # 24小时
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')  # sqlite（持久化，多进程共享）/ memory
+    CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai_cache.db'))
+    CACHE_FLUSH_INTERVAL = float(os.getenv('CACHE_FLUSH_INTERVAL', '1.0'))  # 后台合并写入的间隔（秒）
+    
+    # 帧差门控（同一会话画面无明显变化时复用上次的建议）
+    FRAME_GATE_ENABLED = os.getenv('FRAME_GATE_ENABLED', 'true').lower() == 'true'
+    FRAME_GATE_DIFF_THRESHOLD = float(os.getenv('FRAME_GATE_DIFF_THRESHOLD', '0.04'))  # 32x32灰度缩略图平均像素差（0~1）
+    FRAME_GATE_TILT_THRESHOLD = float(os.getenv('FRAME_GATE_TILT_THRESHOLD', '1.0'))  # 倾斜角度变化（度）
+    FRAME_GATE_MAX_AGE_SECONDS = float(os.getenv('FRAME_GATE_MAX_AGE_SECONDS', '15'))  # 复用结果的最长时间
+    
+    # 水平检测配置
+    HORIZON_ENGINE = os.getenv('HORIZON_ENGINE', 'hough')  # hough（多尺度霍夫，更准）/ gradient（梯度方向直方图，更快）
+    HORIZON_MAX_SIDE = int(os.getenv('HORIZON_MAX_SIDE', '640'))  # 金字塔缩小后的最长边（粗检测分辨率）
+    HORIZON_LEVEL_TOLERANCE = float(os.getenv('HORIZON_LEVEL_TOLERANCE', '2.0'))  # 倾斜不超过该角度视为水平
+    
+    # 逐帧分析的解码尺寸（JPEG按 1/2、1/4、1/8 在DCT域缩小解码为灰度图）
+    ANALYSIS_REDUCED_DECODE = os.getenv('ANALYSIS_REDUCED_DECODE', 'true').lower() == 'true'
+    ANALYSIS_DECODE_TARGET_SIDE = int(os.getenv('ANALYSIS_DECODE_TARGET_SIDE', '1280'))  # 需要水平检测时的最小长边（HORIZON_MAX_SIDE的2倍用于精修）
+    ANALYSIS_DECODE_MIN_SIDE = int(os.getenv('ANALYSIS_DECODE_MIN_SIDE', '320'))  # 有传感器数据、不做水平检测时的最小长边（不低于清晰度的工作尺寸640）
+    SENSOR_MAX_AGE_SECONDS = float(os.getenv('SENSOR_MAX_AGE_SECONDS', '5'))  # 实时连接中最近一次传感器读数收到后超过该时间视为过期，改用画面检测
+    
+    # AI水平二次检查的级联策略（OpenCV认为水平时，能确定结果就跳过AI检查，见 level_cascade.py）
+    CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'true').lower() == 'true'
+    CASCADE_HIGH_CONFIDENCE = float(os.getenv('CASCADE_HIGH_CONFIDENCE', '0.7'))  # OpenCV置信度高于该值直接采用（线条清晰的画面hough约0.9~1.0，gradient约0.7）
+    CASCADE_MIN_CONFIDENCE = float(os.getenv('CASCADE_MIN_CONFIDENCE', '0.4'))  # 低于该值总是请求AI检查（画面中没有可用线条时置信度为0.3）
+    CASCADE_STABLE_FRAMES = int(os.getenv('CASCADE_STABLE_FRAMES', '3'))  # 连续水平的帧数
+    CASCADE_STABLE_MAX_SPREAD = float(os.getenv('CASCADE_STABLE_MAX_SPREAD', '0.5'))  # 连续帧倾斜角度的最大波动（度）
+    CASCADE_STABLE_WINDOW_SECONDS = float(os.getenv('CASCADE_STABLE_WINDOW_SECONDS', '10'))  # 连续帧的时间范围
+    CASCADE_AGREEMENT_WINDOW = int(os.getenv('CASCADE_AGREEMENT_WINDOW', '50'))  # 统计一致率的最近AI检查次数
+    CASCADE_AGREEMENT_THRESHOLD = float(os.getenv('CASCADE_AGREEMENT_THRESHOLD', '0.9'))  # AI与OpenCV一致率阈值
+    CASCADE_AGREEMENT_MIN_SAMPLES = int(os.getenv('CASCADE_AGREEMENT_MIN_SAMPLES', '20'))  # 计算一致率的最少样本数
+    CASCADE_AUDIT_INTERVAL = int(os.getenv('CASCADE_AUDIT_INTERVAL', '10'))  # 因一致率跳过时每隔多少次抽查一次AI
+    
     # 图片处理配置
     MAX_IMAGE_SIZE = (1920, 1080)  # 最大图片尺寸
     SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
     
+    # 发送给AI的图片（按请求类型缩小并重新编码，水平检查只需判断是否歪斜，用更小的图片）
+    IMAGE_PAYLOAD_LEVEL_MAX_SIDE = int(os.getenv('IMAGE_PAYLOAD_LEVEL_MAX_SIDE', '512'))  # 水平检查图片的最长边
+    IMAGE_PAYLOAD_LEVEL_QUALITY = int(os.getenv('IMAGE_PAYLOAD_LEVEL_QUALITY', '70'))  # 水平检查图片的JPEG质量
+    IMAGE_PAYLOAD_SUGGESTION_MAX_SIDE = int(os.getenv('IMAGE_PAYLOAD_SUGGESTION_MAX_SIDE', '1024'))  # 建议请求图片的最长边
+    IMAGE_PAYLOAD_SUGGESTION_QUALITY = int(os.getenv('IMAGE_PAYLOAD_SUGGESTION_QUALITY', '80'))  # 建议请求图片的JPEG质量
+    
     # 响应语言
     RESPONSE_LANGUAGE = "中文"
     
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+按预算管理的会话消息历史
+每次建议请求都会带上会话的历史消息。如果历史里保存完整的prompt和原图，请求会随会话变长而越来越大，
+模型延迟也随之增加。ConversationHistory 在写入和读取时都按预算控制历史大小：
+
+- 写入画面分析的一轮对话时，用户消息只保存简短的文字摘要（完整prompt在当前请求中已经发送），
+  新一轮建议与上一轮完全相同时不追加，只更新上一轮的画面（不增加上下文的轮次不保留）
+- 只有最近 full_image_turns 轮保留发送时的图片，之后 thumbnail_turns 轮缩小为缩略图，更早的只保留文字
+- 所有图片的总字节数超出 max_image_bytes 时，从最早的图片开始继续降级
+- 读取时从最新的消息往前取，估算的token数超出 token_budget 时丢弃更早的消息
+
+图片以原始字节保存在共享的 BlobStore 中（见 blob_store.py），历史消息只保存引用键，
+发送请求时才编码为base64
+"""
+
+import base64
+import math
+import re
+
+import cv2
+import numpy as np
+
+from image_features import image_size
+
+# 估算token时，图片每多少像素约为1个token，以及单张图片的上限
+IMAGE_PIXELS_PER_TOKEN = 750
+MAX_IMAGE_TOKENS = 1600
+
+# 缩略图的JPEG质量
+THUMBNAIL_QUALITY = 60
+
+CJK_PATTERN = re.compile(r'[　-鿿＀-￯]')
+
+
+def estimate_text_tokens(text: str) -> int:
+    """估算文字的token数：中文约1字1个token，其他字符约4个1个token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """按像素数估算图片的token数"""
+    return min(math.ceil(width * height / IMAGE_PIXELS_PER_TOKEN), MAX_IMAGE_TOKENS)
+
+
+def make_thumbnail(image_bytes: bytes, max_side: int):
+    """把图片缩小为JPEG缩略图，返回 (字节, 宽, 高)，失败时返回None"""
+    try:
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        height, width = image.shape[:2]
+        scale = min(1.0, max_side / max(width, height))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        thumbnail = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', thumbnail, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        if not ok:
+            return None
+        return encoded.tobytes(), size[0], size[1]
+    except Exception:
+        return None
+
+
+class ConversationHistory:
+    """单个会话的消息历史（调用方负责加锁）"""
+
+    def __init__(self, blob_store, max_messages: int, token_budget: int, max_image_bytes: int,
+                 full_image_turns: int, thumbnail_turns: int, thumbnail_side: int):
+        self.blob_store = blob_store
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.max_image_bytes = max_image_bytes
+        self.full_image_turns = full_image_turns
+        self.thumbnail_turns = thumbnail_turns
+        self.thumbnail_side = thumbnail_side
+
+        self._turns = []
+
+        # 统计信息
+        self.skipped_exchanges = 0
+        self.degraded_images = 0
+
+    def __len__(self):
+        return len(self._turns)
+
+    def add(self, role: str, text: str, image_bytes: bytes = None, summary: str = None):
+        """追加一条消息；summary 为图片降级为纯文字后使用的摘要"""
+        turn = {'role': role, 'text': text, 'summary': summary, 'image': None, 'image_kind': None,
+                'image_size': None, 'image_bytes': 0, 'tokens': 0}
+        if image_bytes:
+            self._set_image(turn, image_bytes, 'full')
+        self._update_tokens(turn)
+        self._turns.append(turn)
+
+        # 限制历史记录长度
+        if len(self._turns) > self.max_messages:
+            for dropped in self._turns[:-self.max_messages]:
+                self._release_image(dropped)
+            self._turns = self._turns[-self.max_messages:]
+        self._enforce_image_budget()
+
+    def add_exchange(self, prompt_summary: str, image_bytes: bytes, response_text: str) -> bool:
+        """追加一轮画面分析（用户画面 + AI建议），返回是否追加
+
+        与上一轮的AI回复完全相同时说明这一轮没有带来新的上下文，只把上一轮的画面换成最新一帧
+        """
+        last_reply = self._turns[-1] if self._turns else None
+        if (last_reply and last_reply['role'] == 'assistant' and len(self._turns) >= 2
+                and last_reply['text'].strip() == response_text.strip()
+                and self._turns[-2]['image_kind'] is not None):
+            self._set_image(self._turns[-2], image_bytes, 'full')
+            self._turns[-2]['text'] = prompt_summary
+            self._update_tokens(self._turns[-2])
+            self.skipped_exchanges += 1
+            self._enforce_image_budget()
+            return False
+
+        self.add('user', prompt_summary, image_bytes, summary=prompt_summary)
+        self.add('assistant', response_text)
+        return True
+
+    def _set_image(self, turn: dict, image_bytes: bytes, kind: str, size=None):
+        """把图片存入共享存储，消息只保存引用键（替换原有图片时释放其引用）"""
+        key = self.blob_store.put(image_bytes)
+        self._release_image(turn)
+        turn['image'] = key
+        turn['image_kind'] = kind
+        turn['image_size'] = size or image_size(image_bytes)
+        turn['image_bytes'] = len(image_bytes)
+
+    def _release_image(self, turn: dict):
+        if turn['image']:
+            self.blob_store.release(turn['image'])
+        turn['image'] = turn['image_kind'] = turn['image_size'] = None
+        turn['image_bytes'] = 0
+
+    def _update_tokens(self, turn: dict):
+        tokens = estimate_text_tokens(turn['text'])
+        if turn['image']:
+            tokens += estimate_image_tokens(*turn['image_size']) if turn['image_size'] else MAX_IMAGE_TOKENS
+        turn['tokens'] = tokens
+
+    def _degrade(self, turn: dict):
+        """把一条消息的图片降一级：原图 → 缩略图 → 纯文字摘要"""
+        image_bytes = self.blob_store.get(turn['image'])
+        thumbnail = None
+        if turn['image_kind'] == 'full' and image_bytes:
+            thumbnail = make_thumbnail(image_bytes, self.thumbnail_side)
+        if thumbnail:
+            self._set_image(turn, thumbnail[0], 'thumbnail', size=thumbnail[1:])
+        else:
+            self._release_image(turn)
+            if turn['summary']:
+                turn['text'] = turn['summary']
+        self._update_tokens(turn)
+        self.degraded_images += 1
+
+    def _enforce_image_budget(self):
+        """按轮次和总字节数降级较早的图片"""
+        image_turns = [turn for turn in reversed(self._turns) if turn['image']]
+        for age, turn in enumerate(image_turns):
+            if age >= self.full_image_turns and turn['image_kind'] == 'full':
+                self._degrade(turn)
+            if age >= self.full_image_turns + self.thumbnail_turns and turn['image']:
+                self._degrade(turn)
+
+        # 总字节数超出预算时从最早的图片开始继续降级
+        for turn in self._turns:
+            if self.image_bytes() <= self.max_image_bytes:
+                break
+            while turn['image'] and self.image_bytes() > self.max_image_bytes:
+                self._degrade(turn)
+
+    def image_bytes(self) -> int:
+        """历史中所有图片的字节数"""
+        return sum(turn['image_bytes'] for turn in self._turns)
+
+    def messages(self, token_budget: int = None) -> list:
+        """构建发送给模型的历史消息：从最新的消息往前取，直到估算的token数超出预算"""
+        budget = self.token_budget if token_budget is None else token_budget
+        selected, total = [], 0
+        for turn in reversed(self._turns):
+            if total + turn['tokens'] > budget:
+                break
+            total += turn['tokens']
+            selected.append(self._to_message(turn))
+        selected.reverse()
+        return selected
+
+    def _to_message(self, turn: dict) -> dict:
+        # 图片可能已因存储的字节上限被淘汰，此时只发送文字（有摘要时用摘要）
+        image_bytes = self.blob_store.get(turn['image']) if turn['image'] else None
+        if not image_bytes:
+            text = turn['summary'] if turn['image'] and turn['summary'] else turn['text']
+            return {'role': turn['role'], 'content': text}
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
+        return {
+            'role': turn['role'],
+            'content': [
+                {'type': 'text', 'text': turn['text']},
+                {'type': 'image_url', 'image_url': {'url': f"data:image/jpeg;base64,{image_data}"}}
+            ]
+        }
+
+    def all_messages(self) -> list:
+        """全部历史消息（不按token预算截断，用于展示）"""
+        return [self._to_message(turn) for turn in self._turns]
+
+    def estimated_tokens(self) -> int:
+        """历史中所有消息的估算token数"""
+        return sum(turn['tokens'] for turn in self._turns)
+
+    def estimated_size(self) -> int:
+        """估算占用的内存（字节）：共享的图片按引用数分摊"""
+        return int(sum(len(turn['text'].encode('utf-8')) +
+                       (self.blob_store.shared_size(turn['image']) if turn['image'] else 0)
+                       for turn in self._turns))
+
+    def clear(self):
+        """清空历史并释放所有图片引用"""
+        for turn in self._turns:
+            self._release_image(turn)
+        self._turns = []
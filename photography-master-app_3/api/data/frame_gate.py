@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+帧差门控
+用户取景时会连续发送同一场景的很多帧。每个会话记住上一次真正分析过的画面（缩小的灰度图、
+倾斜角度和结果），新帧与之相比变化不大时直接复用上次的建议，不再请求AI。
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = 32
+
+
+def frame_thumbnail(gray_image):
+    """生成用于帧差比较的缩略灰度图（32x32）"""
+    return cv2.resize(gray_image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+
+
+class FrameGate:
+    """按会话比较新帧与上次分析的帧，画面、倾斜角度和上下文都没有明显变化时返回上次的结果"""
+
+    def __init__(self, diff_threshold: float, tilt_threshold: float, max_age_seconds: float, enabled: bool = True):
+        self.diff_threshold = diff_threshold  # 缩略图平均像素差（0~1）
+        self.tilt_threshold = tilt_threshold  # 倾斜角度变化（度）
+        self.max_age_seconds = max_age_seconds  # 复用结果的最长时间
+        self.enabled = enabled
+
+        # 统计信息
+        self.reused_count = 0
+        self.analyzed_count = 0
+
+    def check(self, session, analysis: dict, mode: str):
+        """新帧与上次分析的帧相比没有明显变化时，返回可复用的指导结果（已标记reused），否则返回None"""
+        if not self.enabled:
+            return None
+
+        with session.lock:
+            last = session.last_analyzed_frame
+            intent = session.user_photography_intent
+        if not last:
+            return None
+
+        # 上下文变化（拍摄意图、调用模式、水平状态）或结果太旧时都需要重新分析
+        age = time.time() - last['timestamp']
+        if (age > self.max_age_seconds or last['intent'] != intent or last['mode'] != mode
+                or last['is_level'] != analysis.get('is_level', True)):
+            return None
+
+        tilt_delta = abs(analysis.get('tilt_angle', 0) - last['tilt_angle'])
+        if tilt_delta > self.tilt_threshold:
+            return None
+
+        frame_diff = float(np.mean(cv2.absdiff(analysis['thumbnail'], last['thumbnail']))) / 255.0
+        if frame_diff > self.diff_threshold:
+            return None
+
+        self.reused_count += 1
+        print(f"画面无明显变化（帧差: {frame_diff:.3f}, 角度变化: {tilt_delta:.1f}度），复用上次的建议")
+        guidance = dict(last['guidance'])
+        guidance['meta'] = dict(guidance.get('meta', {}), reused=True,
+                                reused_age_seconds=round(age, 2), frame_diff=round(frame_diff, 4))
+        return guidance
+
+    def remember(self, session, analysis: dict, mode: str, guidance: dict):
+        """记录本次真正分析过的帧及其结果"""
+        self.analyzed_count += 1
+        if not self.enabled:
+            return
+        with session.lock:
+            session.last_analyzed_frame = {
+                'thumbnail': analysis['thumbnail'],
+                'tilt_angle': analysis.get('tilt_angle', 0),
+                'is_level': analysis.get('is_level', True),
+                'intent': session.user_photography_intent,
+                'mode': mode,
+                'guidance': guidance,
+                'timestamp': time.time()
+            }
+
+    def get_stats(self):
+        """获取门控统计信息"""
+        total = self.reused_count + self.analyzed_count
+        return {
+            'enabled': self.enabled,
+            'diff_threshold': self.diff_threshold,
+            'tilt_threshold': self.tilt_threshold,
+            'max_age_seconds': self.max_age_seconds,
+            'reused_frames': self.reused_count,
+            'analyzed_frames': self.analyzed_count,
+            'reuse_rate': round(self.reused_count / total, 3) if total else 0.0
+        }
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+实时相机帧槽位（latest-frame-wins）
+每个实时连接只保留最新的一帧待分析画面：分析进行中到达的新帧直接覆盖旧帧，
+被覆盖的旧帧计为丢弃，避免AI响应变慢时请求堆积。
+"""
+
+import asyncio
+import time
+
+
+class LatestFrameSlot:
+    """只保存最新一帧的异步槽位（单生产者、单消费者）"""
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self._closed = False
+
+        # 统计信息
+        self.received_count = 0
+        self.dropped_count = 0
+        self.processed_count = 0
+
+    def put(self, image_bytes: bytes, options: dict = None):
+        """放入新帧；若上一帧还未被取走则覆盖并计为丢弃"""
+        if self._closed:
+            return
+        self.received_count += 1
+        if self._frame is not None:
+            self.dropped_count += 1
+        self._frame = {
+            'frame_id': self.received_count,
+            'image_bytes': image_bytes,
+            'options': dict(options or {}),
+            'received_at': time.time()
+        }
+        self._event.set()
+
+    async def get(self):
+        """等待并取出最新帧；槽位关闭后返回None"""
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        self.processed_count += 1
+        return frame
+
+    def close(self):
+        """关闭槽位，唤醒正在等待的消费者"""
+        self._closed = True
+        self._frame = None
+        self._event.set()
+
+    def get_stats(self):
+        """获取帧统计信息"""
+        return {
+            'received_frames': self.received_count,
+            'processed_frames': self.processed_count,
+            'dropped_frames': self.dropped_count
+        }
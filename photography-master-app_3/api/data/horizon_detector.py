@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+水平检测
+提供两种检测引擎，输出格式相同（is_level / tilt_angle / tilt_direction / confidence），由 Config.HORIZON_ENGINE 选择：
+
+hough（默认，多尺度霍夫检测）
+1. 粗检测：图像金字塔缩小到长边不超过 HORIZON_MAX_SIDE 后做Canny和概率霍夫变换，
+   用NumPy一次性计算所有线段的角度，以线段长度为权重取加权中位数，再对中位数附近的内点取加权平均
+2. 精修：在高一层金字塔图像上，只在粗估计角度附近的窄范围内以0.1度精度做霍夫变换，按投票数加权
+3. 置信度：内点权重占比（线条方向是否一致）× 内点总长度相对画面高度的支撑度
+   （参与估计的是接近竖直的线条，一条贯穿画面的竖线支撑度即为1）
+
+gradient（梯度方向直方图，更快）
+在缩小后的图像上计算Scharr梯度（方向精度比3x3 Sobel高），按梯度幅值加权统计梯度方向直方图，峰值即主要线条的法线方向。
+只需一次O(像素数)的NumPy计算，没有霍夫累加器，精度略低于hough，适合负载高的节点。
+置信度：峰值附近的梯度能量占比 × 有内点边缘的行数占画面高度的比例。
+
+角度约定与原先的 cv2.HoughLines 检测保持一致：取接近竖直的线条（法线角theta在±30度内），
+角度为正表示右边高（right_high），为负表示左边高（left_high）。
+"""
+
+import cv2
+import numpy as np
+
+# 参与估计的线条方向范围（法线角与0度的夹角，度）
+MAX_LINE_ANGLE = 30.0
+
+# 加权中位数附近视为内点的范围（度）
+INLIER_RANGE = 3.0
+
+# 精修时在粗估计角度两侧搜索的范围（度）和角度精度
+REFINE_RANGE = 2.0
+REFINE_STEP = 0.1
+
+# 梯度方向直方图的分辨率（度）
+HISTOGRAM_BIN = 0.5
+
+
+def level_result(angle: float, confidence: float, tolerance: float) -> dict:
+    """按统一的输出格式返回水平检测结果（各检测引擎共用）"""
+    if angle > tolerance:
+        direction = 'right_high'  # 右边高
+    elif angle < -tolerance:
+        direction = 'left_high'   # 左边高
+    else:
+        direction = 'level'
+    return {
+        'is_level': bool(abs(angle) <= tolerance),  # 确保是Python bool
+        'tilt_angle': float(round(abs(angle), 1)),  # 确保是Python float
+        'tilt_direction': str(direction),  # 确保是Python str
+        'confidence': float(round(float(confidence), 2))  # 确保是Python float
+    }
+
+
+def no_lines_result() -> dict:
+    """没有可用线条时的结果（认为水平，低置信度）"""
+    return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.3}
+
+
+def build_pyramid(gray_image, max_side: int) -> list:
+    """构建图像金字塔，返回从原图到长边不超过 max_side 的各层（至少包含原图）"""
+    levels = [gray_image]
+    while max(levels[-1].shape[:2]) > max_side:
+        levels.append(cv2.pyrDown(levels[-1]))
+    return levels
+
+
+def weighted_median(values, weights) -> float:
+    """加权中位数"""
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cumulative, cumulative[-1] / 2.0)])
+
+
+def fold_normal_angle(theta_deg):
+    """把霍夫法线角（0~180度）折算到 -90~90 度"""
+    return np.where(theta_deg > 90, theta_deg - 180, theta_deg)
+
+
+def _coarse_estimate(gray_small):
+    """粗检测：概率霍夫变换 + 长度加权的稳健角度估计，返回 (角度, 置信度) 或 None"""
+    height, width = gray_small.shape[:2]
+    edges = cv2.Canny(gray_small, 50, 150, apertureSize=3)
+    segments = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=max(min(width, height) // 8, 10),
+                               minLineLength=min(width, height) // 8, maxLineGap=5)
+    if segments is None:
+        return None
+
+    segments = segments.reshape(-1, 4).astype(np.float64)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    lengths = np.hypot(dx, dy)
+
+    # 线段方向角 + 90度 即霍夫法线角，折算到与 HoughLines 相同的角度约定
+    angles = fold_normal_angle((np.degrees(np.arctan2(dy, dx)) + 90.0) % 180.0)
+    mask = np.abs(angles) < MAX_LINE_ANGLE
+    if not np.any(mask):
+        return None
+    angles, lengths = angles[mask], lengths[mask]
+
+    median = weighted_median(angles, lengths)
+    inliers = np.abs(angles - median) <= INLIER_RANGE
+    estimate = float(np.average(angles[inliers], weights=lengths[inliers]))
+
+    agreement = lengths[inliers].sum() / lengths.sum()
+    # 接近竖直的线条最长约为画面高度
+    support = min(lengths[inliers].sum() / height, 1.0)
+    return estimate, float(agreement * support)
+
+
+def _theta_ranges(estimate: float):
+    """精修的法线角搜索范围（弧度），跨过0度时拆成两段"""
+    low, high = estimate - REFINE_RANGE, estimate + REFINE_RANGE
+    if low >= 0:
+        return [(low, high)]
+    if high <= 0:
+        return [(180 + low, 180 + high)]
+    return [(0, high), (180 + low, 180)]
+
+
+def _refine_estimate(gray_image, estimate: float):
+    """精修：在粗估计角度附近做高精度霍夫变换，按投票数加权，返回精修后的角度或None"""
+    height, width = gray_image.shape[:2]
+    edges = cv2.Canny(gray_image, 50, 150, apertureSize=3)
+    threshold = max(min(width, height) // 4, 10)
+
+    thetas, votes = [], []
+    for low, high in _theta_ranges(estimate):
+        lines = cv2.HoughLinesWithAccumulator(edges, 1, np.deg2rad(REFINE_STEP), threshold,
+                                              min_theta=np.deg2rad(low), max_theta=np.deg2rad(high))
+        if lines is not None:
+            lines = lines.reshape(-1, 3)
+            thetas.append(lines[:, 1])
+            votes.append(lines[:, 2])
+    if not thetas:
+        return None
+
+    angles = fold_normal_angle(np.degrees(np.concatenate(thetas)))
+    weights = np.concatenate(votes).astype(np.float64)
+    return weighted_median(angles, weights)
+
+
+def detect_horizon_hough(gray_image, max_side: int, tolerance: float) -> dict:
+    """多尺度霍夫水平检测，输出 is_level / tilt_angle / tilt_direction / confidence"""
+    try:
+        pyramid = build_pyramid(gray_image, max_side)
+
+        coarse = _coarse_estimate(pyramid[-1])
+        if coarse is None:
+            return no_lines_result()
+        estimate, confidence = coarse
+
+        # 在高一层（分辨率为粗检测的2倍）的图像上精修；原图已经足够小时直接用原图
+        refine_level = pyramid[-2] if len(pyramid) > 1 else pyramid[-1]
+        refined = _refine_estimate(refine_level, estimate)
+        if refined is not None:
+            estimate = refined
+
+        return level_result(estimate, confidence, tolerance)
+
+    except Exception as e:
+        print(f"水平检测失败: {e}")
+        return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.1}
+
+
+def detect_horizon_gradient(gray_image, max_side: int, tolerance: float) -> dict:
+    """梯度方向直方图水平检测，输出格式与 detect_horizon_hough 相同"""
+    try:
+        small = build_pyramid(gray_image, max_side)[-1]
+        # ksize=-1 使用Scharr核，斜向边缘的方向误差明显小于3x3 Sobel
+        gx = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=-1)
+        gy = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=-1)
+        magnitude = cv2.magnitude(gx, gy)
+
+        # 只统计明显的边缘（幅值高于均值的若干倍），避免噪声和平坦区域干扰
+        strong = magnitude > max(float(magnitude.mean()) * 2.0, 1.0)
+        if not np.any(strong):
+            return no_lines_result()
+
+        # 梯度方向即线条的法线方向，与霍夫变换的法线角相同，折算到 -90~90 度
+        angles = fold_normal_angle(np.degrees(np.arctan2(gy[strong], gx[strong])) % 180.0)
+        weights = magnitude[strong]
+        rows = np.nonzero(strong)[0]
+        mask = np.abs(angles) < MAX_LINE_ANGLE
+        if not np.any(mask):
+            return no_lines_result()
+        angles, weights, rows = angles[mask], weights[mask], rows[mask]
+
+        bins = np.arange(-MAX_LINE_ANGLE, MAX_LINE_ANGLE + HISTOGRAM_BIN, HISTOGRAM_BIN)
+        histogram, _ = np.histogram(angles, bins=bins, weights=weights)
+        # 平滑直方图，减小单个分箱的量化误差
+        smoothed = np.convolve(histogram, np.ones(3) / 3.0, mode='same')
+        peak = (bins[np.argmax(smoothed)] + bins[np.argmax(smoothed) + 1]) / 2.0
+
+        # 在峰值附近取加权平均作为最终角度
+        inliers = np.abs(angles - peak) <= INLIER_RANGE
+        estimate = float(np.average(angles[inliers], weights=weights[inliers]))
+
+        # 置信度：峰值附近的梯度能量占比 × 支撑度（内点边缘覆盖的行数占画面高度的比例；
+        # 边缘有若干像素宽，按像素数计算会高估支撑度）
+        agreement = weights[inliers].sum() / weights.sum()
+        support = len(np.unique(rows[inliers])) / small.shape[0]
+        return level_result(estimate, agreement * support, tolerance)
+
+    except Exception as e:
+        print(f"水平检测失败: {e}")
+        return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.1}
+
+
+# 可选的水平检测引擎（Config.HORIZON_ENGINE）
+HORIZON_ENGINES = {
+    'hough': detect_horizon_hough,
+    'gradient': detect_horizon_gradient,
+}
+
+
+def detect_horizon(gray_image, engine: str, max_side: int, tolerance: float) -> dict:
+    """使用指定引擎做水平检测"""
+    if engine not in HORIZON_ENGINES:
+        raise ValueError(f"不支持的水平检测引擎: {engine}，可选: {', '.join(HORIZON_ENGINES)}")
+    return HORIZON_ENGINES[engine](gray_image, max_side, tolerance)
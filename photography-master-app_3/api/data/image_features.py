@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+图像特征提取
+PhotographyAgent 和 SimpleImageAnalyzer 共用的单次特征提取：图片只解码一次，
+灰度图、HSV等中间结果只计算一次，按需计算以下特征：
+
+- brightness / contrast：灰度均值和标准差（cv2.meanStdDev 一次得到）
+- saturation：HSV饱和度均值
+- sharpness：拉普拉斯方差（在固定的工作尺寸上计算，见 SHARPNESS_SIDE）
+- histogram：归一化的亮度直方图（以及暗部/高光溢出比例）
+- tilt：水平检测（见 horizon_detector.py）
+- composition：构图特征（主体位置、左右/上下平衡、地平线位置、光线方向），供本地建议引擎使用
+- exif：只解析图片头部的EXIF，不解码像素
+- phash / thumbnail：感知哈希和帧差门控用的缩略图
+
+逐帧分析只需要灰度图，而且不需要传感器的原始分辨率：decode_for_analysis 按输入尺寸和目标工作尺寸
+选择 IMREAD_REDUCED_GRAYSCALE_2/4/8，JPEG在DCT域直接缩小解码，省去全分辨率解码和颜色转换。
+需要全分辨率彩色图像的环节自行调用 cv2.imdecode。
+"""
+
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+from PIL.ExifTags import TAGS
+
+from horizon_detector import detect_horizon
+from perceptual_cache import dhash
+from frame_gate import frame_thumbnail
+
+# 可选的特征
+FEATURES = ('brightness', 'contrast', 'saturation', 'sharpness', 'histogram', 'tilt', 'composition', 'exif', 'phash',
+            'thumbnail')
+
+# 亮度直方图的分箱数
+HISTOGRAM_BINS = 32
+
+# 构图特征的工作尺寸：梯度在长边为 COMPOSITION_SIDE 的缩小图上计算，显著性在 SALIENCY_SIDE 的方图上计算
+COMPOSITION_SIDE = 160
+SALIENCY_SIDE = 64
+# 地平线检测：垂直方向梯度超过该值的像素视为水平边缘（约6个灰度级的跳变）
+HORIZON_EDGE_THRESHOLD = 24
+
+# 清晰度的工作尺寸（长边）：拉普拉斯方差随分辨率变化很大（同一帧缩小一半方差约变为2~4倍），
+# 解码尺寸又随缩小解码倍数和上传尺寸变化，统一缩放到该尺寸后再计算，categorize_sharpness 的阈值按该尺寸标定
+SHARPNESS_SIDE = 640
+
+# IMREAD_REDUCED 支持的缩小倍数（从大到小尝试）
+REDUCED_GRAYSCALE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+}
+
+# 保留的EXIF字段
+EXIF_TAGS = ('Make', 'Model', 'DateTime', 'ExposureTime', 'FNumber', 'ISO')
+
+
+def categorize_brightness(brightness):
+    """亮度分类"""
+    if brightness < 50:
+        return "昏暗"
+    elif brightness < 120:
+        return "适中"
+    else:
+        return "明亮"
+
+
+def categorize_contrast(contrast):
+    """对比度分类"""
+    if contrast < 30:
+        return "低"
+    elif contrast < 60:
+        return "中"
+    else:
+        return "高"
+
+
+def categorize_sharpness(sharpness):
+    """清晰度分类（sharpness为长边 SHARPNESS_SIDE 时的拉普拉斯方差）"""
+    if sharpness < 100:
+        return "模糊"
+    elif sharpness < 300:
+        return "一般"
+    else:
+        return "清晰"
+
+
+def categorize_saturation(saturation):
+    """饱和度分类"""
+    if saturation < 80:
+        return "低饱和度"
+    elif saturation < 150:
+        return "中饱和度"
+    else:
+        return "高饱和度"
+
+
+def read_exif(image_bytes: bytes) -> dict:
+    """从图片字节中读取基本EXIF信息
+
+    Image.open 只解析文件头，getexif 读取头部的EXIF段，不会解码像素数据
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as pil_image:
+            exif_dict = pil_image.getexif()
+        exif_info = {}
+        for tag_id, value in exif_dict.items():
+            tag = TAGS.get(tag_id, tag_id)
+            if tag in EXIF_TAGS:
+                exif_info[tag] = str(value)
+        return exif_info
+    except Exception:
+        return {}
+
+
+def image_size(image_bytes: bytes):
+    """从图片头部读取尺寸 (宽, 高)，不解码像素；无法识别时返回None"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as pil_image:
+            return pil_image.size
+    except Exception:
+        return None
+
+
+def reduced_decode_scale(width: int, height: int, target_side: int) -> int:
+    """选择缩小倍数：缩小后长边仍不小于 target_side 的最大倍数（1/2/4/8）"""
+    for scale in REDUCED_GRAYSCALE_FLAGS:
+        if max(width, height) // scale >= target_side:
+            return scale
+    return 1
+
+
+def decode_for_analysis(image_bytes: bytes, target_side: int):
+    """按分析需要的工作尺寸解码灰度图，返回 (灰度图, 原图尺寸(宽, 高))，解码失败时返回 (None, None)
+
+    target_side 为分析需要的最小长边，为0时按原分辨率解码
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None, None
+
+    size = image_size(image_bytes) if target_side else None
+    scale = reduced_decode_scale(size[0], size[1], target_side) if size else 1
+    gray = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS.get(scale, cv2.IMREAD_GRAYSCALE))
+    if gray is None:
+        return None, None
+    # imdecode 会按EXIF方向旋转图像，文件头中的尺寸是旋转前的
+    if size and (gray.shape[1] > gray.shape[0]) != (size[0] > size[1]):
+        size = (size[1], size[0])
+    return gray, size or (gray.shape[1], gray.shape[0])
+
+
+def sharpness_variance(gray_image) -> float:
+    """在长边为 SHARPNESS_SIDE 的工作尺寸上计算拉普拉斯方差（大图缩小、小图放大）"""
+    height, width = gray_image.shape[:2]
+    scale = SHARPNESS_SIDE / max(height, width)
+    if scale != 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        gray_image = cv2.resize(gray_image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    # 8位图像的拉普拉斯响应不超过int16范围，用CV_16S和meanStdDev计算方差，结果与CV_64F相同但更快
+    return float(cv2.meanStdDev(cv2.Laplacian(gray_image, cv2.CV_16S))[1][0][0]) ** 2
+
+
+def luminance_histogram(gray_image) -> dict:
+    """归一化的亮度直方图，以及暗部（<16）和高光（>239）溢出的像素比例"""
+    counts = cv2.calcHist([gray_image], [0], None, [256], [0, 256]).ravel()
+    total = float(counts.sum()) or 1.0
+    bins = counts.reshape(HISTOGRAM_BINS, -1).sum(axis=1) / total
+    return {
+        'bins': [float(round(value, 4)) for value in bins],
+        'shadows_clipped': float(round(counts[:16].sum() / total, 4)),
+        'highlights_clipped': float(round(counts[240:].sum() / total, 4))
+    }
+
+
+def saliency_map(gray_image):
+    """频谱残差显著性图（SALIENCY_SIDE 的方图，值归一化到0~1）"""
+    small = cv2.resize(gray_image, (SALIENCY_SIDE, SALIENCY_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    spectrum = np.fft.fft2(small)
+    log_amplitude = np.log(np.abs(spectrum) + 1e-6).astype(np.float32)
+    residual = log_amplitude - cv2.blur(log_amplitude, (3, 3))
+    saliency = np.abs(np.fft.ifft2(np.exp(residual + 1j * np.angle(spectrum)))) ** 2
+    saliency = cv2.GaussianBlur(saliency.astype(np.float32), (9, 9), 2.5)
+    peak = float(saliency.max())
+    return saliency / peak if peak > 0 else saliency
+
+
+def composition_features(gray_image) -> dict:
+    """构图特征（坐标都归一化到0~1，原点在左上角）
+
+    - subject_x / subject_y：显著区域的重心；subject_spread：显著区域的离散程度，越小主体越集中
+    - balance_x / balance_y：梯度权重的右减左、下减上（-1~1），正值表示右侧/下方元素更多
+    - horizon_y：水平边缘覆盖最宽的行；horizon_coverage：该行中水平边缘像素的比例，贯穿画面的地平线接近1
+    - top_texture / bottom_texture：上、下三分之一区域的平均梯度（判断天空是否空旷）
+    - light_x / light_y：右减左、下减上的平均亮度差（-1~1），表示光线方向
+    """
+    height, width = gray_image.shape[:2]
+    scale = COMPOSITION_SIDE / max(height, width)
+    small = gray_image
+    if scale < 1:
+        small = cv2.resize(gray_image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    small = small.astype(np.float32)
+    rows, cols = small.shape
+
+    gx = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    weight = cv2.magnitude(gx, gy)
+    total = float(weight.sum()) or 1.0
+    half_row, half_col, third = rows // 2, cols // 2, max(1, rows // 3)
+
+    # 地平线：忽略上下边缘10%，取水平边缘覆盖最宽的行
+    row_coverage = (np.abs(gy) > HORIZON_EDGE_THRESHOLD).mean(axis=1)
+    low, high = rows // 10, max(rows - rows // 10, rows // 10 + 1)
+    horizon_row = low + int(np.argmax(row_coverage[low:high]))
+
+    # 主体：显著性高于平均值2倍的区域
+    saliency = saliency_map(gray_image)
+    mask = saliency > saliency.mean() * 2
+    if not mask.any():
+        mask = saliency > 0
+    ys, xs = np.nonzero(mask)
+    weights = saliency[ys, xs]
+    weight_sum = float(weights.sum()) or 1.0
+    subject_x = float((xs + 0.5) @ weights / weight_sum / SALIENCY_SIDE)
+    subject_y = float((ys + 0.5) @ weights / weight_sum / SALIENCY_SIDE)
+    spread = float(np.sqrt((((xs + 0.5) / SALIENCY_SIDE - subject_x) ** 2
+                            + ((ys + 0.5) / SALIENCY_SIDE - subject_y) ** 2) @ weights / weight_sum))
+
+    return {
+        'subject_x': round(subject_x, 3),
+        'subject_y': round(subject_y, 3),
+        'subject_spread': round(spread, 3),
+        'balance_x': round((float(weight[:, half_col:].sum()) - float(weight[:, :half_col].sum())) / total, 3),
+        'balance_y': round((float(weight[half_row:].sum()) - float(weight[:half_row].sum())) / total, 3),
+        'horizon_y': round((horizon_row + 0.5) / rows, 3),
+        'horizon_coverage': round(float(row_coverage[horizon_row]), 3),
+        'top_texture': round(float(weight[:third].mean()), 1),
+        'bottom_texture': round(float(weight[-third:].mean()), 1),
+        'light_x': round((float(small[:, half_col:].mean()) - float(small[:, :half_col].mean())) / 255, 3),
+        'light_y': round((float(small[half_row:].mean()) - float(small[:half_row].mean())) / 255, 3)
+    }
+
+
+def extract_features(image, features=FEATURES, image_bytes: bytes = None, horizon_engine: str = 'hough',
+                     horizon_max_side: int = 640, level_tolerance: float = 2.0) -> dict:
+    """从已解码的图像（BGR或灰度）中提取指定的特征（saturation需要BGR图像）
+
+    image_bytes 为原始图片字节，只在需要EXIF时使用；horizon_* 和 level_tolerance 为水平检测参数。
+    返回的数值都是Python原生类型（可直接序列化为JSON），phash为整数，thumbnail为数组
+    """
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"不支持的图像特征: {', '.join(sorted(unknown))}")
+
+    height, width = image.shape[:2]
+    result = {
+        'width': int(width),  # 确保是Python int
+        'height': int(height),
+        'orientation': "横向" if width > height else "竖向" if height > width else "正方形"
+    }
+
+    # 共享的中间结果：灰度图只转换一次
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    if 'brightness' in features or 'contrast' in features:
+        mean, stddev = cv2.meanStdDev(gray)
+        brightness, contrast = float(mean[0][0]), float(stddev[0][0])
+        if 'brightness' in features:
+            result['brightness'] = float(round(brightness, 1))  # 确保是Python float
+            result['brightness_level'] = categorize_brightness(brightness)
+        if 'contrast' in features:
+            result['contrast'] = float(round(contrast, 1))
+            result['contrast_level'] = categorize_contrast(contrast)
+
+    if 'saturation' in features:
+        saturation = float(cv2.mean(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))[1]) if image.ndim == 3 else 0.0
+        result['saturation'] = float(round(saturation, 1))
+        result['saturation_level'] = categorize_saturation(saturation)
+
+    if 'sharpness' in features:
+        sharpness = sharpness_variance(gray)
+        result['sharpness'] = float(round(sharpness, 3))
+        result['sharpness_level'] = categorize_sharpness(sharpness)
+
+    if 'histogram' in features:
+        result['histogram'] = luminance_histogram(gray)
+
+    if 'tilt' in features:
+        result['tilt'] = detect_horizon(gray, engine=horizon_engine, max_side=horizon_max_side,
+                                        tolerance=level_tolerance)
+
+    if 'composition' in features:
+        result['composition'] = composition_features(gray)
+
+    if 'exif' in features:
+        result['exif'] = read_exif(image_bytes) if image_bytes else {}
+
+    if 'phash' in features:
+        result['phash'] = dhash(gray)
+
+    if 'thumbnail' in features:
+        result['thumbnail'] = frame_thumbnail(gray)
+
+    return result
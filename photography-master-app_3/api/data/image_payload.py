@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+AI请求的图片载荷
+发送给模型的图片不需要原始分辨率：水平检查只需判断画面是否歪斜，几百像素就够；建议请求需要看清画面内容，
+但也远小于手机拍摄的原图。每种请求类型有自己的目标尺寸和JPEG质量（见 Config.IMAGE_PAYLOAD_*），
+在内存中用 cv2.resize(INTER_AREA) 缩小后重新编码，不再写临时文件。
+
+FramePayload 对应一帧画面：第一次需要时才解码（缓存命中、跳过AI检查时完全不解码），
+解码结果和各类型的编码结果都缓存在对象中，同一帧的水平检查和建议请求共用。
+"""
+
+import base64
+import threading
+
+import cv2
+import numpy as np
+
+from image_features import image_size, reduced_decode_scale
+
+# IMREAD_REDUCED 彩色解码的缩小倍数
+REDUCED_COLOR_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+JPEG_MAGIC = b'\xff\xd8'
+
+
+class FramePayload:
+    """一帧画面在各类AI请求中的图片载荷（按请求类型缓存base64编码结果，线程安全）"""
+
+    def __init__(self, image_bytes: bytes, builder):
+        self.image_bytes = image_bytes
+        self._builder = builder
+        self._image = None
+        self._encoded = {}
+        self._base64 = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, kind: str) -> bytes:
+        """返回指定请求类型（level / suggestions）的JPEG字节（会话历史保存原始字节）"""
+        with self._lock:
+            if kind not in self._encoded:
+                self._encoded[kind] = self._encode(kind)
+            return self._encoded[kind]
+
+    def base64(self, kind: str) -> str:
+        """返回指定请求类型的base64编码图片"""
+        with self._lock:
+            if kind not in self._base64:
+                if kind not in self._encoded:
+                    self._encoded[kind] = self._encode(kind)
+                self._base64[kind] = base64.b64encode(self._encoded[kind]).decode('utf-8')
+            return self._base64[kind]
+
+    def _encode(self, kind: str) -> bytes:
+        max_side, quality = self._builder.profiles[kind]
+        image = self._decoded()
+        if image is None:
+            # 无法解码时原样发送
+            return self.image_bytes
+
+        height, width = image.shape[:2]
+        scale = max_side / max(width, height)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return self.image_bytes
+
+        encoded = encoded.tobytes()
+        # 原图已经足够小且是更小的JPEG时直接使用原图
+        if scale >= 1 and self.image_bytes.startswith(JPEG_MAGIC) and len(self.image_bytes) <= len(encoded):
+            encoded = self.image_bytes
+        self._builder.record(len(self.image_bytes), len(encoded))
+        return encoded
+
+    def _decoded(self):
+        """按所有请求类型中最大的目标尺寸缩小解码（只解码一次）"""
+        if self._image is None:
+            buffer = np.frombuffer(self.image_bytes, dtype=np.uint8)
+            if buffer.size == 0:
+                return None
+            size = image_size(self.image_bytes)
+            scale = reduced_decode_scale(size[0], size[1], self._builder.max_side) if size else 1
+            self._image = cv2.imdecode(buffer, REDUCED_COLOR_FLAGS.get(scale, cv2.IMREAD_COLOR))
+        return self._image
+
+
+class ImagePayloadBuilder:
+    """按请求类型的目标尺寸和质量构建图片载荷，并统计压缩效果"""
+
+    def __init__(self, profiles: dict):
+        self.profiles = profiles  # 请求类型 -> (最长边, JPEG质量)
+        self.max_side = max(max_side for max_side, _ in profiles.values())
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.frames = 0
+        self.encoded_count = 0
+        self.original_bytes = 0
+        self.payload_bytes = 0
+
+    def for_frame(self, image_bytes: bytes) -> FramePayload:
+        """为一帧画面创建载荷对象"""
+        with self._lock:
+            self.frames += 1
+        return FramePayload(image_bytes, self)
+
+    def record(self, original_size: int, payload_size: int):
+        with self._lock:
+            self.encoded_count += 1
+            self.original_bytes += original_size
+            self.payload_bytes += payload_size
+
+    def get_stats(self):
+        """获取载荷统计信息"""
+        with self._lock:
+            return {
+                'profiles': {kind: {'max_side': max_side, 'quality': quality}
+                             for kind, (max_side, quality) in self.profiles.items()},
+                'frames': self.frames,
+                'encoded_payloads': self.encoded_count,
+                'original_bytes': self.original_bytes,
+                'payload_bytes': self.payload_bytes,
+                'compression_ratio': round(self.payload_bytes / self.original_bytes, 3) if self.original_bytes else None
+            }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+AI水平检查的级联策略
+OpenCV认为画面水平时，原先每一帧都会再请求一次AI做水平二次检查。级联策略按代价从低到高依次判断，
+能确定结果时就跳过AI检查：
+
+1. sensor：设备传感器提供了横滚角，结果可靠
+2. tilt_detected：OpenCV已经检测到明显倾斜，直接采用
+3. high_confidence：OpenCV水平检测置信度足够高
+4. stable：同一会话最近连续若干帧都判断为水平、角度几乎不变，且该会话上一次AI检查也认为水平
+5. agreement：最近AI检查与OpenCV"水平"判断的一致率足够高（样本足够多）；
+   其中每隔若干次仍会抽查一次AI（audit），保证一致率统计持续更新
+其余情况（uncertain）请求AI检查。
+
+每次决策和AI检查结果都会记录统计（各原因的次数、AI耗时、按置信度分段的不一致率），
+用于根据成本和延迟调整阈值。
+"""
+
+import time
+import threading
+from collections import Counter, deque
+
+# 决策原因 -> 是否请求AI检查
+DECISION_REASONS = {
+    'disabled': True,
+    'sensor': False,
+    'tilt_detected': False,
+    'high_confidence': False,
+    'stable': False,
+    'agreement': False,
+    'audit': True,
+    'uncertain': True,
+}
+
+# 原先会请求AI、由级联策略跳过的原因（用于估算节省的请求和时间）
+CASCADE_SKIP_REASONS = ('high_confidence', 'stable', 'agreement')
+
+# 按OpenCV置信度分段统计AI检查的不一致率
+CONFIDENCE_BUCKETS = [0.2, 0.4, 0.6, 0.8, 1.01]
+
+# 保留的最近决策条数（/api/stats 中查看）
+RECENT_DECISIONS = 50
+
+
+def confidence_bucket(confidence: float) -> str:
+    """置信度所在分段的名称，如 '0.4-0.6'"""
+    low = 0.0
+    for high in CONFIDENCE_BUCKETS:
+        if confidence < high:
+            return f"{low:.1f}-{min(high, 1.0):.1f}"
+        low = high
+    return f"{low:.1f}-1.0"
+
+
+class LevelCascade:
+    """决定是否需要AI水平二次检查，并记录决策统计"""
+
+    def __init__(self, high_confidence: float, min_confidence: float, stable_frames: int,
+                 stable_max_spread: float, stable_window_seconds: float, agreement_window: int,
+                 agreement_threshold: float, agreement_min_samples: int, audit_interval: int,
+                 enabled: bool = True):
+        self.high_confidence = high_confidence  # 高于该置信度直接信任OpenCV
+        self.min_confidence = min_confidence  # stable / agreement 规则要求的最低置信度
+        self.stable_frames = stable_frames  # 连续水平的帧数
+        self.stable_max_spread = stable_max_spread  # 连续帧倾斜角度的最大波动（度）
+        self.stable_window_seconds = stable_window_seconds  # 连续帧的时间范围
+        self.agreement_threshold = agreement_threshold  # AI与OpenCV的一致率阈值
+        self.agreement_min_samples = agreement_min_samples  # 计算一致率的最少样本数
+        self.audit_interval = audit_interval  # 因一致率跳过时，每隔多少次抽查一次AI
+        self.enabled = enabled
+
+        self._agreements = deque(maxlen=agreement_window)  # 最近AI检查是否认为水平
+        self._recent = deque(maxlen=RECENT_DECISIONS)
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.decisions = Counter()
+        self.agreement_skips = 0
+        self.ai_checks = 0
+        self.ai_disagreements = 0
+        self.ai_failures = 0
+        self.ai_latency_total = 0.0
+        self.ai_latency_count = 0
+        self.bucket_stats = {}  # 置信度分段 -> {'checks', 'disagreements'}
+
+    def decide(self, session, analysis: dict) -> dict:
+        """记录本帧的水平读数并决定是否请求AI检查，返回 {'run_ai', 'reason', 'confidence'}"""
+        confidence = float(analysis.get('level_confidence', 0.0))
+        reason = self._decide_reason(session, analysis, confidence)
+        decision = {'run_ai': DECISION_REASONS[reason], 'reason': reason, 'confidence': confidence}
+
+        with self._lock:
+            self.decisions[reason] += 1
+            self._recent.append({
+                'timestamp': round(time.time(), 3),
+                'session_id': session.session_id,
+                'reason': reason,
+                'run_ai': decision['run_ai'],
+                'confidence': confidence,
+                'tilt_angle': analysis.get('tilt_angle', 0)
+            })
+        return decision
+
+    def _decide_reason(self, session, analysis: dict, confidence: float) -> str:
+        is_level = analysis.get('is_level', True)
+        if analysis.get('level_source') == 'sensor':
+            return 'sensor'
+        if not is_level:
+            self._remember_reading(session, analysis, confidence)
+            return 'tilt_detected'
+
+        stable = self._remember_reading(session, analysis, confidence)
+        if not self.enabled:
+            return 'disabled'
+        if confidence >= self.high_confidence:
+            return 'high_confidence'
+        if confidence < self.min_confidence:
+            return 'uncertain'
+        if stable:
+            return 'stable'
+
+        with self._lock:
+            samples = len(self._agreements)
+            if samples >= self.agreement_min_samples and sum(self._agreements) / samples >= self.agreement_threshold:
+                self.agreement_skips += 1
+                if self.audit_interval and self.agreement_skips % self.audit_interval == 0:
+                    return 'audit'
+                return 'agreement'
+        return 'uncertain'
+
+    def _remember_reading(self, session, analysis: dict, confidence: float) -> bool:
+        """把本帧读数加入会话的最近读数，返回本帧之前的读数是否满足"稳定"条件"""
+        now = time.time()
+        reading = (now, bool(analysis.get('is_level', True)), float(analysis.get('tilt_angle', 0)), confidence)
+        with session.lock:
+            recent = [r for r in session.level_readings if now - r[0] <= self.stable_window_seconds]
+            session.level_readings.append(reading)
+            ai_confirmed = session.last_ai_level is True
+
+        recent = recent[-self.stable_frames:]
+        if not ai_confirmed or len(recent) < self.stable_frames:
+            return False
+        recent.append(reading)
+        angles = [r[2] for r in recent]
+        return all(r[1] for r in recent) and max(angles) - min(angles) <= self.stable_max_spread
+
+    def record(self, session, decision: dict, ai_level_result: dict, latency: float = None):
+        """记录AI检查的结果（与OpenCV的"水平"判断是否一致）和耗时"""
+        with self._lock:
+            self.ai_checks += 1
+            if latency is not None:
+                self.ai_latency_total += latency
+                self.ai_latency_count += 1
+            if ai_level_result.get('fallback'):
+                # AI请求失败时的默认结果不代表AI的判断，不计入一致率
+                self.ai_failures += 1
+                return
+
+            agreed = bool(ai_level_result['is_level'])
+            self._agreements.append(agreed)
+            if not agreed:
+                self.ai_disagreements += 1
+            bucket = self.bucket_stats.setdefault(confidence_bucket(decision['confidence']),
+                                                  {'checks': 0, 'disagreements': 0})
+            bucket['checks'] += 1
+            bucket['disagreements'] += 0 if agreed else 1
+
+        with session.lock:
+            session.last_ai_level = agreed
+
+    def get_stats(self, include_recent: bool = False):
+        """获取级联策略统计信息"""
+        with self._lock:
+            total = sum(self.decisions.values())
+            # OpenCV认为水平的帧（原先每一帧都会请求AI检查）
+            candidates = total - self.decisions['sensor'] - self.decisions['tilt_detected']
+            skipped = sum(self.decisions[reason] for reason in CASCADE_SKIP_REASONS)
+            samples = len(self._agreements)
+            avg_latency = self.ai_latency_total / self.ai_latency_count if self.ai_latency_count else None
+            stats = {
+                'enabled': self.enabled,
+                'thresholds': {
+                    'high_confidence': self.high_confidence,
+                    'min_confidence': self.min_confidence,
+                    'stable_frames': self.stable_frames,
+                    'stable_max_spread': self.stable_max_spread,
+                    'agreement_threshold': self.agreement_threshold,
+                    'agreement_min_samples': self.agreement_min_samples,
+                    'audit_interval': self.audit_interval
+                },
+                'decisions': dict(self.decisions),
+                'total_decisions': total,
+                'skipped_checks': skipped,
+                'skip_rate': round(skipped / candidates, 3) if candidates else 0.0,
+                'ai_checks': self.ai_checks,
+                'ai_failures': self.ai_failures,
+                'ai_disagreements': self.ai_disagreements,
+                'agreement_rate': round(sum(self._agreements) / samples, 3) if samples else None,
+                'agreement_samples': samples,
+                'avg_ai_latency_seconds': round(avg_latency, 3) if avg_latency is not None else None,
+                # 跳过的检查按平均AI耗时估算节省的时间
+                'estimated_saved_seconds': round(skipped * avg_latency, 2) if avg_latency is not None else None,
+                'confidence_buckets': {
+                    name: dict(bucket, disagreement_rate=round(bucket['disagreements'] / bucket['checks'], 3))
+                    for name, bucket in sorted(self.bucket_stats.items())
+                }
+            }
+            if include_recent:
+                stats['recent_decisions'] = list(self._recent)
+        return stats
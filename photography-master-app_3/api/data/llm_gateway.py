@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+"""
+统一的模型调用网关
+PhotographyAgent 的所有模型调用（水平检查、建议、combined、流式建议）都经过 LLMGateway：
+
+- 连接池：同步和异步客户端各使用一个共享的 httpx 连接池（keep-alive），连接数、保活时间和连接超时见 Config.LLM_POOL_*
+- 调用类型配置：每种调用类型有自己的 max_tokens / temperature / timeout（见 Config.LLM_CALL_PROFILES），
+  调用方只负责构建消息
+- 模型路由：每种调用类型有按优先级排序的候选模型，每次请求由 ModelRouter 按观测到的延迟和错误率选择
+  （见 model_router.py），熔断中的模型不参与选择
+- 响应缓存：按 (调用类型, 候选模型, 规范化的文字, 图片哈希) 缓存响应，完全相同的请求在有效期内直接返回；
+  同一请求正在进行时，后到的相同请求等待并共用同一个响应（请求合并），不重复发送
+- 截止时间和重试：每种调用类型有总的截止时间（deadline），每次尝试的超时不超过剩余时间；
+  超时、连接错误、限流和5xx错误按带抖动的指数退避重试，剩余时间不足以再尝试一次时不再重试
+- 对冲请求：一次尝试超过该调用类型、该模型最近成功请求的p95延迟仍未返回时，再发出一个相同的请求，
+  先成功返回的结果生效（异步模式取消较慢的请求；同步模式较慢的请求在后台线程结束后丢弃）。
+  同步模式下主请求在单独的线程中执行，不受对冲线程池大小限制；对冲线程都在忙时不再排队，只等主请求
+- 熔断：每个 (模型, 调用类型) 一个熔断器（见 circuit_breaker.py），错误率或慢调用比例过高时
+  直接抛出 CircuitOpenError，不再占用连接和线程等待上游，调用方立即使用本地建议
+- 指标：按调用类型统计请求数、缓存命中、请求合并、错误、取消、重试、对冲、延迟分位数和token用量
+  （含服务商prompt缓存命中，见 prompt_usage.py）；延迟样本另按 (调用类型, 模型) 保存，供对冲使用
+
+流式请求不缓存、不合并也不对冲，只受截止时间和熔断器限制并统计指标（每收到一个chunk检查一次截止时间，
+逐字缓慢输出的模型超过截止时间后中止，关闭上游连接并按超时处理）；流式请求的延迟按首个chunk的时间计算
+（完整时长取决于生成的长度），单独统计，不计入非流式请求的延迟样本。
+
+调用方取消的调用（客户端断开时的 GeneratorExit / CancelledError 等）既不算成功也不算失败：
+不计入路由统计和熔断器（half_open 时归还探测名额），在指标中单独计为 cancelled。
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+from openai import (
+    OpenAI, AsyncOpenAI, APITimeoutError, APIConnectionError, RateLimitError, InternalServerError
+)
+
+from prompt_usage import PromptUsageTracker
+from circuit_breaker import CircuitOpenError
+from model_router import ModelRouter
+
+# 每种调用类型（以及每个 (调用类型, 模型)）保留的最近延迟样本数（计算分位数用）
+LATENCY_SAMPLES = 200
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 可以重试的错误：超时、连接错误、限流、服务端5xx
+RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError, TimeoutError)
+
+# 调用类型配置中不属于请求参数的字段
+PROFILE_POLICY_KEYS = ('deadline',)
+
+
+class DeadlineExceeded(TimeoutError):
+    """调用的截止时间已到，不再发起新的尝试"""
+
+
+def normalize_messages(messages: list) -> list:
+    """规范化消息用于缓存键：文字合并空白，图片替换为内容哈希"""
+    normalized = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            parts = []
+            for item in content:
+                if item.get('type') == 'image_url':
+                    url = item['image_url']['url']
+                    parts.append(['image', hashlib.sha256(url.encode('utf-8')).hexdigest()])
+                else:
+                    parts.append(['text', WHITESPACE_PATTERN.sub(' ', item.get('text', '')).strip()])
+            content = parts
+        elif isinstance(content, str):
+            content = WHITESPACE_PATTERN.sub(' ', content).strip()
+        normalized.append([message.get('role'), content])
+    return normalized
+
+
+def _current_task_cancelling() -> bool:
+    """当前任务是否正在被取消（Python 3.11+ 才能区分，更早的版本返回False）"""
+    task = asyncio.current_task()
+    return task is not None and hasattr(task, 'cancelling') and task.cancelling() > 0
+
+
+def percentile(samples, fraction: float):
+    """样本的分位数（样本为空时返回None）"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ResponseCache:
+    """按请求内容缓存模型响应（LRU + TTL，线程安全）"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, stored_at = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def set(self, key: str, response):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (response, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CallMetrics:
+    """单个调用类型的指标"""
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.first_chunk_latencies = deque(maxlen=LATENCY_SAMPLES)  # 流式请求的首个chunk延迟
+
+    def to_dict(self):
+        latencies = list(self.latencies)
+        first_chunk = list(self.first_chunk_latencies)
+        return {
+            'requests': self.requests,
+            'cache_hits': self.cache_hits,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'rejected': self.rejected,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'latency_p50': round(percentile(latencies, 0.5), 3) if latencies else None,
+            'latency_p95': round(percentile(latencies, 0.95), 3) if latencies else None,
+            'first_chunk_p50': round(percentile(first_chunk, 0.5), 3) if first_chunk else None,
+            'first_chunk_p95': round(percentile(first_chunk, 0.95), 3) if first_chunk else None
+        }
+
+
+class LLMGateway:
+    """模型调用网关：连接池、调用类型配置、模型路由、响应缓存、截止时间/重试/对冲、熔断和指标"""
+
+    def __init__(self, base_url: str, api_key: str, model: str, profiles: dict, routes: dict = None,
+                 explore_rate: float = 0.05,
+                 max_connections: int = 32, max_keepalive_connections: int = 16,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 5.0,
+                 cache_max_entries: int = 256, cache_ttl_seconds: float = 60.0,
+                 max_retries: int = 2, retry_base_delay: float = 0.25, retry_max_delay: float = 2.0,
+                 min_attempt_seconds: float = 1.0, hedge_enabled: bool = True, hedge_quantile: float = 0.95,
+                 hedge_min_samples: int = 20, hedge_min_delay: float = 0.5, hedge_workers: int = 8,
+                 circuit_breakers=None):
+        self.model = model
+        self.profiles = profiles
+        # routes 为 {调用类型: [候选模型, ...]}，没有配置的调用类型使用 model
+        self.router = ModelRouter(routes or {}, model, explore_rate=explore_rate)
+        # 熔断器注册表（CircuitBreakerRegistry），为None时不熔断
+        self.circuit_breakers = circuit_breakers
+
+        # 重试和对冲策略
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.min_attempt_seconds = min_attempt_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        # 同步模式下的对冲请求在这里执行；空闲名额用信号量计数，没有空闲线程时不对冲（排队的对冲请求没有意义）
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="llm-hedge")
+        self._hedge_slots = threading.BoundedSemaphore(hedge_workers)
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # 读超时由每次调用的 timeout 覆盖，这里只设置连接超时；重试由网关按截止时间控制，关闭SDK自带的重试
+        timeout = httpx.Timeout(60.0, connect=connect_timeout)
+        self.client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.Client(limits=limits, timeout=timeout)
+        )
+        # 异步客户端（异步服务器模式使用，等待模型响应时不占用线程）
+        self.async_client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=limits, timeout=timeout)
+        )
+
+        self.response_cache = ResponseCache(cache_max_entries, cache_ttl_seconds)
+        self.prompt_usage = PromptUsageTracker()
+
+        self._lock = threading.Lock()
+        self._metrics = {}
+        # (调用类型, 模型) -> 最近成功尝试的延迟（对冲等待时间按实际发送的模型计算，不混入其他候选模型）
+        self._model_latencies = {}
+        self._inflight = {}
+        self._inflight_async = {}
+
+    def params(self, call_type: str, messages: list, timeout: float = None, model: str = None) -> dict:
+        """按调用类型的配置构建请求参数（timeout 为本次尝试的超时，默认使用配置值；model 默认为第一个候选模型）"""
+        if call_type not in self.profiles:
+            raise ValueError(f"未知的模型调用类型: {call_type}")
+        params = {key: value for key, value in self.profiles[call_type].items() if key not in PROFILE_POLICY_KEYS}
+        if timeout is not None:
+            params['timeout'] = timeout
+        return dict(params, model=model or self.router.candidates(call_type)[0], messages=messages)
+
+    def deadline(self, call_type: str) -> float:
+        """调用的截止时间（时间戳）：配置了 deadline 时使用，否则为单次请求的超时"""
+        profile = self.profiles[call_type]
+        return time.time() + profile.get('deadline', profile['timeout'])
+
+    def _attempt_timeout(self, call_type: str, deadline: float) -> float:
+        """本次尝试的超时：不超过配置的超时和剩余时间"""
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"模型调用({call_type})已超过截止时间")
+        return min(self.profiles[call_type]['timeout'], remaining)
+
+    def _retry_delay(self, call_type: str, error: Exception, attempt: int, deadline: float):
+        """计算重试前的等待时间（带抖动的指数退避）；不可重试或剩余时间不足时返回None"""
+        if not isinstance(error, RETRYABLE_ERRORS) or isinstance(error, DeadlineExceeded):
+            return None
+        if attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+        if deadline - time.time() - delay < self.min_attempt_seconds:
+            return None
+        with self._lock:
+            self._metric(call_type).retries += 1
+        print(f"模型调用({call_type})失败，{delay:.2f}秒后重试 (第{attempt + 1}次): {error}")
+        return delay
+
+    def _hedge_delay(self, call_type: str, model: str, deadline: float):
+        """发出对冲请求前的等待时间：该模型最近成功请求的p95延迟；样本不足或剩余时间不够时返回None"""
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            latencies = list(self._model_latencies.get((call_type, model), ()))
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        delay = max(self.hedge_min_delay, percentile(latencies, self.hedge_quantile))
+        if deadline - time.time() - delay < self.min_attempt_seconds:
+            return None
+        return delay
+
+    def cache_key(self, call_type: str, messages: list) -> str:
+        """响应缓存键：调用类型 + 候选模型 + 规范化的消息内容（同一调用类型由哪个候选模型响应都可以复用）"""
+        normalized = json.dumps([call_type, self.router.candidates(call_type), normalize_messages(messages)],
+                                ensure_ascii=False)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _metric(self, call_type: str) -> CallMetrics:
+        metrics = self._metrics.get(call_type)
+        if metrics is None:
+            metrics = self._metrics.setdefault(call_type, CallMetrics())
+        return metrics
+
+    def _record(self, call_type: str, first_chunk: float = None, usage=None, error: bool = False,
+                cache_hit: bool = False, coalesced: bool = False, rejected: bool = False, cancelled: bool = False):
+        """记录一次调用（first_chunk 为成功的流式请求的首个chunk延迟；非流式请求的延迟由 _record_latency 按尝试记录）"""
+        with self._lock:
+            metrics = self._metric(call_type)
+            metrics.requests += 1
+            metrics.cache_hits += cache_hit
+            metrics.coalesced += coalesced
+            metrics.rejected += rejected
+            metrics.cancelled += cancelled
+            metrics.errors += error and not rejected
+            if first_chunk is not None and not error:
+                metrics.first_chunk_latencies.append(first_chunk)
+            if usage is not None:
+                metrics.prompt_tokens += int(getattr(usage, 'prompt_tokens', 0) or 0)
+                metrics.completion_tokens += int(getattr(usage, 'completion_tokens', 0) or 0)
+        if usage is not None:
+            self.prompt_usage.record(call_type, usage)
+
+    def complete(self, call_type: str, messages: list, cache: bool = True):
+        """同步调用模型，返回响应对象（失败时抛出异常）"""
+        key = self.cache_key(call_type, messages) if cache else None
+        if key:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record(call_type, cache_hit=True)
+                return cached
+
+            with self._lock:
+                pending = self._inflight.get(key)
+                if pending is None:
+                    future = self._inflight[key] = Future()
+            if pending is not None:
+                # 相同的请求正在进行，等待并共用其响应
+                self._record(call_type, coalesced=True)
+                return pending.result()
+
+        try:
+            response = self._request(call_type, messages)
+        except BaseException as e:
+            # 包括 KeyboardInterrupt 等非 Exception 的异常：合并的请求必须结束，否则等待者会一直阻塞
+            if isinstance(e, Exception):
+                self._record(call_type, error=True, rejected=isinstance(e, CircuitOpenError))
+            else:
+                self._record(call_type, cancelled=True)
+            if key:
+                self._finish_inflight(self._inflight, key, future, error=e)
+            raise
+
+        self._record(call_type, usage=getattr(response, 'usage', None))
+        if key:
+            self.response_cache.set(key, response)
+            self._finish_inflight(self._inflight, key, future, response=response)
+        return response
+
+    async def complete_async(self, call_type: str, messages: list, cache: bool = True):
+        """异步调用模型，返回响应对象（失败时抛出异常）"""
+        key = self.cache_key(call_type, messages) if cache else None
+        if key:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record(call_type, cache_hit=True)
+                return cached
+
+            pending = self._inflight_async.get(key)
+            if pending is not None and not pending.get_loop().is_closed():
+                self._record(call_type, coalesced=True)
+                try:
+                    return await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    # 发起请求的调用方被取消（如WebSocket客户端断开）时 pending 被取消，
+                    # 本调用方没有被取消，重新发起请求（或加入新的合并请求）
+                    if not pending.cancelled() or _current_task_cancelling():
+                        raise
+                    return await self.complete_async(call_type, messages, cache)
+            future = self._inflight_async[key] = asyncio.get_running_loop().create_future()
+
+        try:
+            response = await self._request_async(call_type, messages)
+        except BaseException as e:
+            # 包括 CancelledError：否则合并的请求不会结束，等待者会一直阻塞
+            if isinstance(e, Exception):
+                self._record(call_type, error=True, rejected=isinstance(e, CircuitOpenError))
+            else:
+                self._record(call_type, cancelled=True)
+            if key:
+                self._finish_inflight(self._inflight_async, key, future, error=e)
+            raise
+
+        self._record(call_type, usage=getattr(response, 'usage', None))
+        if key:
+            self.response_cache.set(key, response)
+            self._finish_inflight(self._inflight_async, key, future, response=response)
+        return response
+
+    def _attempt(self, call_type: str, messages: list, deadline: float, model: str):
+        """发起一次上游请求，成功时记录延迟"""
+        timeout = self._attempt_timeout(call_type, deadline)
+        start = time.time()
+        response = self.client.chat.completions.create(**self.params(call_type, messages, timeout, model))
+        self._record_latency(call_type, model, time.time() - start)
+        return response
+
+    async def _attempt_async(self, call_type: str, messages: list, deadline: float, model: str):
+        timeout = self._attempt_timeout(call_type, deadline)
+        start = time.time()
+        response = await self.async_client.chat.completions.create(**self.params(call_type, messages, timeout,
+                                                                                 model))
+        self._record_latency(call_type, model, time.time() - start)
+        return response
+
+    def _record_latency(self, call_type: str, model: str, latency: float):
+        """记录一次成功尝试的延迟：调用类型的统计和 (调用类型, 模型) 的对冲样本"""
+        with self._lock:
+            self._metric(call_type).latencies.append(latency)
+            samples = self._model_latencies.get((call_type, model))
+            if samples is None:
+                samples = self._model_latencies[(call_type, model)] = deque(maxlen=LATENCY_SAMPLES)
+            samples.append(latency)
+
+    def breaker(self, call_type: str, model: str = None):
+        """调用类型和模型（默认为第一个候选模型）的熔断器（未启用熔断时返回None）"""
+        if self.circuit_breakers is None or not self.circuit_breakers.enabled:
+            return None
+        return self.circuit_breakers.get(model or self.router.candidates(call_type)[0], call_type)
+
+    def degraded(self, call_type: str) -> bool:
+        """该调用类型的所有候选模型是否都在熔断中"""
+        return all(self._rejecting(call_type, model) for model in self.router.candidates(call_type))
+
+    def _rejecting(self, call_type: str, model: str) -> bool:
+        breaker = self.breaker(call_type, model)
+        return breaker is not None and breaker.rejecting()
+
+    def _route(self, call_type: str) -> str:
+        """选择本次请求的模型（跳过熔断中的模型）"""
+        model, _ = self.router.choose(call_type, available=lambda candidate: not self._rejecting(call_type, candidate))
+        return model
+
+    def _admit(self, call_type: str, model: str):
+        """熔断器打开时直接抛出 CircuitOpenError，否则返回熔断器（可能为None）"""
+        breaker = self.breaker(call_type, model)
+        if breaker is not None:
+            breaker.allow()
+        return breaker
+
+    def _settle(self, call_type: str, model: str, breaker, start: float, error: Exception = None,
+                latency: float = None):
+        """把一次调用（含重试和对冲）的结果计入路由统计和熔断器（latency 默认为从 start 到现在的时长）
+
+        路由统计中任何错误都算失败（如模型不存在）；熔断器只把超时、连接错误、限流和5xx算作失败，
+        其他错误说明服务能正常响应
+        """
+        latency = latency if latency is not None else time.time() - start
+        self.router.record(call_type, model, latency, error is None)
+        if breaker is not None:
+            breaker.record(not isinstance(error, RETRYABLE_ERRORS), latency)
+
+    @staticmethod
+    def _abandon(breaker):
+        """调用被调用方取消：不计入路由统计和熔断器，只归还熔断器的探测名额"""
+        if breaker is not None:
+            breaker.abandon()
+
+    def _request(self, call_type: str, messages: list):
+        """带模型路由、熔断、截止时间、重试和对冲的上游请求（同步）"""
+        model = self._route(call_type)
+        breaker = self._admit(call_type, model)
+        start = time.time()
+        try:
+            response = self._retrying(call_type, messages, model)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self._settle(call_type, model, breaker, start, e)
+            else:
+                self._abandon(breaker)
+            raise
+        self._settle(call_type, model, breaker, start)
+        return response
+
+    async def _request_async(self, call_type: str, messages: list):
+        """带模型路由、熔断、截止时间、重试和对冲的上游请求（异步）"""
+        model = self._route(call_type)
+        breaker = self._admit(call_type, model)
+        start = time.time()
+        try:
+            response = await self._retrying_async(call_type, messages, model)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self._settle(call_type, model, breaker, start, e)
+            else:
+                self._abandon(breaker)
+            raise
+        self._settle(call_type, model, breaker, start)
+        return response
+
+    def _retrying(self, call_type: str, messages: list, model: str):
+        deadline = self.deadline(call_type)
+        attempt = 0
+        while True:
+            try:
+                return self._hedged(call_type, messages, deadline, model)
+            except Exception as e:
+                delay = self._retry_delay(call_type, e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    async def _retrying_async(self, call_type: str, messages: list, model: str):
+        deadline = self.deadline(call_type)
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_async(call_type, messages, deadline, model)
+            except Exception as e:
+                delay = self._retry_delay(call_type, e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _hedged(self, call_type: str, messages: list, deadline: float, model: str):
+        """主请求超过p95延迟仍未返回时发出对冲请求，返回先成功的结果"""
+        hedge_delay = self._hedge_delay(call_type, model, deadline)
+        if hedge_delay is None:
+            return self._attempt(call_type, messages, deadline, model)
+
+        primary = self._start_primary(call_type, messages, deadline, model)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        if not self._hedge_slots.acquire(blocking=False):
+            return primary.result()
+        try:
+            hedge = self._hedge_executor.submit(self._attempt, call_type, messages, deadline, model)
+        except BaseException:
+            self._hedge_slots.release()
+            raise
+        hedge.add_done_callback(lambda _: self._hedge_slots.release())
+        with self._lock:
+            self._metric(call_type).hedged += 1
+        return self._first_success(call_type, primary, hedge)
+
+    def _start_primary(self, call_type: str, messages: list, deadline: float, model: str) -> Future:
+        """在单独的线程中发起主请求（不经过对冲线程池，并发的同步调用不会排队等待线程）"""
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(self._attempt(call_type, messages, deadline, model))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="llm-primary", daemon=True).start()
+        return future
+
+    def _first_success(self, call_type: str, primary, hedge):
+        pending, first_error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self._metric(call_type).hedge_wins += 1
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    async def _hedged_async(self, call_type: str, messages: list, deadline: float, model: str):
+        """对冲请求的异步版本：先成功的结果生效，取消另一个请求"""
+        hedge_delay = self._hedge_delay(call_type, model, deadline)
+        if hedge_delay is None:
+            return await self._attempt_async(call_type, messages, deadline, model)
+
+        primary = asyncio.ensure_future(self._attempt_async(call_type, messages, deadline, model))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            hedge = asyncio.ensure_future(self._attempt_async(call_type, messages, deadline, model))
+            tasks.append(hedge)
+            with self._lock:
+                self._metric(call_type).hedged += 1
+            pending, first_error = {primary, hedge}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self._metric(call_type).hedge_wins += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            # 已有结果、出错或调用方被取消时，都取消还在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _finish_inflight(self, inflight: dict, key: str, future, response=None, error: BaseException = None):
+        with self._lock:
+            if inflight.get(key) is future:
+                del inflight[key]
+        if isinstance(error, asyncio.CancelledError) and isinstance(future, asyncio.Future):
+            # 发起请求的调用方被取消：取消 future，等待者各自重新发起请求
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+            # 没有等待者时避免“异常未被获取”的警告
+            if isinstance(future, asyncio.Future):
+                future.exception()
+        else:
+            future.set_result(response)
+
+    def stream(self, call_type: str, messages: list):
+        """同步流式调用，逐个产出chunk（最后一个chunk包含usage）
+
+        路由统计、熔断器的慢调用判断和延迟指标都使用首个chunk的延迟，不使用完整的生成时长；
+        每收到一个chunk检查调用类型的截止时间，超过后关闭上游流并抛出 DeadlineExceeded
+        """
+        start = time.time()
+        first_chunk = None
+        usage = None
+        breaker = None
+        model = self._route(call_type)
+        try:
+            breaker = self._admit(call_type, model)
+            deadline = self.deadline(call_type)
+            timeout = self._attempt_timeout(call_type, deadline)
+            stream = self.client.chat.completions.create(**self.params(call_type, messages, timeout, model),
+                                                         stream=True, stream_options={"include_usage": True})
+            for chunk in stream:
+                if first_chunk is None:
+                    first_chunk = time.time() - start
+                if time.time() > deadline:
+                    stream.close()
+                    raise DeadlineExceeded(f"流式模型调用({call_type})已超过截止时间")
+                usage = getattr(chunk, 'usage', None) or usage
+                yield chunk
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # 客户端中途断开（GeneratorExit / CancelledError）：不算成功也不算失败
+                self._abandon(breaker)
+                self._record(call_type, cancelled=True)
+            else:
+                if not isinstance(e, CircuitOpenError):
+                    self._settle(call_type, model, breaker, start, e)
+                self._record(call_type, error=True, rejected=isinstance(e, CircuitOpenError))
+            raise
+        self._settle(call_type, model, breaker, start, latency=first_chunk)
+        self._record(call_type, first_chunk=first_chunk, usage=usage)
+
+    async def stream_async(self, call_type: str, messages: list):
+        """异步流式调用，逐个产出chunk（截止时间和延迟的统计方式与 stream 相同）"""
+        start = time.time()
+        first_chunk = None
+        usage = None
+        breaker = None
+        model = self._route(call_type)
+        try:
+            breaker = self._admit(call_type, model)
+            deadline = self.deadline(call_type)
+            timeout = self._attempt_timeout(call_type, deadline)
+            stream = await self.async_client.chat.completions.create(**self.params(call_type, messages, timeout,
+                                                                                   model),
+                                                                     stream=True,
+                                                                     stream_options={"include_usage": True})
+            async for chunk in stream:
+                if first_chunk is None:
+                    first_chunk = time.time() - start
+                if time.time() > deadline:
+                    await stream.close()
+                    raise DeadlineExceeded(f"流式模型调用({call_type})已超过截止时间")
+                usage = getattr(chunk, 'usage', None) or usage
+                yield chunk
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # 客户端中途断开（GeneratorExit / CancelledError）：不算成功也不算失败
+                self._abandon(breaker)
+                self._record(call_type, cancelled=True)
+            else:
+                if not isinstance(e, CircuitOpenError):
+                    self._settle(call_type, model, breaker, start, e)
+                self._record(call_type, error=True, rejected=isinstance(e, CircuitOpenError))
+            raise
+        self._settle(call_type, model, breaker, start, latency=first_chunk)
+        self._record(call_type, first_chunk=first_chunk, usage=usage)
+
+    def get_stats(self):
+        """获取网关统计信息"""
+        with self._lock:
+            calls = {call_type: metrics.to_dict() for call_type, metrics in self._metrics.items()}
+            model_latencies = {f"{model}:{call_type}": list(samples)
+                               for (call_type, model), samples in self._model_latencies.items()}
+            inflight = len(self._inflight) + len(self._inflight_async)
+        return {
+            'model': self.model,
+            'routes': self.router.get_stats(),
+            'profiles': self.profiles,
+            'calls': calls,
+            # 各 (模型:调用类型) 的延迟分位数（对冲等待时间基于p95）
+            'model_latency': {
+                name: {'samples': len(samples), 'p50': round(percentile(samples, 0.5), 3),
+                       'p95': round(percentile(samples, 0.95), 3)}
+                for name, samples in model_latencies.items()
+            },
+            'inflight': inflight,
+            'response_cache_entries': len(self.response_cache),
+            'prompt_usage': self.prompt_usage.get_stats(),
+            'circuit_breakers': self.circuit_breakers.get_stats() if self.circuit_breakers else None
+        }
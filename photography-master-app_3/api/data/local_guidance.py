@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+本地规则建议引擎
+不调用模型，根据OpenCV计算的画面特征（见 image_features.py）在几毫秒内生成拍摄建议，
+格式与AI建议相同（step / action / direction / intensity / reason）。用于：
+
+- local 模式（节省模式）：所有建议都由本地生成
+- 降级：模型调用失败、超时或熔断时替代AI建议
+
+每条规则根据特征给出严重程度（0~1），乘以该拍摄意图类别下规则的权重后排序：
+
+- exposure：过暗、高光/暗部溢出，建议转向光线更合适的一侧
+- sharpness：画面模糊，建议持稳手机
+- subject：主体位置，按拍摄意图移向三分线（人像眼睛在上三分线，建筑保持居中对称）
+- balance：没有明显主体时，画面左右元素失衡
+- horizon：地平线在画面正中时，按天空是否空旷移到上/下三分线
+- pitch：设备传感器俯仰角（建筑避免仰拍变形，美食建议从斜上方拍）
+
+水平校正不在这里生成：由 PhotographyAgent 按传感器/OpenCV的倾斜结果作为第1条建议合并。
+规则建议不足时用该类别的通用建议补足。
+"""
+
+import math
+
+# 拍摄意图类别及其关键词（按顺序匹配，都不匹配时为general）
+INTENT_CATEGORIES = (
+    ('portrait', ('人像', '肖像', '人物', '自拍', '合影')),
+    ('landscape', ('风景', '景观', '日落', '日出', '山', '海', '天空')),
+    ('food', ('美食', '食物', '菜', '甜点', '饮品')),
+    ('architecture', ('建筑', '楼', '街景', '室内')),
+)
+
+# 每个类别下各规则的权重（0表示不使用该规则）
+RULE_WEIGHTS = {
+    'general': {'exposure': 1.0, 'sharpness': 1.0, 'subject': 0.8, 'balance': 0.6, 'horizon': 0.6, 'pitch': 0.4},
+    'portrait': {'exposure': 1.0, 'sharpness': 1.0, 'subject': 1.0, 'balance': 0.4, 'horizon': 0.3, 'pitch': 0.5},
+    'landscape': {'exposure': 0.9, 'sharpness': 0.8, 'subject': 0.5, 'balance': 0.7, 'horizon': 1.0, 'pitch': 0.3},
+    'food': {'exposure': 1.0, 'sharpness': 1.0, 'subject': 0.6, 'balance': 0.3, 'horizon': 0.0, 'pitch': 0.9},
+    'architecture': {'exposure': 0.8, 'sharpness': 0.8, 'subject': 0.6, 'balance': 0.8, 'horizon': 0.3, 'pitch': 1.0},
+}
+
+# 规则阈值（显著性/构图相关的阈值按 images/ 下的实拍截图和合成场景校准）
+DARK_BRIGHTNESS = 50  # 平均亮度低于该值视为过暗（与 categorize_brightness 的“昏暗”一致）
+HIGHLIGHT_CLIP_RATIO = 0.05  # 高光溢出像素比例
+SHADOW_CLIP_RATIO = 0.15  # 暗部溢出像素比例（亮度<16），实拍昏暗室内约0.19、正常光线约0.12
+BLUR_SHARPNESS = 100  # 拉普拉斯方差低于该值视为模糊（与 categorize_sharpness 的“模糊”一致）
+LIGHT_SIDE_MIN = 0.03  # 左右亮度差超过该值才建议转向某一侧
+# 显著区域离散程度超过该值视为没有明显主体：单个主体的离散度约等于其半径（半径0.35时约0.35），
+# 没有主体的纯色/纹理画面约0.41~0.45，实拍截图约0.32~0.35
+SUBJECT_MAX_SPREAD = 0.36
+SUBJECT_MIN_OFFSET = 0.08  # 主体偏离目标位置超过该值才建议移动
+BALANCE_MIN = 0.25  # 左右梯度权重差超过该值视为失衡
+HORIZON_MIN_COVERAGE = 0.5  # 水平边缘覆盖超过画面宽度的一半才视为地平线
+HORIZON_CENTER_BAND = 0.08  # 地平线距画面中线不超过该值视为“居中”
+PITCH_MAX_ARCHITECTURE = 10  # 拍建筑时俯仰角超过该值会产生透视变形（度）
+PITCH_FOOD_OVERHEAD = -20  # 拍美食时俯仰角高于该值说明几乎是平拍（度，俯拍为负）
+
+# 通用建议（规则建议不足时补足，按类别在前、通用在后的顺序；general 的条数不少于 Config.MAX_ADVICE_ITEMS，
+# 保证没有规则触发时也能补满）
+GENERIC_TIPS = {
+    'portrait': [
+        ("把手机降到人物眼睛的高度，平视拍摄", "down", 2, "平视角度让人像更自然"),
+        ("让人物离背景远一些，背景更简洁", "right", 2, "突出人物主体"),
+    ],
+    'landscape': [
+        ("寻找前景元素（树枝、岩石）放进画面下方", "down", 2, "增加风景的层次和纵深"),
+        ("横向拿手机，容纳更宽的视野", "right", 2, "展现风景的开阔感"),
+    ],
+    'food': [
+        ("靠近窗边的自然光，从侧后方打光", "left", 2, "侧逆光突出食物的质感"),
+        ("靠近一点，让食物占满画面的大部分", "down", 2, "突出美食的细节"),
+    ],
+    'architecture': [
+        ("后退几步，把建筑完整放进画面", "down", 3, "保持建筑的完整轮廓"),
+        ("对准建筑的中轴线，保持左右对称", "left", 1, "对称构图体现建筑的秩序感"),
+    ],
+    'general': [
+        ("调整拍摄角度，寻找最佳构图位置", "left", 3, "优化构图布局"),
+        ("调整拍摄高度，尝试不同视角", "down", 2, "增加画面层次感"),
+        ("调整焦距，突出主体元素", "up", 2, "增强主体表现力"),
+        ("微调位置，平衡画面元素", "right", 2, "完善整体构图"),
+        ("靠近主体一些，减少画面边缘的杂物", "down", 2, "画面更简洁，主体更突出"),
+        ("点击屏幕上的主体，重新对焦和测光", "up", 1, "让主体清晰、曝光准确"),
+    ],
+}
+
+
+def intent_category(intent: str = None) -> str:
+    """拍摄意图所属的类别"""
+    if intent:
+        for category, keywords in INTENT_CATEGORIES:
+            if any(keyword in intent for keyword in keywords):
+                return category
+    return 'general'
+
+
+def _suggestion(action: str, direction: str, intensity: int, reason: str) -> dict:
+    return {"step": 0, "action": action, "direction": direction, "intensity": intensity, "reason": reason}
+
+
+def _intensity(severity: float) -> int:
+    """严重程度（0~1）转换为强度（1~5）"""
+    return max(1, min(5, 1 + int(severity * 4)))
+
+
+def _toward_light(composition: dict):
+    """光线更亮的一侧对应的方向（左右亮度差不明显时返回None）"""
+    light_x = composition.get('light_x', 0.0)
+    if abs(light_x) < LIGHT_SIDE_MIN:
+        return None
+    return 'right' if light_x > 0 else 'left'
+
+
+def _camera_direction(dx: float, dy: float) -> str:
+    """把主体在画面中移动 (dx, dy) 需要的手机移动方向（手机与画面内容的移动方向相反）"""
+    horizontal = ('left' if dx > 0 else 'right') if abs(dx) >= SUBJECT_MIN_OFFSET else None
+    vertical = ('up' if dy > 0 else 'down') if abs(dy) >= SUBJECT_MIN_OFFSET else None
+    if horizontal and vertical:
+        return f"{horizontal}_{vertical}"
+    return horizontal or vertical
+
+
+class LocalGuidanceEngine:
+    """根据画面特征和拍摄意图生成排序后的本地建议"""
+
+    def __init__(self, max_items: int = 5):
+        self.max_items = max_items
+        self.rules = {
+            'exposure': self._exposure,
+            'sharpness': self._sharpness,
+            'subject': self._subject,
+            'balance': self._balance,
+            'horizon': self._horizon,
+            'pitch': self._pitch,
+        }
+
+    def suggest(self, analysis: dict, intent: str = None, limit: int = None) -> list:
+        """生成建议列表（按重要程度排序，step从1开始编号）"""
+        category = intent_category(intent)
+        weights = RULE_WEIGHTS[category]
+        composition = analysis.get('composition') or {}
+
+        candidates = []
+        for name, rule in self.rules.items():
+            if not weights.get(name):
+                continue
+            for severity, suggestion in rule(analysis, composition, category):
+                candidates.append((severity * weights[name], suggestion))
+        candidates.sort(key=lambda item: item[0], reverse=True)
+
+        suggestions = [suggestion for _, suggestion in candidates]
+        for tips in (GENERIC_TIPS.get(category, []), GENERIC_TIPS['general']):
+            suggestions.extend(_suggestion(*tip) for tip in tips)
+
+        limit = limit or self.max_items
+        result = []
+        for suggestion in suggestions:
+            if len(result) >= limit:
+                break
+            if any(existing['action'] == suggestion['action'] for existing in result):
+                continue
+            result.append(dict(suggestion, step=len(result) + 1))
+        return result
+
+    def _exposure(self, analysis: dict, composition: dict, category: str) -> list:
+        results = []
+        brightness = analysis.get('brightness', 128)
+        highlights = analysis.get('highlights_clipped', 0.0)
+        shadows = analysis.get('shadows_clipped', 0.0)
+        toward_light = _toward_light(composition)
+
+        if highlights > HIGHLIGHT_CLIP_RATIO:
+            severity = min(1.0, highlights / (HIGHLIGHT_CLIP_RATIO * 4))
+            # 背离更亮的一侧，把过曝的区域移出画面
+            direction = {'left': 'right', 'right': 'left'}.get(toward_light, 'down')
+            results.append((severity, _suggestion(
+                "避开强光，把过亮的区域移出画面", direction, _intensity(severity), "画面高光过曝，细节丢失")))
+
+        if brightness < DARK_BRIGHTNESS or shadows > SHADOW_CLIP_RATIO:
+            severity = max(1 - brightness / DARK_BRIGHTNESS if brightness < DARK_BRIGHTNESS else 0.0,
+                           min(1.0, shadows / (SHADOW_CLIP_RATIO * 2)))
+            if category == 'food':
+                action, reason = "把食物移到靠窗或光线更好的位置", "光线不足，食物颜色不诱人"
+            elif category == 'portrait':
+                action, reason = "让人物转向光源，脸部迎着光", "光线不足，人物面部偏暗"
+            else:
+                action, reason = "转向光线更亮的一侧，让画面更明亮", "画面偏暗，暗部细节丢失"
+            results.append((severity, _suggestion(action, toward_light or 'up', _intensity(severity), reason)))
+        return results
+
+    def _sharpness(self, analysis: dict, composition: dict, category: str) -> list:
+        sharpness = analysis.get('sharpness')
+        if sharpness is None or sharpness >= BLUR_SHARPNESS:
+            return []
+        severity = 1 - sharpness / BLUR_SHARPNESS
+        return [(severity, _suggestion(
+            "双手持稳手机，手肘贴紧身体，点击主体重新对焦", "down", 1, "画面有些模糊，持稳后更清晰"))]
+
+    def _subject(self, analysis: dict, composition: dict, category: str) -> list:
+        if not composition or composition.get('subject_spread', 1.0) > SUBJECT_MAX_SPREAD:
+            return []
+        x, y = composition['subject_x'], composition['subject_y']
+
+        if category == 'architecture':
+            # 建筑保持水平居中对称，只看左右
+            target_x, target_y = 0.5, y
+            reason = "建筑居中更能体现对称美"
+        elif category == 'food':
+            # 美食居中即可，只在偏到边缘时调整
+            target_x, target_y = 0.5, 0.5
+            if math.hypot(x - 0.5, y - 0.5) < 0.2:
+                return []
+            reason = "让美食回到画面中心"
+        else:
+            target_x = 1 / 3 if x < 0.5 else 2 / 3
+            # 人像让眼睛（主体上部）落在上三分线
+            target_y = 1 / 3 if category == 'portrait' or y < 0.5 else 2 / 3
+            reason = "主体放在三分线交点，构图更有张力" if category != 'portrait' else "人物眼睛在上三分线更自然"
+
+        dx, dy = target_x - x, target_y - y
+        direction = _camera_direction(dx, dy)
+        if direction is None:
+            return []
+        distance = math.hypot(dx, dy)
+        severity = min(1.0, distance / 0.3)
+        place = '左侧' if target_x < 0.45 else '右侧' if target_x > 0.55 else '中间'
+        action = f"手机向{self._direction_name(direction)}移动一点，把主体放到画面{place}"
+        return [(severity, _suggestion(action, direction, _intensity(severity), reason))]
+
+    def _balance(self, analysis: dict, composition: dict, category: str) -> list:
+        if not composition or composition.get('subject_spread', 1.0) <= SUBJECT_MAX_SPREAD:
+            # 有明显主体时由主体位置规则处理
+            return []
+        balance = composition.get('balance_x', 0.0)
+        if abs(balance) < BALANCE_MIN:
+            return []
+        heavy, direction = ('右', 'left') if balance > 0 else ('左', 'right')
+        severity = min(1.0, abs(balance) / (BALANCE_MIN * 2))
+        return [(severity, _suggestion(
+            f"画面{heavy}侧元素偏多，手机向{self._direction_name(direction)}平移一点",
+            direction, _intensity(severity * 0.6), "让画面左右更平衡"))]
+
+    def _horizon(self, analysis: dict, composition: dict, category: str) -> list:
+        if not composition or composition.get('horizon_coverage', 0.0) < HORIZON_MIN_COVERAGE:
+            return []
+        offset = composition['horizon_y'] - 0.5
+        if abs(offset) > HORIZON_CENTER_BAND:
+            return []
+        severity = 1 - abs(offset) / HORIZON_CENTER_BAND * 0.5
+        if composition.get('top_texture', 0.0) < composition.get('bottom_texture', 0.0) * 0.5:
+            # 天空空旷：手机向下，地平线上移到上三分线，多拍地面景物
+            return [(severity, _suggestion(
+                "手机稍微向下，让地平线落在画面上三分之一处", "down", 2, "天空比较空，多留地面景物更充实"))]
+        return [(severity, _suggestion(
+            "手机稍微向上，让地平线落在画面下三分之一处", "up", 2, "地平线避免居中，多留天空更开阔"))]
+
+    def _pitch(self, analysis: dict, composition: dict, category: str) -> list:
+        pitch = analysis.get('pitch')
+        if pitch is None:
+            return []
+        if category == 'food':
+            if pitch <= PITCH_FOOD_OVERHEAD:
+                return []
+            severity = min(1.0, (pitch - PITCH_FOOD_OVERHEAD) / 40)
+            return [(severity, _suggestion(
+                "举高手机，从斜上方45度或正上方俯拍", "up", _intensity(severity), "俯拍能展现美食的全貌和摆盘"))]
+        if abs(pitch) <= PITCH_MAX_ARCHITECTURE:
+            return []
+        severity = min(1.0, (abs(pitch) - PITCH_MAX_ARCHITECTURE) / 30)
+        direction = 'down' if pitch > 0 else 'up'
+        reason = "仰拍或俯拍会让建筑线条倾斜变形" if category == 'architecture' else "镜头过于倾斜，画面透视夸张"
+        return [(severity, _suggestion(
+            f"手机稍微向{self._direction_name(direction)}回正，保持竖直", direction, _intensity(severity), reason))]
+
+    @staticmethod
+    def _direction_name(direction: str) -> str:
+        return {
+            'up': '上', 'down': '下', 'left': '左', 'right': '右',
+            'left_up': '左上', 'left_down': '左下', 'right_up': '右上', 'right_down': '右下'
+        }[direction]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+按调用类型选择模型的路由器
+每种调用类型（level / suggestions / combined）配置一个按优先级排序的候选模型列表（见 Config.LLM_ROUTES）。
+只需要回答一个词的水平检查可以交给便宜、快速的模型，把主模型的容量留给建议请求。
+
+选择方法（每次请求选一次，重试和对冲沿用同一个模型）：
+
+- 按候选顺序过滤掉熔断中的模型（由网关传入 available）和最近错误率超过 max_error_rate 的模型
+- 样本数达到 min_samples 的模型按“期望成功耗时” 延迟EWMA / (1 - 错误率EWMA) 打分，选分数最低的；
+  都没有足够样本时选排在最前面的模型
+- 探测预算：explore_rate 比例的请求随机改选其他未熔断的模型，让延迟和错误率的统计保持更新，
+  错误率过高的模型恢复后也能重新被选中
+
+选择结果（模型和原因：only / best / preferred / explore / fallback）记录在统计信息中，
+实际响应的模型由 PhotographyAgent 写入返回结果的 meta.models。
+"""
+
+import random
+import threading
+
+# 选择原因
+REASON_ONLY = 'only'  # 只有一个候选模型
+REASON_BEST = 'best'  # 统计分数最低
+REASON_PREFERRED = 'preferred'  # 样本不足，按候选顺序
+REASON_EXPLORE = 'explore'  # 探测预算
+REASON_FALLBACK = 'fallback'  # 所有候选都不可用，使用第一个（由熔断器决定是否拒绝）
+
+
+class RouteStats:
+    """单个 (调用类型, 模型) 的统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.chosen = {}
+
+    def score(self):
+        """期望成功耗时（秒），没有延迟样本时返回None"""
+        if self.latency_ewma is None:
+            return None
+        return self.latency_ewma / max(1.0 - self.error_ewma, 0.01)
+
+    def to_dict(self):
+        score = self.score()
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'error_ewma': round(self.error_ewma, 3),
+            'score': round(score, 3) if score is not None else None,
+            'chosen': dict(self.chosen)
+        }
+
+
+class ModelRouter:
+    """按观测到的延迟和错误率为每种调用类型选择模型（线程安全）"""
+
+    def __init__(self, routes: dict, default_model: str, explore_rate: float = 0.05, ewma_alpha: float = 0.2,
+                 min_samples: int = 3, max_error_rate: float = 0.5):
+        self.default_model = default_model
+        self.routes = {call_type: list(dict.fromkeys(models)) for call_type, models in routes.items() if models}
+        self.explore_rate = explore_rate
+        self.ewma_alpha = ewma_alpha
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def candidates(self, call_type: str) -> list:
+        """调用类型的候选模型（按优先级）；没有配置时使用默认模型"""
+        return self.routes.get(call_type) or [self.default_model]
+
+    def _route_stats(self, call_type: str, model: str) -> RouteStats:
+        stats = self._stats.get((call_type, model))
+        if stats is None:
+            stats = self._stats[(call_type, model)] = RouteStats()
+        return stats
+
+    def choose(self, call_type: str, available=None) -> tuple:
+        """选择模型，返回 (模型, 原因)；available(model) 返回False的模型（如熔断中）不参与选择"""
+        candidates = self.candidates(call_type)
+        if len(candidates) == 1:
+            return self._chosen(call_type, candidates[0], REASON_ONLY)
+
+        healthy = [model for model in candidates if available is None or available(model)]
+        if not healthy:
+            return self._chosen(call_type, candidates[0], REASON_FALLBACK)
+
+        with self._lock:
+            stats = {model: self._route_stats(call_type, model) for model in healthy}
+        usable = [model for model in healthy if stats[model].error_ewma <= self.max_error_rate] or healthy
+
+        scored = [(stats[model].score(), index, model) for index, model in enumerate(usable)
+                  if stats[model].requests >= self.min_samples and stats[model].score() is not None]
+        model, reason = (min(scored)[2], REASON_BEST) if scored else (usable[0], REASON_PREFERRED)
+
+        others = [candidate for candidate in healthy if candidate != model]
+        if others and random.random() < self.explore_rate:
+            # 包括错误率过高的模型，恢复后可以重新被选中
+            model, reason = random.choice(others), REASON_EXPLORE
+        return self._chosen(call_type, model, reason)
+
+    def _chosen(self, call_type: str, model: str, reason: str) -> tuple:
+        with self._lock:
+            stats = self._route_stats(call_type, model)
+            stats.chosen[reason] = stats.chosen.get(reason, 0) + 1
+        return model, reason
+
+    def record(self, call_type: str, model: str, latency: float, success: bool):
+        """记录一次请求（含重试和对冲）的结果：成功时更新延迟EWMA，失败和成功都更新错误率EWMA"""
+        with self._lock:
+            stats = self._route_stats(call_type, model)
+            stats.requests += 1
+            stats.errors += not success
+            stats.error_ewma += self.ewma_alpha * ((0.0 if success else 1.0) - stats.error_ewma)
+            if success:
+                if stats.latency_ewma is None:
+                    stats.latency_ewma = latency
+                else:
+                    stats.latency_ewma += self.ewma_alpha * (latency - stats.latency_ewma)
+
+    def get_stats(self):
+        """获取每种调用类型的候选模型和统计"""
+        with self._lock:
+            stats = {key: value.to_dict() for key, value in self._stats.items()}
+        call_types = set(self.routes) | {call_type for call_type, _ in stats}
+        return {
+            call_type: {
+                'candidates': self.candidates(call_type),
+                'models': {model: stats[(call_type, model)] for model in self.candidates(call_type)
+                           if (call_type, model) in stats}
+            }
+            for call_type in sorted(call_types)
+        }
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+感知哈希缓存
+用画面的差值哈希（dHash）代替精确的内容哈希作为缓存键：手持手机对着同一场景时，
+相邻帧像素略有不同但dHash只差几位，按汉明距离查找近似重复帧即可复用最近的建议。
+
+近似查找使用多索引哈希（multi-index hashing）：把64位哈希切成 阈值+1 段，
+由抽屉原理，汉明距离不超过阈值的两个哈希至少有一段完全相同，
+因此只需比较与查询哈希某一段相同的候选项，无需遍历全部缓存。
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+
+
+def dhash(gray_image) -> int:
+    """计算灰度图的差值哈希（64位整数）：缩小到 9x8 后比较左右相邻像素的明暗"""
+    small = cv2.resize(gray_image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希之间的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def hash_blocks(max_distance: int) -> list:
+    """多索引哈希的分段：阈值+1段，尽量等长，返回每段的 (偏移, 掩码)"""
+    block_count = max_distance + 1
+    sizes = [HASH_BITS // block_count + (1 if i < HASH_BITS % block_count else 0) for i in range(block_count)]
+    blocks = []
+    offset = 0
+    for size in sizes:
+        blocks.append((offset, (1 << size) - 1))
+        offset += size
+    return blocks
+
+
+class PerceptualCache:
+    """按 (命名空间, 感知哈希) 存取的近似重复缓存，支持汉明距离阈值、TTL过期和LRU淘汰
+
+    命名空间区分结果类型和影响建议的上下文（拍摄意图、是否水平等），只在同一命名空间内查找。
+    backend 为可选的持久化后端（见 cache_backend.py）：写入同步到后端，内存未命中时再查后端，
+    这样重启后缓存仍然有效，多个worker进程也能复用彼此的结果。
+    """
+
+    def __init__(self, max_distance: int, max_entries: int, ttl_seconds: float, backend=None):
+        self.max_distance = max(0, min(int(max_distance), HASH_BITS - 1))
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+
+        # 分段边界：阈值+1段，尽量等长
+        self._blocks = hash_blocks(self.max_distance)
+
+        self._entries = OrderedDict()  # entry_key -> 缓存项，按最近使用排序
+        self._index = {}  # (命名空间, 段序号, 段值) -> entry_key集合
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.hits = 0
+        self.near_hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _block_keys(self, namespace: str, phash: int):
+        """哈希各段在索引中的键"""
+        return [(namespace, i, (phash >> offset) & mask) for i, (offset, mask) in enumerate(self._blocks)]
+
+    def get(self, namespace: str, phash: int):
+        """查找汉明距离不超过阈值的最近缓存项，返回缓存结果或None"""
+        now = time.time()
+        with self._lock:
+            best_key, best_distance = None, None
+            candidates = set()
+            for block_key in self._block_keys(namespace, phash):
+                candidates.update(self._index.get(block_key, ()))
+
+            for entry_key in candidates:
+                entry = self._entries[entry_key]
+                if now - entry['timestamp'] >= self.ttl_seconds:
+                    continue
+                distance = hamming_distance(phash, entry['phash'])
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = entry_key, distance
+                    if distance == 0:
+                        break
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self._record_hit(best_distance)
+                entry = self._entries[best_key]
+                if self.backend:
+                    self.backend.touch(namespace, entry['phash'])
+                return entry['result']
+
+        # 内存未命中时查询持久化后端（可能是重启前或其他worker进程写入的结果）
+        if self.backend:
+            record = self.backend.find(namespace, phash, self.max_distance, now - self.ttl_seconds)
+            if record:
+                record_phash = int(record['phash'], 16)
+                with self._lock:
+                    self._insert(namespace, record_phash, record['result'], record['timestamp'])
+                    self.backend_hits += 1
+                    self._record_hit(hamming_distance(phash, record_phash))
+                self.backend.touch(namespace, record_phash)
+                return record['result']
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _record_hit(self, distance: int):
+        self.hits += 1
+        if distance > 0:
+            self.near_hits += 1
+        print(f"使用缓存结果 (汉明距离: {distance})")
+
+    def set(self, namespace: str, phash: int, result, timestamp: float = None):
+        """写入缓存项（同一命名空间下相同哈希的旧结果被覆盖），并排队写入持久化后端"""
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            self._insert(namespace, phash, result, timestamp)
+        if self.backend:
+            self.backend.put({'namespace': namespace, 'phash': f"{phash:016x}", 'result': result, 'timestamp': timestamp})
+
+    def _insert(self, namespace: str, phash: int, result, timestamp: float):
+        """写入内存缓存和索引，超出条数时按LRU淘汰（调用方持有锁）"""
+        entry_key = (namespace, phash)
+        if entry_key in self._entries:
+            self._remove(entry_key)
+        self._entries[entry_key] = {
+            'namespace': namespace,
+            'phash': phash,
+            'result': result,
+            'timestamp': timestamp
+        }
+        for block_key in self._block_keys(namespace, phash):
+            self._index.setdefault(block_key, set()).add(entry_key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_key):
+        """删除缓存项及其索引"""
+        entry = self._entries.pop(entry_key)
+        for block_key in self._block_keys(entry['namespace'], entry['phash']):
+            bucket = self._index.get(block_key)
+            if bucket is not None:
+                bucket.discard(entry_key)
+                if not bucket:
+                    del self._index[block_key]
+
+    def warm_up(self) -> int:
+        """从持久化后端加载最近使用的记录到内存，返回加载数量"""
+        if not self.backend:
+            return 0
+        records = self.backend.load_recent(self.max_entries, time.time() - self.ttl_seconds)
+        with self._lock:
+            for record in records:
+                self._insert(record['namespace'], int(record['phash'], 16), record['result'], record['timestamp'])
+        return len(records)
+
+    def flush(self):
+        """立即把待写入的数据提交到持久化后端"""
+        if self.backend:
+            self.backend.flush()
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'max_distance': self.max_distance,
+            'hits': self.hits,
+            'near_duplicate_hits': self.near_hits,
+            'backend_hits': self.backend_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'backend': self.backend.get_stats() if self.backend else None
+        }
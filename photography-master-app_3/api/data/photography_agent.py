@@ -5,202 +5,183 @@
 """
 
 import json
-import base64
+import time
+import asyncio
 import os
-import hashlib
 from typing import Dict, List
-from PIL import Image
 import cv2
 import numpy as np
-import math
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
-from openai import OpenAI
+from session_registry import PhotographySession
+from suggestion_stream import SuggestionStreamParser
+from perceptual_cache import PerceptualCache
+from cache_backend import create_cache_backend
+from frame_gate import FrameGate
+from horizon_detector import HORIZON_ENGINES
+from image_features import extract_features, decode_for_analysis, SHARPNESS_SIDE
+from image_payload import ImagePayloadBuilder, FramePayload
+from sensor_input import sensor_level_info
+from level_cascade import LevelCascade
+from llm_gateway import LLMGateway
+from circuit_breaker import CircuitBreakerRegistry
+from local_guidance import LocalGuidanceEngine
+
+# 指导流程需要的图像特征（没有设备传感器数据时再加上水平检测 tilt）；
+# sharpness / histogram / composition 供本地建议引擎使用
+AGENT_FEATURES = ('brightness', 'sharpness', 'histogram', 'composition', 'phash', 'thumbnail')
 
 class PhotographyAgent:
-    def __init__(self, knowledge_file: str = "extracted_photography_knowledge.json"):
+    def __init__(self, knowledge_file: str = "extracted_photography_knowledge.json", prompt_file: str = "prompt.txt"):
         Config.validate_config()
         self.model_name = Config.MODEL_NAME
-        self.client = OpenAI(
+        
+        # 所有模型调用都经过网关：共享连接池、按调用类型的参数和模型路由、响应缓存、截止时间内的重试和对冲请求、熔断、指标
+        self.llm = LLMGateway(
             base_url=Config.OPENROUTER_BASE_URL,
             api_key=Config.OPENROUTER_API_KEY,
+            model=self.model_name,
+            profiles=Config.LLM_CALL_PROFILES,
+            routes=Config.LLM_ROUTES,
+            explore_rate=Config.LLM_ROUTER_EXPLORE_RATE,
+            max_connections=Config.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=Config.LLM_POOL_KEEPALIVE_EXPIRY,
+            connect_timeout=Config.LLM_CONNECT_TIMEOUT,
+            cache_max_entries=Config.LLM_RESPONSE_CACHE_ENTRIES,
+            cache_ttl_seconds=Config.LLM_RESPONSE_CACHE_TTL,
+            max_retries=Config.LLM_MAX_RETRIES,
+            retry_base_delay=Config.LLM_RETRY_BASE_DELAY,
+            retry_max_delay=Config.LLM_RETRY_MAX_DELAY,
+            min_attempt_seconds=Config.LLM_MIN_ATTEMPT_SECONDS,
+            hedge_enabled=Config.LLM_HEDGE_ENABLED,
+            hedge_quantile=Config.LLM_HEDGE_QUANTILE,
+            hedge_min_samples=Config.LLM_HEDGE_MIN_SAMPLES,
+            hedge_min_delay=Config.LLM_HEDGE_MIN_DELAY,
+            hedge_workers=Config.LLM_MAX_WORKERS,
+            circuit_breakers=CircuitBreakerRegistry(
+                enabled=Config.CIRCUIT_BREAKER_ENABLED,
+                window_seconds=Config.CIRCUIT_WINDOW_SECONDS,
+                min_requests=Config.CIRCUIT_MIN_REQUESTS,
+                error_rate_threshold=Config.CIRCUIT_ERROR_RATE,
+                slow_call_seconds=Config.CIRCUIT_SLOW_CALL_SECONDS,
+                slow_rate_threshold=Config.CIRCUIT_SLOW_RATE,
+                open_seconds=Config.CIRCUIT_OPEN_SECONDS,
+                half_open_probes=Config.CIRCUIT_HALF_OPEN_PROBES
+            )
+        )
+        
+        # 本地规则建议引擎：local模式和模型调用失败/熔断时使用（见 local_guidance.py）
+        self.local_guidance = LocalGuidanceEngine(max_items=Config.MAX_ADVICE_ITEMS)
+        
+        # 并发执行AI请求的线程池（水平二次检查与建议请求同时发出）
+        self.llm_executor = ThreadPoolExecutor(
+            max_workers=Config.LLM_MAX_WORKERS,
+            thread_name_prefix="llm"
         )
         
-        # 添加缓存机制
-        self.cache = {}
-        self.cache_file = "ai_cache.json"
+        # 添加缓存机制（按画面感知哈希查找近似重复帧，手持对准同一场景时复用最近的建议）
+        # 内存中做近似查找，持久化后端负责重启后恢复和多进程共享
+        self.cache = PerceptualCache(
+            max_distance=Config.CACHE_PHASH_MAX_DISTANCE,
+            max_entries=Config.CACHE_MAX_ENTRIES,
+            ttl_seconds=Config.CACHE_TTL_SECONDS,
+            backend=self._create_cache_backend()
+        )
         self.load_cache()
         
-        # 添加消息历史记录
-        self.message_history = []
-        self.max_history_length = 10  # 保持最近10条消息
+        if Config.HORIZON_ENGINE not in HORIZON_ENGINES:
+            raise ValueError(f"不支持的水平检测引擎: {Config.HORIZON_ENGINE}，可选: {', '.join(HORIZON_ENGINES)}")
+        
+        # 帧差门控：同一会话画面无明显变化时直接复用上次的建议
+        self.frame_gate = FrameGate(
+            diff_threshold=Config.FRAME_GATE_DIFF_THRESHOLD,
+            tilt_threshold=Config.FRAME_GATE_TILT_THRESHOLD,
+            max_age_seconds=Config.FRAME_GATE_MAX_AGE_SECONDS,
+            enabled=Config.FRAME_GATE_ENABLED
+        )
+        
+        # AI请求的图片载荷：按请求类型缩小并重新编码，同一帧的各个请求共用
+        self.image_payloads = ImagePayloadBuilder({
+            'level': (Config.IMAGE_PAYLOAD_LEVEL_MAX_SIDE, Config.IMAGE_PAYLOAD_LEVEL_QUALITY),
+            'suggestions': (Config.IMAGE_PAYLOAD_SUGGESTION_MAX_SIDE, Config.IMAGE_PAYLOAD_SUGGESTION_QUALITY)
+        })
+        
+        # AI水平二次检查的级联策略：OpenCV的水平判断足够可信时跳过AI检查
+        self.level_cascade = LevelCascade(
+            high_confidence=Config.CASCADE_HIGH_CONFIDENCE,
+            min_confidence=Config.CASCADE_MIN_CONFIDENCE,
+            stable_frames=Config.CASCADE_STABLE_FRAMES,
+            stable_max_spread=Config.CASCADE_STABLE_MAX_SPREAD,
+            stable_window_seconds=Config.CASCADE_STABLE_WINDOW_SECONDS,
+            agreement_window=Config.CASCADE_AGREEMENT_WINDOW,
+            agreement_threshold=Config.CASCADE_AGREEMENT_THRESHOLD,
+            agreement_min_samples=Config.CASCADE_AGREEMENT_MIN_SAMPLES,
+            audit_interval=Config.CASCADE_AUDIT_INTERVAL,
+            enabled=Config.CASCADE_ENABLED
+        )
         
-        # 添加会话状态管理
-        self.session_started = False
-        self.user_photography_intent = None  # 用户想拍摄的内容
+        # 默认会话（命令行等单用户场景使用；API服务器为每个客户端创建独立会话）
+        # 消息历史、拍摄意图等轻量状态保存在会话中，缓存和知识库在所有会话间共享
+        self.default_session = PhotographySession("default")
         
         # 无需加载额外检测器
         
         # 加载知识库
         self.extracted_knowledge = self.load_extracted_knowledge(knowledge_file)
         print(f"已加载 {len(self.extracted_knowledge)} 个精简知识点")
+        
+        # 系统人设和请求的固定前缀（按请求类型生成一次，保证每次请求的前缀完全相同，便于服务商缓存）
+        self.system_prompt = self.load_system_prompt(prompt_file)
+        self._system_prompts = {}
+    
+    def _create_cache_backend(self):
+        """按配置创建缓存持久化后端，失败时退回到不持久化的内存缓存"""
+        try:
+            return create_cache_backend(
+                Config.CACHE_BACKEND,
+                path=Config.CACHE_DB_PATH,
+                max_entries=Config.CACHE_MAX_ENTRIES,
+                ttl_seconds=Config.CACHE_TTL_SECONDS,
+                max_distance=Config.CACHE_PHASH_MAX_DISTANCE,
+                flush_interval=Config.CACHE_FLUSH_INTERVAL
+            )
+        except Exception as e:
+            print(f"缓存后端初始化失败，使用内存缓存: {e}")
+            return create_cache_backend('memory', None, Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL_SECONDS)
     
     def load_cache(self):
-        """加载缓存"""
+        """加载缓存（从持久化后端预热最近使用的记录）"""
         try:
-            if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    self.cache = json.load(f)
-                print(f"已加载 {len(self.cache)} 条缓存记录")
+            loaded = self.cache.warm_up()
+            print(f"已加载 {loaded} 条缓存记录")
         except Exception as e:
             print(f"缓存加载失败: {e}")
-            self.cache = {}
     
     def save_cache(self):
-        """保存缓存"""
+        """保存缓存（写入平时由后台线程合并提交，这里立即提交剩余写入）"""
         try:
-            # 只保留最近100条缓存
-            if len(self.cache) > 100:
-                # 删除最旧的缓存
-                oldest_keys = sorted(self.cache.keys(), key=lambda k: self.cache[k].get('timestamp', 0))[:len(self.cache) - 100]
-                for key in oldest_keys:
-                    del self.cache[key]
-            
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, ensure_ascii=False, indent=2)
+            self.cache.flush()
         except Exception as e:
             print(f"缓存保存失败: {e}")
     
-    def get_cache_key(self, image_path: str, analysis: dict) -> str:
-        """生成缓存键"""
-        try:
-            # 基于图片文件大小和修改时间生成键
-            stat = os.stat(image_path)
-            key_data = f"{stat.st_size}_{stat.st_mtime}_{analysis.get('brightness', 0):.1f}_{analysis.get('is_level', True)}"
-            return hashlib.md5(key_data.encode()).hexdigest()
-        except:
-            return hashlib.md5(image_path.encode()).hexdigest()
-    
-    def get_cached_result(self, cache_key: str):
-        """获取缓存结果"""
-        if cache_key in self.cache:
-            cached_data = self.cache[cache_key]
-            # 检查缓存是否过期（24小时）
-            import time
-            if time.time() - cached_data.get('timestamp', 0) < 86400:
-                print(f"使用缓存结果")
-                return cached_data.get('result')
-        return None
-    
-    def set_cached_result(self, cache_key: str, result):
-        """设置缓存结果"""
-        import time
-        self.cache[cache_key] = {
-            'result': result,
-            'timestamp': time.time()
-        }
-    
-    def add_to_message_history(self, role: str, content: str, image_data: str = None):
-        """添加消息到历史记录"""
-        message = {"role": role}
+    def get_cache_key(self, analysis: dict, intent: str = None, kind: str = 'suggestions') -> tuple:
+        """生成缓存键 (命名空间, 感知哈希)
         
-        if role == "user" and image_data:
-            # 用户消息包含图片
-            message["content"] = [
-                {"type": "text", "text": content},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-            ]
-        else:
-            # 普通文本消息
-            message["content"] = content
-        
-        self.message_history.append(message)
-        
-        # 限制历史记录长度
-        if len(self.message_history) > self.max_history_length:
-            self.message_history = self.message_history[-self.max_history_length:]
-        
-        print(f"添加消息到历史 (角色: {role}, 历史长度: {len(self.message_history)})")
+        感知哈希在分析画面时计算，近似的画面汉明距离很小；
+        命名空间包含结果类型和影响建议的上下文：缓存在所有会话间共享，拍摄意图不同时建议不同，
+        水平状态和亮度等级会写入prompt，也需要区分
+        """
+        namespace = f"{kind}|{intent or ''}|{analysis.get('is_level', True)}|{analysis.get('brightness_level', '')}"
+        return namespace, analysis['phash']
     
-    def clear_message_history(self):
-        """清空消息历史记录"""
-        self.message_history = []
-        self.session_started = False
-        self.user_photography_intent = None
-        print("已清空消息历史记录和会话状态")
+    def get_cached_result(self, cache_key: tuple):
+        """获取缓存结果（过期时间和距离阈值见 Config.CACHE_*）"""
+        return self.cache.get(*cache_key)
     
-    def get_message_history_summary(self):
-        """获取消息历史记录摘要"""
-        return {
-            "total_messages": len(self.message_history),
-            "messages_preview": [
-                {
-                    "role": msg["role"],
-                    "has_image": isinstance(msg.get("content"), list) and any(
-                        item.get("type") == "image_url" for item in msg.get("content", [])
-                    ),
-                    "text_preview": (
-                        msg["content"][:50] + "..." if isinstance(msg["content"], str) and len(msg["content"]) > 50
-                        else (
-                            msg["content"][0]["text"][:50] + "..." if isinstance(msg.get("content"), list) and len(msg["content"]) > 0 and "text" in msg["content"][0] and len(msg["content"][0]["text"]) > 50
-                            else (
-                                msg["content"][0]["text"] if isinstance(msg.get("content"), list) and len(msg["content"]) > 0 and "text" in msg["content"][0]
-                                else msg["content"] if isinstance(msg["content"], str)
-                                else "No text content"
-                            )
-                        )
-                    )
-                }
-                for msg in self.message_history[-5:]  # 显示最后5条消息
-            ]
-        }
-    
-    def start_conversation(self):
-        """开始新的拍摄会话"""
-        if not self.session_started:
-            self.session_started = True
-            self.clear_message_history()
-            
-            # 添加初始对话
-            greeting_message = """你好！我是你的AI摄影助手 📸
-
-在开始拍摄之前，请告诉我：你想拍摄什么内容呢？
-
-比如：
-🌅 风景照片（日出、山景、海景等）
-👤 人像照片（朋友、家人、自拍等）  
-🍕 美食照片（餐厅菜品、家常菜等）
-🏗️ 建筑照片（古建筑、现代建筑等）
-🌸 花草照片（公园、花园等）
-🐱 宠物照片
-📚 产品照片（物品展示等）
-
-或者其他任何你想拍的内容！了解你的拍摄意图后，我可以提供更精准的构图和拍摄建议。"""
-
-            self.add_to_message_history("assistant", greeting_message)
-            print("已开始新的拍摄会话")
-            return greeting_message
-        else:
-            return "会话已经开始，可以直接告诉我你想拍摄什么！"
-    
-    def set_photography_intent(self, intent: str):
-        """设置用户的拍摄意图"""
-        self.user_photography_intent = intent
-        self.add_to_message_history("user", f"我想拍摄：{intent}")
-        
-        # AI确认并提供预期指导
-        confirmation_message = f"""很好！我了解你想拍摄 **{intent}** 📸
-
-现在请把相机对准你想拍的场景，我会实时分析画面并提供专业的拍摄建议，包括：
-• 构图调整
-• 角度优化  
-• 位置移动
-• 光线利用
-
-开始拍摄吧！我会根据你的拍摄意图给出最合适的建议。"""
-
-        self.add_to_message_history("assistant", confirmation_message)
-        print(f"用户拍摄意图已设置: {intent}")
-        return confirmation_message
+    def set_cached_result(self, cache_key: tuple, result):
+        """设置缓存结果"""
+        self.cache.set(*cache_key, result)
     
     def load_extracted_knowledge(self, knowledge_file: str) -> Dict[str, str]:
         """加载预处理的精简知识库"""
@@ -227,338 +208,566 @@ class PhotographyAgent:
             print(f"加载知识库失败: {e}")
             return {}
     
-    def analyze_image(self, image_path):
-        """分析图像：精确水平检测 + 基础信息"""
+    def load_system_prompt(self, prompt_file: str) -> str:
+        """加载系统人设prompt（请求前缀的第一部分）"""
+        possible_paths = [
+            prompt_file,  # 当前目录
+            os.path.join(os.path.dirname(__file__), prompt_file),  # agent文件同级目录
+        ]
+        for path in possible_paths:
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        return f.read().strip()
+                except Exception as e:
+                    print(f"加载系统prompt失败: {e}")
+                    return ""
+        print(f"系统prompt文件不存在: {prompt_file}")
+        return ""
+    
+    def load_image_bytes(self, image_source) -> bytes:
+        """读取图片原始字节（支持文件路径或内存中的字节）"""
+        if isinstance(image_source, (bytes, bytearray, memoryview)):
+            return bytes(image_source)
+        with open(image_source, 'rb') as f:
+            return f.read()
+    
+    def decode_image(self, image_bytes: bytes):
+        """在内存中按原分辨率解码彩色图片，失败时返回None（逐帧分析使用缩小解码的 decode_for_analysis）"""
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        if buffer.size == 0:
+            return None
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    
+    def decode_for_analysis(self, image_bytes: bytes, sensor: Dict = None):
+        """按分析需要的工作尺寸缩小解码灰度图，返回 (灰度图, 原图尺寸)
+        
+        水平检测在 HORIZON_MAX_SIDE 上粗检测、在2倍尺寸上精修，因此解码到长边不小于
+        ANALYSIS_DECODE_TARGET_SIDE；有传感器数据时不做水平检测，用更小的尺寸即可，
+        但不小于清晰度的工作尺寸 SHARPNESS_SIDE（放大后计算的拉普拉斯方差偏低）
+        """
+        if not Config.ANALYSIS_REDUCED_DECODE:
+            target_side = 0
+        elif sensor:
+            target_side = max(Config.ANALYSIS_DECODE_MIN_SIDE, SHARPNESS_SIDE)
+        else:
+            target_side = Config.ANALYSIS_DECODE_TARGET_SIDE
+        return decode_for_analysis(image_bytes, target_side)
+    
+    def analyze_image(self, image, sensor: Dict = None, original_size: tuple = None):
+        """分析图像：精确水平检测 + 基础信息
+        
+        image 可以是已解码的数组（BGR或灰度）、图片字节或文件路径；
+        sensor 为客户端上传的设备传感器数据（见 sensor_input.py），提供时直接用横滚角判断水平，跳过画面检测；
+        original_size 为缩小解码前的原图尺寸 (宽, 高)，返回的宽高以原图为准
+        """
         try:
-            # 读取图片
-            image = cv2.imread(image_path)
+            # 读取图片（已解码的数组直接复用，避免重复解码）
+            if not isinstance(image, np.ndarray):
+                image, original_size = self.decode_for_analysis(self.load_image_bytes(image), sensor)
             if image is None:
                 return {'error': '无法读取图片'}
             
-            height, width = image.shape[:2]
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # 基础信息
-            brightness = np.mean(gray)
-            
-            # 🔧 精确的水平检测
-            level_info = self._detect_horizon_level_precise(gray, width, height)
+            # 单次特征提取：灰度图只计算一次，亮度、水平检测、感知哈希和缩略图都基于它
+            # 🔧 精确的水平检测（有设备传感器数据时直接使用，不再做画面检测）
+            features = extract_features(
+                image,
+                AGENT_FEATURES if sensor else AGENT_FEATURES + ('tilt',),
+                horizon_engine=Config.HORIZON_ENGINE,
+                horizon_max_side=Config.HORIZON_MAX_SIDE,
+                level_tolerance=Config.HORIZON_LEVEL_TOLERANCE
+            )
+            level_info = sensor_level_info(sensor, Config.HORIZON_LEVEL_TOLERANCE) if sensor else features['tilt']
             
             return {
-                'width': int(width),  # 确保是Python int
-                'height': int(height),  # 确保是Python int
-                'brightness': float(round(brightness, 1)),  # 确保是Python float
-                'brightness_level': str(self._categorize_brightness(brightness)),  # 确保是Python str
+                'width': int(original_size[0]) if original_size else features['width'],
+                'height': int(original_size[1]) if original_size else features['height'],
+                'brightness': features['brightness'],
+                'brightness_level': features['brightness_level'],
+                
+                # 本地建议引擎用的清晰度、高光/暗部溢出比例和构图特征
+                'sharpness': features['sharpness'],
+                'highlights_clipped': features['histogram']['highlights_clipped'],
+                'shadows_clipped': features['histogram']['shadows_clipped'],
+                'composition': features['composition'],
                 
                 # 精确的水平检测结果
                 'is_level': level_info['is_level'],
                 'tilt_angle': level_info['tilt_angle'],
                 'tilt_direction': level_info['tilt_direction'],
-                'level_confidence': level_info['confidence']
+                'level_confidence': level_info['confidence'],
+                'level_source': 'sensor' if sensor else 'image',
+                'pitch': sensor.get('pitch') if sensor else None,
+                
+                # 感知哈希（近似重复帧缓存的键）和帧差门控用的缩略图
+                'phash': features['phash'],
+                'thumbnail': features['thumbnail']
             }
             
         except Exception as e:
             return {'error': f'图片分析失败: {str(e)}'}
     
-    def _detect_horizon_level_precise(self, gray_image, width, height):
-        """精确的水平检测（OpenCV算法）"""
+
+    
+    def get_guidance(self, image_source, mode: str = None, session: PhotographySession = None,
+                     sensor: Dict = None) -> str:
+        """获取拍摄指导（返回JSON格式）
+        
+        image_source 可以是上传的图片字节或文件路径；图片只读取和解码一次，
+        同一份字节同时用于OpenCV分析和AI请求的base64编码。
+        mode 选择AI调用方式：two_call（水平检查和建议分两次请求）、
+        combined（一次请求同时返回水平判断和建议）或 local（不调用模型，本地规则生成建议），
+        默认取 Config.LLM_MODE；模型熔断时自动按local生成，meta.degraded 为True。
+        session 为客户端的会话状态（消息历史、拍摄意图），默认使用 default_session。
+        sensor 为设备传感器数据（roll/pitch/timestamp），提供时直接用于水平校正，
+        不再做画面水平检测和AI水平二次检查
+        """
         try:
-            # 边缘检测
-            edges = cv2.Canny(gray_image, 50, 150, apertureSize=3)
+            mode, session = self._resolve_guidance_options(mode, session)
             
-            # 霍夫线变换
-            lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=min(width, height)//4)
+            # 读取、解码并分析图片（全程在内存中完成，不产生临时文件）
+            image_bytes, analysis = self._prepare_frame(image_source, sensor)
             
-            if lines is None:
-                return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.3}
+            if 'error' in analysis:
+                return self._analysis_error_json(analysis)
             
-            # 收集水平线角度
-            horizontal_angles = []
-            for line in lines:
-                rho, theta = line[0]
-                angle_deg = math.degrees(theta)
-                
-                # 只考虑接近水平的线条
-                if angle_deg < 30 or angle_deg > 150:
-                    if angle_deg > 150:
-                        angle_deg = angle_deg - 180
-                    horizontal_angles.append(angle_deg)
+            # 画面与上次分析的帧相比没有明显变化时直接复用上次的建议
+            reused = self.frame_gate.check(session, analysis, mode)
+            if reused:
+                return self._dump_guidance(reused)
             
-            if not horizontal_angles:
-                return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.3}
+            # local模式或模型熔断中：本地规则引擎直接生成建议，不编码图片、不调用模型
+            if mode == 'local' or self._llm_degraded(mode):
+                return self._dump_guidance(self._local_guidance(analysis, session, mode))
             
-            # 计算平均倾斜角度
-            avg_angle = np.mean(horizontal_angles)
-            tolerance = 2.0
-            is_level = abs(avg_angle) <= tolerance
+            # 🎯 双重水平检测策略：由级联策略决定是否还需要AI水平二次检查
+            decision = self._decide_level_check(session, analysis)
             
-            # 确定倾斜方向
-            if avg_angle > tolerance:
-                direction = 'right_high'  # 右边高
-            elif avg_angle < -tolerance:
-                direction = 'left_high'   # 左边高
-            else:
-                direction = 'level'
+            payload = self.image_payloads.for_frame(image_bytes)
             
-            confidence = min(len(horizontal_angles) / 10.0, 1.0)
+            if not decision['run_ai']:
+                # 策略1: 传感器数据、OpenCV检测到明显倾斜或OpenCV的水平判断足够可信 - 直接使用
+                level_direction = self._level_direction_without_ai(analysis, decision)
+                
+                # 其他建议由AI生成（不涉及水平）
+                ai_suggestions = self._get_ai_suggestions_json(payload, analysis, session)
+                
+            elif mode == 'combined':
+                # 策略2a: OpenCV认为水平 - 一次AI请求同时完成水平二次检查和建议
+                print(f"OpenCV认为水平，AI合并请求（水平检查+建议）中...")
+                ai_level_result, ai_suggestions = self._ai_check_level_and_suggestions(
+                    payload, analysis, session
+                )
+                self.level_cascade.record(session, decision, ai_level_result)
+                level_direction = self._level_direction_from_ai(ai_level_result)
+                
+            else:
+                # 策略2b: OpenCV认为水平 - 让AI二次检查
+                # 建议prompt不依赖AI的水平结论，两个请求并发执行，都完成后再决定第1条是否为水平校正
+                print(f"OpenCV认为水平，AI二次检查与建议请求并发执行中...")
+                level_future = self.llm_executor.submit(self._checked_level_only, payload, analysis, session, decision)
+                
+                # 其他建议由AI生成（不涉及水平），在当前线程执行
+                ai_suggestions = self._get_ai_suggestions_json(payload, analysis, session)
+                
+                ai_level_result = level_future.result()
+                level_direction = self._level_direction_from_ai(ai_level_result)
             
-            return {
-                'is_level': bool(is_level),  # 确保是Python bool
-                'tilt_angle': float(round(abs(avg_angle), 1)),  # 确保是Python float
-                'tilt_direction': str(direction),  # 确保是Python str
-                'confidence': float(round(confidence, 2))  # 确保是Python float
-            }
+            guidance = self._build_guidance(analysis, level_direction, ai_suggestions, mode)
+            self.frame_gate.remember(session, analysis, mode, guidance)
+            return self._dump_guidance(guidance)
             
         except Exception as e:
-            return {'is_level': True, 'tilt_angle': 0, 'tilt_direction': 'level', 'confidence': 0.1}
-    
-
-    def _categorize_brightness(self, brightness):
-        """亮度分类"""
-        if brightness < 50:
-            return "昏暗"
-        elif brightness < 120:
-            return "适中"
-        else:
-            return "明亮"
-    
-
+            return self._processing_error_json(e)
     
-    def get_guidance(self, image_path: str) -> str:
-        """获取拍摄指导（返回JSON格式）"""
+    async def get_guidance_async(self, image_source, mode: str = None, session: PhotographySession = None,
+                                 sensor: Dict = None) -> str:
+        """获取拍摄指导的异步版本（供异步服务器使用）
+        
+        OpenCV分析在线程池中执行，AI请求使用异步客户端，等待模型响应时不占用线程。
+        参数和返回值与 get_guidance 相同
+        """
         try:
-            # 分析图片
-            analysis = self.analyze_image(image_path)
+            mode, session = self._resolve_guidance_options(mode, session)
+            
+            # CPU密集的解码和分析放到线程池，避免阻塞事件循环
+            image_bytes, analysis = await asyncio.to_thread(self._prepare_frame, image_source, sensor)
             
             if 'error' in analysis:
-                return json.dumps({
-                    "error": f"分析失败: {analysis['error']}",
-                    "suggestions": []
-                }, ensure_ascii=False, indent=2)
+                return self._analysis_error_json(analysis)
             
-            # 🎯 双重水平检测策略
-            opencv_detected_tilt = not analysis.get('is_level', True)
-            tilt_angle = analysis.get('tilt_angle', 0)
-            tilt_direction = analysis.get('tilt_direction', 'level')
+            reused = self.frame_gate.check(session, analysis, mode)
+            if reused:
+                return self._dump_guidance(reused)
             
-            suggestions = []
+            if mode == 'local' or self._llm_degraded(mode):
+                return self._dump_guidance(self._local_guidance(analysis, session, mode))
             
-            if opencv_detected_tilt:
-                # 策略1: OpenCV检测到明显倾斜 - 优先级最高，直接使用
-                print(f"OpenCV检测到倾斜({tilt_direction}, {tilt_angle}度) - 优先采用")
-                
-                # 添加水平校正建议
-                level_suggestion = self._create_level_correction_suggestion(tilt_direction)
-                suggestions.append(level_suggestion)
+            decision = self._decide_level_check(session, analysis)
+            
+            payload = self.image_payloads.for_frame(image_bytes)
+            
+            if not decision['run_ai']:
+                level_direction = self._level_direction_without_ai(analysis, decision)
+                ai_suggestions = await self._get_ai_suggestions_json_async(payload, analysis, session)
                 
-                # 其他建议由AI生成（不涉及水平）
-                ai_suggestions = self._get_ai_suggestions_json(image_path, analysis)
-                suggestions.extend(ai_suggestions[:4])  # 最多4条，总共5条
+            elif mode == 'combined':
+                print(f"OpenCV认为水平，AI合并请求（水平检查+建议）中...")
+                ai_level_result, ai_suggestions = await self._ai_check_level_and_suggestions_async(
+                    payload, analysis, session
+                )
+                self.level_cascade.record(session, decision, ai_level_result)
+                level_direction = self._level_direction_from_ai(ai_level_result)
                 
             else:
-                # 策略2: OpenCV认为水平 - 让AI二次检查
-                print(f"OpenCV认为水平，AI二次检查中...")
-                ai_level_result = self._ai_check_level_only(image_path, analysis)
-                
-                if not ai_level_result['is_level']:
-                    # AI检测到倾斜 - 第一条手势校正 + 4条其他建议
-                    print(f"AI检测到倾斜({ai_level_result['direction']}) - 采用AI结果")
-                    
-                    # 添加水平校正建议
-                    level_suggestion = self._create_level_correction_suggestion(ai_level_result['direction'])
-                    suggestions.append(level_suggestion)
-                    
-                    # 其他建议由AI生成（不涉及水平）
-                    ai_suggestions = self._get_ai_suggestions_json(image_path, analysis)
-                    suggestions.extend(ai_suggestions[:4])  # 最多4条，总共5条
-                else:
-                    # AI确认水平 - 5条不涉及水平的建议
-                    print(f"AI确认画面水平")
-                    ai_suggestions = self._get_ai_suggestions_json(image_path, analysis)
-                    suggestions = ai_suggestions[:5]
-            
-            # 确保每个建议都有正确的step编号
-            for i, suggestion in enumerate(suggestions):
-                suggestion['step'] = i + 1
-            
-            # 返回JSON格式（转换numpy类型为Python原生类型）
-            result = {
-                "suggestions": suggestions[:5],  # 确保最多5条建议
-                "analysis": {
-                    "is_level": bool(analysis.get('is_level', True)),  # 确保是Python bool
-                    "tilt_angle": float(analysis.get('tilt_angle', 0)),  # 确保是Python float
-                    "brightness": str(analysis.get('brightness_level', 'N/A'))  # 确保是Python str
-                }
-            }
+                print(f"OpenCV认为水平，AI二次检查与建议请求并发执行中...")
+                ai_level_result, ai_suggestions = await asyncio.gather(
+                    self._checked_level_only_async(payload, analysis, session, decision),
+                    self._get_ai_suggestions_json_async(payload, analysis, session)
+                )
+                level_direction = self._level_direction_from_ai(ai_level_result)
             
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            guidance = self._build_guidance(analysis, level_direction, ai_suggestions, mode)
+            self.frame_gate.remember(session, analysis, mode, guidance)
+            return self._dump_guidance(guidance)
             
         except Exception as e:
-            return json.dumps({
-                "error": f"处理失败: {str(e)}",
-                "suggestions": []
-            }, ensure_ascii=False, indent=2)
+            return self._processing_error_json(e)
     
-    def _get_ai_suggestions_excluding_level(self, image_path: str, analysis: Dict) -> List[str]:
-        """获取AI建议，但明确排除水平相关的建议"""
+    def stream_guidance(self, image_source, session: PhotographySession = None, sensor: Dict = None):
+        """流式获取拍摄指导，逐个产出 (事件类型, 数据)
+        
+        事件顺序: analysis（画面分析）→ suggestion（每条建议完整生成后立即产出）→ done（完整结果，
+        格式与 get_guidance 相同）；出错时产出 error。
+        建议请求开启流式输出，水平二次检查与之并发执行，在产出第一条建议前确定是否需要水平校正。
+        """
         try:
-            # 处理图片大小
-            processed_image_path = self.resize_image_if_needed(image_path)
-            
-            # 编码图片
-            image_base64 = self.encode_image_to_base64(processed_image_path)
+            session = session or self.default_session
+            image_bytes, analysis = self._prepare_frame(image_source, sensor)
             
-            # 创建prompt（明确排除水平问题）
-            prompt = self._create_non_level_prompt(analysis)
+            if 'error' in analysis:
+                yield 'error', json.loads(self._analysis_error_json(analysis))
+                return
+            yield 'analysis', self._analysis_summary(analysis)
             
-            # 调用AI模型
-            ai_response = self.call_minimax_api(prompt, image_base64)
+            reused = self.frame_gate.check(session, analysis, 'two_call')
+            if reused:
+                for suggestion in reused['suggestions']:
+                    yield 'suggestion', suggestion
+                yield 'done', reused
+                return
             
-            if ai_response:
-                # 解析AI响应，提取建议
-                lines = ai_response.strip().split('\n')
-                suggestions = []
-                for line in lines:
-                    line = line.strip()
-                    if line and any(line.startswith(str(i)+'.') for i in range(1, 6)):
-                        # 移除编号
-                        suggestion = line.split('.', 1)[1].strip() if '.' in line else line
-                        suggestions.append(suggestion)
-                return suggestions
+            payload = self.image_payloads.for_frame(image_bytes)
+            level_future = None
+            level_direction = None
+            decision = self._decide_level_check(session, analysis)
+            if not decision['run_ai']:
+                level_direction = self._level_direction_without_ai(analysis, decision)
             else:
-                return self._get_fallback_non_level_suggestions(analysis)
+                level_future = self.llm_executor.submit(self._checked_level_only, payload, analysis, session, decision)
+            
+            suggestions = []
+            ai_count = 0
+            correction_pending = True
+            for kind, value in self._stream_ai_suggestions(payload, analysis, session):
+                if correction_pending:
+                    # 在产出第一条建议前确定是否需要水平校正
+                    if level_future:
+                        # 水平检查只返回几个字，通常在第一条建议生成前就已完成
+                        level_direction = self._level_direction_from_ai(level_future.result())
+                        level_future = None
+                    correction_pending = False
+                    if level_direction:
+                        yield 'suggestion', self._append_stream_suggestion(
+                            suggestions, self._create_level_correction_suggestion(level_direction))
                 
+                # 流式结束时的完整列表中，已经产出过的建议跳过
+                new_items = [value] if kind == 'partial' else value[ai_count:]
+                for item in new_items:
+                    if len(suggestions) >= 5:
+                        break
+                    ai_count += 1
+                    yield 'suggestion', self._append_stream_suggestion(suggestions, item)
+            
+            guidance = self._guidance_result(analysis, suggestions, {"llm_mode": "two_call", "streamed": True})
+            self.frame_gate.remember(session, analysis, 'two_call', guidance)
+            yield 'done', guidance
+            
         except Exception as e:
-            print(f"获取AI建议失败: {e}")
-            return self._get_fallback_non_level_suggestions(analysis)
+            yield 'error', json.loads(self._processing_error_json(e))
     
-    def _get_ai_suggestions_with_level_check(self, image_path: str, analysis: Dict) -> List[str]:
-        """AI建议（包含水平二次检查）"""
+    async def stream_guidance_async(self, image_source, session: PhotographySession = None, sensor: Dict = None):
+        """流式获取拍摄指导的异步版本，事件与 stream_guidance 相同"""
         try:
-            # 处理图片大小
-            processed_image_path = self.resize_image_if_needed(image_path)
-            
-            # 编码图片
-            image_base64 = self.encode_image_to_base64(processed_image_path)
+            session = session or self.default_session
+            image_bytes, analysis = await asyncio.to_thread(self._prepare_frame, image_source, sensor)
             
-            # 创建包含水平检查的prompt
-            prompt = self._create_level_check_prompt(analysis)
+            if 'error' in analysis:
+                yield 'error', json.loads(self._analysis_error_json(analysis))
+                return
+            yield 'analysis', self._analysis_summary(analysis)
             
-            # 调用AI模型
-            ai_response = self.call_minimax_api(prompt, image_base64)
+            reused = self.frame_gate.check(session, analysis, 'two_call')
+            if reused:
+                for suggestion in reused['suggestions']:
+                    yield 'suggestion', suggestion
+                yield 'done', reused
+                return
             
-            if ai_response:
-                # 解析AI响应，提取建议
-                lines = ai_response.strip().split('\n')
-                suggestions = []
-                for line in lines:
-                    line = line.strip()
-                    if line and any(line.startswith(str(i)+'.') for i in range(1, 6)):
-                        # 移除编号
-                        suggestion = line.split('.', 1)[1].strip() if '.' in line else line
-                        suggestions.append(suggestion)
-                return suggestions
+            payload = self.image_payloads.for_frame(image_bytes)
+            level_task = None
+            level_direction = None
+            decision = self._decide_level_check(session, analysis)
+            if not decision['run_ai']:
+                level_direction = self._level_direction_without_ai(analysis, decision)
             else:
-                return self._get_fallback_with_level_check(analysis)
+                level_task = asyncio.create_task(self._checked_level_only_async(payload, analysis, session, decision))
+            
+            suggestions = []
+            ai_count = 0
+            correction_pending = True
+            async for kind, value in self._stream_ai_suggestions_async(payload, analysis, session):
+                if correction_pending:
+                    # 在产出第一条建议前确定是否需要水平校正
+                    if level_task:
+                        # 水平检查只返回几个字，通常在第一条建议生成前就已完成
+                        level_direction = self._level_direction_from_ai(await level_task)
+                        level_task = None
+                    correction_pending = False
+                    if level_direction:
+                        yield 'suggestion', self._append_stream_suggestion(
+                            suggestions, self._create_level_correction_suggestion(level_direction))
                 
+                # 流式结束时的完整列表中，已经产出过的建议跳过
+                new_items = [value] if kind == 'partial' else value[ai_count:]
+                for item in new_items:
+                    if len(suggestions) >= 5:
+                        break
+                    ai_count += 1
+                    yield 'suggestion', self._append_stream_suggestion(suggestions, item)
+            
+            guidance = self._guidance_result(analysis, suggestions, {"llm_mode": "two_call", "streamed": True})
+            self.frame_gate.remember(session, analysis, 'two_call', guidance)
+            yield 'done', guidance
+            
         except Exception as e:
-            print(f"获取AI建议失败: {e}")
-            return self._get_fallback_with_level_check(analysis)
+            yield 'error', json.loads(self._processing_error_json(e))
     
-    def _create_non_level_prompt(self, analysis: Dict) -> str:
-        """创建不涉及水平问题的prompt（注入摄影知识）"""
-        brightness = analysis['brightness_level']
+    def _append_stream_suggestion(self, suggestions: list, suggestion: Dict) -> Dict:
+        """按产出顺序为流式建议编号并记录"""
+        suggestion = dict(suggestion, step=len(suggestions) + 1)
+        suggestions.append(suggestion)
+        return suggestion
+    
+    def _stream_ai_suggestions(self, payload: FramePayload, analysis: dict,
+                               session: PhotographySession):
+        """流式请求AI建议：每解析出一条建议产出 ('partial', 建议)，最后产出 ('final', 完整建议列表)"""
+        call = self._prepare_suggestion_call(payload, analysis, session)
+        if call['cached']:
+            yield 'final', call['cached']
+            return
         
-        # 注入相关的摄影知识
-        knowledge_context = self._get_relevant_knowledge()
+        parser = SuggestionStreamParser()
+        chunks = []
+        try:
+            for chunk in self.llm.stream('suggestions', call['messages']):
+                self._record_model(analysis, 'suggestions', chunk)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                chunks.append(delta)
+                for raw_suggestion in parser.feed(delta):
+                    for suggestion in self._validate_suggestions([raw_suggestion]):
+                        yield 'partial', suggestion
+        except Exception as e:
+            print(f"❌ AI流式建议获取失败: {e}")
         
-        # 添加用户拍摄意图上下文
-        intent_context = ""
-        intent_requirement = ""
-        if self.user_photography_intent:
-            intent_context = f"""
-用户拍摄意图: {self.user_photography_intent}
-请根据用户想拍摄的内容类型，提供针对性的专业建议。考虑该拍摄主题的特殊要求和最佳实践。"""
-            intent_requirement = f"""
-
-🎯 CRITICAL: 用户要拍摄{self.user_photography_intent}！你必须基于这个具体目标分析画面并提供专业建议：
-
-拍摄{self.user_photography_intent}的专业要求：
-"""
-
-            # Add specific requirements based on photography type
-            if "人像" in self.user_photography_intent or "肖像" in self.user_photography_intent:
-                intent_requirement += """
-- 人物要占据画面主要位置，背景要简洁
-- 相机高度应与眼部平齐或略低（显得亲切自然）
-- 避开背景中的干扰元素（电线杆、垃圾桶等）
-- 寻找柔和的光线，避免强烈阴影
-- 建议动作必须针对人像构图优化！"""
-
-            elif "风景" in self.user_photography_intent or "景观" in self.user_photography_intent:
-                intent_requirement += """
-- 地平线要水平，天空与地面比例要合理
-- 寻找前景、中景、背景的层次感
-- 包含引导线条或有趣的前景元素
-- 考虑黄金分割构图原则
-- 建议动作必须针对风景构图优化！"""
-
-            elif "美食" in self.user_photography_intent or "食物" in self.user_photography_intent:
-                intent_requirement += f"""
-- 采用45度俯拍角度，展现食物的立体感和层次
-- 避免手机阴影遮挡食物
-- 靠近拍摄突出食物质感和细节
-- 简化背景，让食物成为唯一焦点
-- 寻找均匀自然光，避免闪光灯
-
-🔥 每个action必须包含"食物"或"美食"字样！强制模板：
-- "蹲下45度俯拍，让食物更有立体感"
-- "往[方向]移动避开阴影，让食物光线更好"
-- "靠近[距离]突出食物的[特征]细节"
-- "调整角度让食物占据画面[比例]"""
-
-            elif "建筑" in self.user_photography_intent:
-                intent_requirement += """
-- 寻找对称构图，让建筑线条垂直
-- 后退寻找完整建筑轮廓，避免透视变形
-- 利用引导线条增强建筑的气势
-- 考虑仰拍或俯拍展现建筑特色
-- 建议动作必须针对建筑摄影优化！"""
-
-            else:
-                intent_requirement += f"""
-- 针对{self.user_photography_intent}的特殊拍摄需求
-- 考虑这类拍摄的最佳角度、构图和光线
-- 突出{self.user_photography_intent}的特点和美感
-- 建议动作必须与拍摄目标相关！"""
-
-            intent_requirement += f"""
-
-❌ 禁止使用这些泛泛建议：
-- "调整拍摄角度，寻找最佳构图位置" 
-- "调整拍摄高度，尝试不同视角"
-- "调整焦距，突出主体元素"
-- "微调位置，平衡画面元素"
-- "优化构图布局"
-
-✅ 必须使用针对{self.user_photography_intent}的具体建议：
-- "蹲下采用45度俯拍角度，让食物显得更有立体感和层次"
-- "往左移动避开手机阴影，让食物光线更均匀"
-- "靠近2步突出食物质感和细节"
-
-🚨 如果你给出泛泛建议，就是失败！"""
+        yield 'final', self._finish_stream_call(call, ''.join(chunks).strip(), session)
+    
+    async def _stream_ai_suggestions_async(self, payload: FramePayload, analysis: dict,
+                                           session: PhotographySession):
+        """流式请求AI建议的异步版本"""
+        call = await asyncio.to_thread(self._prepare_suggestion_call, payload, analysis, session)
+        if call['cached']:
+            yield 'final', call['cached']
+            return
+        
+        parser = SuggestionStreamParser()
+        chunks = []
+        try:
+            async for chunk in self.llm.stream_async('suggestions', call['messages']):
+                self._record_model(analysis, 'suggestions', chunk)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                chunks.append(delta)
+                for raw_suggestion in parser.feed(delta):
+                    for suggestion in self._validate_suggestions([raw_suggestion]):
+                        yield 'partial', suggestion
+        except Exception as e:
+            print(f"❌ AI流式建议获取失败: {e}")
+        
+        yield 'final', self._finish_stream_call(call, ''.join(chunks).strip(), session)
+    
+    def _finish_stream_call(self, call: Dict, response_text: str, session: PhotographySession) -> list:
+        """流式输出结束后解析完整文本，记录历史并缓存；没有可用建议时使用默认建议"""
+        if response_text:
+            print(f"🤖 AI流式响应完成: {response_text[:200]}...")
+            result = self._finish_suggestion_text(call, response_text, session)
+            if result:
+                return result
+        return self._suggestion_fallback(call)
+    
+    def _resolve_guidance_options(self, mode: str, session: PhotographySession) -> tuple:
+        """确定AI调用模式和会话（未指定时使用默认值）"""
+        mode = mode or Config.LLM_MODE
+        if mode not in Config.LLM_MODES:
+            raise ValueError(f"不支持的AI调用模式: {mode}")
+        return mode, session or self.default_session
+    
+    def _llm_degraded(self, mode: str) -> bool:
+        """该模式的建议请求的所有候选模型是否都在熔断（熔断时间到后返回False，由正常请求去探测恢复）"""
+        return self.llm.degraded('combined' if mode == 'combined' else 'suggestions')
+    
+    def _local_guidance(self, analysis: Dict, session: PhotographySession, mode: str) -> Dict:
+        """本地规则引擎生成指导结果：水平校正只依据传感器/OpenCV，其余建议由 LocalGuidanceEngine 生成
+        
+        local模式的结果参与帧差门控复用；熔断降级的结果不复用，模型恢复后下一帧即可得到AI建议
+        """
+        analysis['level_check'] = 'local'
+        level_direction = None if analysis.get('is_level', True) else analysis.get('tilt_direction')
+        suggestions = self.local_guidance.suggest(analysis, session.user_photography_intent)
+        meta = {"llm_mode": "local"}
+        if mode != 'local':
+            print(f"⚡ 模型熔断中，{mode}模式改用本地建议")
+            meta.update(degraded=True, requested_mode=mode)
+        guidance = self._guidance_result(analysis, self._merge_level_and_suggestions(level_direction, suggestions),
+                                         meta)
+        if mode == 'local':
+            self.frame_gate.remember(session, analysis, mode, guidance)
+        return guidance
+    
+    def _prepare_frame(self, image_source, sensor: Dict = None) -> tuple:
+        """读取、解码并分析图片，返回 (图片字节, 分析结果)"""
+        image_bytes = self.load_image_bytes(image_source)
+        image, original_size = self.decode_for_analysis(image_bytes, sensor)
+        return image_bytes, self.analyze_image(image, sensor, original_size)
+    
+    def _build_guidance(self, analysis: Dict, level_direction, ai_suggestions: list, mode: str) -> Dict:
+        """组装最终的指导结果"""
+        suggestions = self._merge_level_and_suggestions(level_direction, ai_suggestions)
+        return self._guidance_result(analysis, suggestions, {"llm_mode": mode})
+    
+    def _dump_guidance(self, guidance: Dict) -> str:
+        """指导结果转为JSON字符串"""
+        return json.dumps(guidance, ensure_ascii=False, indent=2)
+    
+    def _guidance_result(self, analysis: Dict, suggestions: list, meta: Dict) -> Dict:
+        """组装指导结果字典（meta.models 为本帧实际响应的模型 {调用类型: 模型}）"""
+        return {
+            "suggestions": suggestions,
+            "analysis": self._analysis_summary(analysis),
+            "meta": dict(meta, level_source=analysis.get('level_source', 'image'),
+                         level_check=analysis.get('level_check'), models=analysis.get('models', {}))
+        }
+    
+    def _record_model(self, analysis: Dict, call_type: str, response):
+        """记录响应本帧请求的模型（模型路由的选择结果，写入返回结果的meta.models）"""
+        model = getattr(response, 'model', None)
+        if model:
+            analysis.setdefault('models', {})[call_type] = model
+    
+    def _analysis_summary(self, analysis: Dict) -> Dict:
+        """返回给客户端的分析摘要（转换numpy类型为Python原生类型）"""
+        return {
+            "is_level": bool(analysis.get('is_level', True)),  # 确保是Python bool
+            "tilt_angle": float(analysis.get('tilt_angle', 0)),  # 确保是Python float
+            "brightness": str(analysis.get('brightness_level', 'N/A')),  # 确保是Python str
+            "pitch": analysis.get('pitch')  # 设备传感器俯仰角（未上传传感器数据时为None）
+        }
+    
+    def _analysis_error_json(self, analysis: Dict) -> str:
+        """图片分析失败时的返回结果"""
+        return json.dumps({
+            "error": f"分析失败: {analysis['error']}",
+            "suggestions": []
+        }, ensure_ascii=False, indent=2)
+    
+    def _processing_error_json(self, error: Exception) -> str:
+        """处理过程异常时的返回结果"""
+        return json.dumps({
+            "error": f"处理失败: {str(error)}",
+            "suggestions": []
+        }, ensure_ascii=False, indent=2)
+    
+    def _decide_level_check(self, session: PhotographySession, analysis: Dict) -> Dict:
+        """由级联策略决定是否需要AI水平二次检查，决策原因记录在分析结果中（返回给客户端的meta.level_check）"""
+        decision = self.level_cascade.decide(session, analysis)
+        analysis['level_check'] = decision['reason']
+        return decision
+    
+    def _level_direction_without_ai(self, analysis: Dict, decision: Dict):
+        """不做AI检查时，根据传感器或OpenCV的结果返回需要校正的倾斜方向（水平时返回None）"""
+        tilt_direction = analysis.get('tilt_direction', 'level')
+        if decision['reason'] == 'sensor':
+            print(f"使用设备传感器水平数据({tilt_direction}, {analysis.get('tilt_angle', 0)}度)")
+        elif decision['reason'] == 'tilt_detected':
+            print(f"OpenCV检测到倾斜({tilt_direction}, {analysis.get('tilt_angle', 0)}度) - 优先采用")
         else:
-            intent_requirement = """
-
-🎯 用户还没有指定拍摄对象，请提供通用的摄影改进建议。"""
-
-        prompt = f"""🚨 WARNING: 用户要拍摄 {self.user_photography_intent if self.user_photography_intent else '照片'}！
-
-你必须分析画面并基于拍摄目标给出具体建议。绝对禁止泛泛而谈！
-
-技术参数: 光线{brightness}, 尺寸{analysis.get('width', 'N/A')}x{analysis.get('height', 'N/A')}{intent_context}{intent_requirement}
-
-核心知识: {knowledge_context[:200]}...
+            print(f"OpenCV认为水平（置信度: {decision['confidence']}, 依据: {decision['reason']}），跳过AI水平检查")
+        return None if analysis.get('is_level', True) else tilt_direction
+    
+    def _checked_level_only(self, payload: FramePayload, analysis: Dict, session: PhotographySession,
+                            decision: Dict) -> Dict:
+        """执行AI水平检查，并把结果和耗时记录到级联策略统计"""
+        start_time = time.perf_counter()
+        result = self._ai_check_level_only(payload, analysis)
+        self.level_cascade.record(session, decision, result, time.perf_counter() - start_time)
+        return result
+    
+    async def _checked_level_only_async(self, payload: FramePayload, analysis: Dict, session: PhotographySession,
+                                        decision: Dict) -> Dict:
+        """_checked_level_only 的异步版本"""
+        start_time = time.perf_counter()
+        result = await self._ai_check_level_only_async(payload, analysis)
+        self.level_cascade.record(session, decision, result, time.perf_counter() - start_time)
+        return result
+    
+    def _level_direction_from_ai(self, ai_level_result: Dict):
+        """根据AI水平检查结果返回需要校正的倾斜方向（水平时返回None）"""
+        if ai_level_result['is_level']:
+            print(f"AI确认画面水平")
+            return None
+        print(f"AI检测到倾斜({ai_level_result['direction']}) - 采用AI结果")
+        return ai_level_result['direction']
+    
+    def _merge_level_and_suggestions(self, level_direction, ai_suggestions: list) -> list:
+        """合并水平校正建议和AI建议
+        
+        画面倾斜时第一条为手势校正 + 4条其他建议，否则为5条不涉及水平的建议
+        """
+        suggestions = []
+        if level_direction:
+            suggestions.append(self._create_level_correction_suggestion(level_direction))
+        # 复制建议字典，避免修改缓存中的结果
+        suggestions.extend(dict(suggestion) for suggestion in ai_suggestions[:5 - len(suggestions)])
+        
+        # 确保每个建议都有正确的step编号
+        for i, suggestion in enumerate(suggestions):
+            suggestion['step'] = i + 1
+        
+        return suggestions
+    
+    def _suggestion_system_prompt(self, combined: bool = False) -> str:
+        """建议请求的固定前缀：人设（prompt.txt）+ 摄影知识 + 输出格式和要求
+        
+        与画面、会话和拍摄意图都无关，所有请求完全相同，放在消息最前面时服务商的prompt缓存可以命中。
+        combined 模式额外包含水平判断任务
+        """
+        kind = 'combined' if combined else 'suggestions'
+        if kind not in self._system_prompts:
+            persona = f"{self.system_prompt}\n\n" if self.system_prompt else ""
+            prompt = f"""{persona}核心知识: {self._get_relevant_knowledge()[:200]}...
 
 输出JSON格式:
 ```json
@@ -656,25 +865,136 @@ intensity字段必须是1-5的整数，表示动作幅度：
 - 在reason字段中简单说明为什么选择这个方向（如："避开遮挡"、"包含更多景色"、"改善构图"）
 
 只返回JSON格式，不要其他内容。"""
-        return prompt
+            if combined:
+                prompt += self._combined_level_task()
+            self._system_prompts[kind] = prompt
+        return self._system_prompts[kind]
+    
+    def _intent_guidance(self, intent: str = None) -> str:
+        """按拍摄意图的指导（同一意图的请求完全相同，接在固定前缀之后）"""
+        intent_context = ""
+        intent_requirement = ""
+        if intent:
+            intent_context = f"""
+用户拍摄意图: {intent}
+请根据用户想拍摄的内容类型，提供针对性的专业建议。考虑该拍摄主题的特殊要求和最佳实践。"""
+            intent_requirement = f"""
+
+🎯 CRITICAL: 用户要拍摄{intent}！你必须基于这个具体目标分析画面并提供专业建议：
+
+拍摄{intent}的专业要求：
+"""
+
+            # Add specific requirements based on photography type
+            if "人像" in intent or "肖像" in intent:
+                intent_requirement += """
+- 人物要占据画面主要位置，背景要简洁
+- 相机高度应与眼部平齐或略低（显得亲切自然）
+- 避开背景中的干扰元素（电线杆、垃圾桶等）
+- 寻找柔和的光线，避免强烈阴影
+- 建议动作必须针对人像构图优化！"""
+
+            elif "风景" in intent or "景观" in intent:
+                intent_requirement += """
+- 地平线要水平，天空与地面比例要合理
+- 寻找前景、中景、背景的层次感
+- 包含引导线条或有趣的前景元素
+- 考虑黄金分割构图原则
+- 建议动作必须针对风景构图优化！"""
+
+            elif "美食" in intent or "食物" in intent:
+                intent_requirement += f"""
+- 采用45度俯拍角度，展现食物的立体感和层次
+- 避免手机阴影遮挡食物
+- 靠近拍摄突出食物质感和细节
+- 简化背景，让食物成为唯一焦点
+- 寻找均匀自然光，避免闪光灯
+
+🔥 每个action必须包含"食物"或"美食"字样！强制模板：
+- "蹲下45度俯拍，让食物更有立体感"
+- "往[方向]移动避开阴影，让食物光线更好"
+- "靠近[距离]突出食物的[特征]细节"
+- "调整角度让食物占据画面[比例]"""
+
+            elif "建筑" in intent:
+                intent_requirement += """
+- 寻找对称构图，让建筑线条垂直
+- 后退寻找完整建筑轮廓，避免透视变形
+- 利用引导线条增强建筑的气势
+- 考虑仰拍或俯拍展现建筑特色
+- 建议动作必须针对建筑摄影优化！"""
+
+            else:
+                intent_requirement += f"""
+- 针对{intent}的特殊拍摄需求
+- 考虑这类拍摄的最佳角度、构图和光线
+- 突出{intent}的特点和美感
+- 建议动作必须与拍摄目标相关！"""
+
+            intent_requirement += f"""
+
+❌ 禁止使用这些泛泛建议：
+- "调整拍摄角度，寻找最佳构图位置" 
+- "调整拍摄高度，尝试不同视角"
+- "调整焦距，突出主体元素"
+- "微调位置，平衡画面元素"
+- "优化构图布局"
+
+✅ 必须使用针对{intent}的具体建议：
+- "蹲下采用45度俯拍角度，让食物显得更有立体感和层次"
+- "往左移动避开手机阴影，让食物光线更均匀"
+- "靠近2步突出食物质感和细节"
+
+🚨 如果你给出泛泛建议，就是失败！"""
+        else:
+            intent_requirement = """
+
+🎯 用户还没有指定拍摄对象，请提供通用的摄影改进建议。"""
+
+        guidance = f"""🚨 WARNING: 用户要拍摄 {intent if intent else '照片'}！
+
+你必须分析画面并基于拍摄目标给出具体建议。绝对禁止泛泛而谈！{intent_context}{intent_requirement}"""
+        if intent:
+            guidance += f"""
+
+你是专业摄影师。用户正在拍摄{intent}。你的任务是分析画面并给出4个具体的、针对{intent}的专业建议。绝对禁止给出通用建议。每个建议必须明确说明为什么这个动作对拍摄{intent}有帮助。"""
+        return guidance
+    
+    def _suggestion_system_message(self, intent: str = None, combined: bool = False) -> Dict:
+        """建议请求的系统消息：固定前缀 + 拍摄意图指导"""
+        return {
+            "role": "system",
+            "content": f"{self._suggestion_system_prompt(combined)}\n\n=== 拍摄目标 ===\n{self._intent_guidance(intent)}"
+        }
+    
+    def _create_non_level_prompt(self, analysis: Dict, intent: str = None) -> str:
+        """当前画面的可变部分（技术参数），放在请求最后、紧挨图片"""
+        brightness = analysis['brightness_level']
+        prompt = f"技术参数: 光线{brightness}, 尺寸{analysis.get('width', 'N/A')}x{analysis.get('height', 'N/A')}"
+        if intent:
+            prompt += f"\n用户拍摄意图: {intent}"
+        return prompt + "\n\n请按要求分析这一帧画面，不要涉及画面水平问题，只返回JSON格式。"
     
     def _get_relevant_knowledge(self) -> str:
-        """获取相关的摄影知识点"""
+        """获取相关的摄影知识点
+        
+        按知识点名称命中的关键词数排序（同分时按知识库顺序）选择固定的5个，
+        每次选择结果相同，保证请求前缀稳定
+        """
         if not self.extracted_knowledge:
             return "暂无专业知识库支持"
         
         # 选择一些通用的、有指导价值的知识点
-        relevant_keys = [
-            key for key in self.extracted_knowledge.keys() 
-            if any(keyword in key for keyword in [
-                '构图', '光线', '角度', '人像', '风景', '色彩', '技巧', 
-                '拍摄', '摄影', '视角', '背景', '前景', '对比', '层次'
-            ])
+        keywords = [
+            '构图', '光线', '角度', '人像', '风景', '色彩', '技巧',
+            '拍摄', '摄影', '视角', '背景', '前景', '对比', '层次'
         ]
-        
-        # 随机选择3-5个相关知识点
-        import random
-        selected_keys = random.sample(relevant_keys, min(5, len(relevant_keys))) if relevant_keys else list(self.extracted_knowledge.keys())[:5]
+        scored = [
+            (sum(keyword in key for keyword in keywords), index, key)
+            for index, key in enumerate(self.extracted_knowledge.keys())
+        ]
+        relevant = sorted((item for item in scored if item[0]), key=lambda item: (-item[0], item[1]))
+        selected_keys = [key for _, _, key in relevant[:5]] or list(self.extracted_knowledge.keys())[:5]
         
         knowledge_text = ""
         for key in selected_keys:
@@ -682,63 +1002,78 @@ intensity字段必须是1-5的整数，表示动作幅度：
         
         return knowledge_text.strip() if knowledge_text else "使用基础摄影原理指导"
     
-    def _ai_check_level_only(self, image_path: str, analysis: Dict) -> Dict:
+    def _ai_check_level_only(self, payload: FramePayload, analysis: Dict) -> Dict:
         """AI专门检查水平状态，只返回True/False和方向"""
         try:
-            prompt = self._create_level_check_only_prompt(analysis)
-            
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=10,  # 只需要一个词，大幅减少token消耗
-                temperature=0.1  # 降低随机性，确保回答稳定一致
-            )
-            
-            result = response.choices[0].message.content.strip().lower()
-            print(f"AI水平检测原始回答: '{result}'")
-            
-            # 优化的解析逻辑 - 更精确的关键词匹配
-            if any(keyword in result for keyword in ['水平', '平稳', '平', 'level', '正常', '不倾斜']):
-                print("AI判断: 画面水平")
-                return {'is_level': True, 'direction': 'level'}
-            elif any(keyword in result for keyword in ['左边高', '左高', '左倾', '左侧高', 'left_high', '左边']):
-                print("AI判断: 左边高，建议右手抬起")
-                return {'is_level': False, 'direction': 'left_high'}
-            elif any(keyword in result for keyword in ['右边高', '右高', '右倾', '右侧高', 'right_high', '右边']):
-                print("AI判断: 右边高，建议左手抬起")
-                return {'is_level': False, 'direction': 'right_high'}
-            else:
-                print(f"⚠️ AI回答格式异常，默认判断为轻微倾斜: '{result}'")
-                # 默认认为有轻微倾斜，交由用户判断
-                return {'is_level': False, 'direction': 'unknown'}
-                
+            response = self.llm.complete('level', self._level_check_messages(payload, analysis))
+            self._record_model(analysis, 'level', response)
+            return self._finish_level_check(response)
         except Exception as e:
             print(f"AI水平检测失败: {e}")
-            return {'is_level': True, 'direction': 'level'}  # 默认认为水平
+            return self._default_level_result()  # 默认认为水平
     
-    def _create_level_check_only_prompt(self, analysis: Dict) -> str:
-        """创建专门用于水平检查的prompt（基于专业摄影知识）"""
+    async def _ai_check_level_only_async(self, payload: FramePayload, analysis: Dict) -> Dict:
+        """AI水平检查的异步版本"""
+        try:
+            # 图片缩小编码放到线程池，避免阻塞事件循环
+            messages = await asyncio.to_thread(self._level_check_messages, payload, analysis)
+            response = await self.llm.complete_async('level', messages)
+            self._record_model(analysis, 'level', response)
+            return self._finish_level_check(response)
+        except Exception as e:
+            print(f"AI水平检测失败: {e}")
+            return self._default_level_result()  # 默认认为水平
+    
+    def _level_check_messages(self, payload: FramePayload, analysis: Dict) -> list:
+        """构建水平检查请求的消息（固定的检查方法在系统消息中，图片尺寸和图片放在最后）"""
+        prompt = self._create_level_check_only_prompt(analysis)
+        return [
+            {"role": "system", "content": self._level_check_system_prompt()},
+            {
+                "role": "user", 
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/jpeg;base64,{payload.base64('level')}"}
+                    }
+                ]
+            }
+        ]
+    
+    def _finish_level_check(self, response) -> Dict:
+        """解析水平检查响应"""
+        result = response.choices[0].message.content.strip().lower()
+        print(f"AI水平检测原始回答: '{result}'")
         
-        # 获取水平检测相关的专业知识
-        level_knowledge = self._get_level_detection_knowledge()
+        return self._parse_level_answer(result)
+    
+    def _parse_level_answer(self, result: str) -> Dict:
+        """解析AI的水平判断回答（水平/左边高/右边高）"""
+        result = result.strip().lower()
         
-        prompt = f"""你是专业的摄影技术分析师，需要基于专业知识快速准确判断照片水平状态。
+        # 优化的解析逻辑 - 更精确的关键词匹配
+        if any(keyword in result for keyword in ['水平', '平稳', '平', 'level', '正常', '不倾斜']):
+            print("AI判断: 画面水平")
+            return {'is_level': True, 'direction': 'level'}
+        elif any(keyword in result for keyword in ['左边高', '左高', '左倾', '左侧高', 'left_high', '左边']):
+            print("AI判断: 左边高，建议右手抬起")
+            return {'is_level': False, 'direction': 'left_high'}
+        elif any(keyword in result for keyword in ['右边高', '右高', '右倾', '右侧高', 'right_high', '右边']):
+            print("AI判断: 右边高，建议左手抬起")
+            return {'is_level': False, 'direction': 'right_high'}
+        else:
+            print(f"⚠️ AI回答格式异常，默认判断为轻微倾斜: '{result}'")
+            # 默认认为有轻微倾斜，交由用户判断
+            return {'is_level': False, 'direction': 'unknown'}
+    
+    def _level_check_system_prompt(self) -> str:
+        """水平检查的固定前缀（专业知识和判断方法，与画面无关，所有请求相同）"""
+        if 'level' not in self._system_prompts:
+            # 获取水平检测相关的专业知识
+            level_knowledge = self._get_level_detection_knowledge()
+            
+            self._system_prompts['level'] = f"""你是专业的摄影技术分析师，需要基于专业知识快速准确判断照片水平状态。
 
 === 专业知识基础 ===
 你是一个专业的摄影师，你要通过照片的全局来判断这个图片的水平与否，可以参考一些知识：{level_knowledge}
@@ -749,9 +1084,6 @@ intensity字段必须是1-5的整数，表示动作幅度：
 3. **边缘对比法**：重点关注画面顶部和底部边缘线，忽略物体本身的倾斜
 4. **视觉重心法**：检查画面的视觉重心是否稳定，不向某一侧倾斜
 
-=== 当前图片数据 ===
-- 图片尺寸: {analysis.get('width', 'N/A')} x {analysis.get('height', 'N/A')}
-
 === 判断任务 ===
 运用上述专业方法，重点检查：
 • 画面整体的水平基准线（不是物体）
@@ -764,7 +1096,38 @@ intensity字段必须是1-5的整数，表示动作幅度：
 • "右边高" - 画面右侧相对较高，需要左手抬起校正
 
 只回答一个词，不要任何解释。"""
-        return prompt
+        return self._system_prompts['level']
+    
+    def _create_level_check_only_prompt(self, analysis: Dict) -> str:
+        """水平检查当前画面的可变部分"""
+        return f"""=== 当前图片数据 ===
+- 图片尺寸: {analysis.get('width', 'N/A')} x {analysis.get('height', 'N/A')}
+
+请判断这张照片的水平状态，只回答"水平"、"左边高"或"右边高"中的一个词。"""
+    
+    def _create_combined_prompt(self, analysis: Dict, intent: str = None) -> str:
+        """combined模式当前画面的可变部分（水平判断任务在固定前缀中）"""
+        return self._create_non_level_prompt(analysis, intent) + "\n同时完成水平判断，在JSON最外层返回 \"level\" 字段。"
+    
+    def _combined_level_task(self) -> str:
+        """combined模式的额外任务：同时判断水平（固定文本，属于请求前缀）"""
+        return """
+
+=== 额外任务：水平判断 ===
+除了上面的建议外，请同时判断画面整体是否水平（看画面的水平基准线和左右视觉平衡，忽略物体本身的倾斜）。
+在JSON最外层增加 "level" 字段，值只能是以下三个词之一：
+• "水平" - 画面整体平稳，无明显倾斜
+• "左边高" - 画面左侧相对较高
+• "右边高" - 画面右侧相对较高
+
+最终输出格式：
+```json
+{
+  "level": "水平",
+  "suggestions": [ ...同上格式... ]
+}
+```
+suggestions 中仍然不要涉及水平问题。只返回JSON格式，不要其他内容。"""
     
     def _get_level_detection_knowledge(self) -> str:
         """获取水平检测相关的专业知识"""
@@ -807,121 +1170,6 @@ intensity字段必须是1-5的整数，表示动作幅度：
         
         return knowledge_text.strip() if knowledge_text else "• 水平拍摄避免歪斜，提升画面稳定性\n• 参考线帮助判断画面是否横平竖直\n• 对称构图不会出现左右倾斜问题\n• 视觉平衡感是判断水平的重要依据"
 
-    def _create_level_check_prompt(self, analysis: Dict) -> str:
-        """创建包含水平二次检查的prompt"""
-        brightness = analysis['brightness_level']
-
-        prompt = f"""你是手机拍照教练，用最简单的话教用户拍照。
-
-当前光线: {brightness}
-
-仪器显示照片基本是平的，但请你再仔细看看照片，检查是不是真的平。
-
-请给出5个简单易懂的拍照建议：
-
-1. [简单动作]
-2. [简单动作]
-3. [简单动作]
-4. [简单动作]
-5. [简单动作]
-
-要求：
-- 先看照片是不是真的平，如果歪了：
-  * 如果左边高，说"右手抬起来"
-  * 如果右边高，说"左手抬起来"
-- 用最简单的话，像教小朋友一样
-- 说具体方向："往左走2步"、"往右走1步"、"蹲下来"、"站高一点"
-- 不要说"焦距"，要说"放大"或"缩小"
-- 不要说专业词汇，要说大白话
-
-只返回5条简单指令，不要其他内容。"""
-        return prompt
-    
-    def _get_fallback_non_level_suggestions(self, analysis: Dict) -> List[str]:
-        """生成不涉及水平的后备建议"""
-        suggestions = [
-            "往左边或往右边走2步",
-            "蹲下来一点，或者站高一点",
-            "手机稍微往上抬，或者往下压一点",
-            "拿稳手机，深呼吸再拍"
-        ]
-        
-        # 根据光线调整
-        if analysis['brightness_level'] == '昏暗':
-            suggestions[3] = "走到亮一点的地方"
-        
-        return suggestions
-    
-    def _get_fallback_with_level_check(self, analysis: Dict) -> List[str]:
-        """生成包含水平检查的后备建议"""
-        suggestions = [
-            "看看屏幕，照片是不是拍歪了",
-            "往左边或往右边走2步",
-            "蹲下来一点，或者站高一点",
-            "拿稳手机，深呼吸再拍",
-            "看看光线好不好，走到亮一点的地方"
-        ]
-        
-        # 根据光线调整
-        if analysis['brightness_level'] == '昏暗':
-            suggestions[4] = "太暗了，走到亮一点的地方"
-        
-        return suggestions
-    
-    def resize_image_if_needed(self, image_path: str) -> str:
-        """如果需要，调整图片大小"""
-        try:
-            with Image.open(image_path) as img:
-                # 更激进的压缩策略
-                max_size = (1280, 720)  # 降低分辨率以加快传输
-                if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    resized_path = f"temp_resized_{os.path.basename(image_path)}"
-                    img.save(resized_path, quality=75, optimize=True)  # 降低质量以减小文件大小
-                    return resized_path
-                return image_path
-        except Exception:
-            return image_path
-    
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """将图片编码为base64"""
-        try:
-            with open(image_path, 'rb') as f:
-                return base64.b64encode(f.read()).decode('utf-8')
-        except Exception as e:
-            raise Exception(f"图片编码失败: {e}")
-    
-    def call_minimax_api(self, prompt: str, image_base64: str) -> str:
-        """调用Minimax API"""
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=Config.MAX_TOKENS,
-                temperature=Config.TEMPERATURE,
-                extra_headers={
-                    "HTTP-Referer": Config.SITE_URL,
-                    "X-Title": Config.SITE_NAME,
-                }
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            print(f"API调用异常: {e}")
-            return None
-    
     def _create_level_correction_suggestion(self, tilt_direction: str) -> dict:
         """创建水平校正建议"""
         if tilt_direction == 'right_high':
@@ -949,213 +1197,303 @@ intensity字段必须是1-5的整数，表示动作幅度：
                 "reason": "保持画面水平"
             }
     
-    def _get_ai_suggestions_json(self, image_path: str, analysis: dict) -> list:
+    def _get_ai_suggestions_json(self, payload: FramePayload, analysis: dict,
+                                 session: PhotographySession) -> list:
         """获取AI建议并解析为JSON格式"""
+        call = self._prepare_suggestion_call(payload, analysis, session)
+        if call['cached']:
+            return call['cached']
+        
         try:
-            # 检查缓存
-            cache_key = self.get_cache_key(image_path, analysis)
-            cached_result = self.get_cached_result(cache_key)
-            if cached_result:
-                return cached_result
-            
-            prompt = self._create_non_level_prompt(analysis)
-            
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            
-            # 构建包含历史记录的消息数组
-            messages = self.message_history.copy()  # 复制历史消息
-            
-            # 🚨 Add explicit system message for context
-            if self.user_photography_intent:
-                system_message = {
-                    "role": "system", 
-                    "content": f"你是专业摄影师。用户正在拍摄{self.user_photography_intent}。你的任务是分析画面并给出4个具体的、针对{self.user_photography_intent}的专业建议。绝对禁止给出通用建议。每个建议必须明确说明为什么这个动作对拍摄{self.user_photography_intent}有帮助。"
-                }
-                messages.append(system_message)
-            
-            # 添加当前用户消息
-            current_message = {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                    }
-                ]
-            }
-            messages.append(current_message)
-            
-            print(f"使用消息历史: {len(self.message_history)} 条历史消息 + 1 条新消息")
-            
-            # 🐛 DEBUG: Print full prompt being sent to LLM
-            print("=" * 80)
-            print("🤖 FULL PROMPT SENT TO LLM:")
+            # 超时、连接错误由网关在截止时间内重试（见 llm_gateway.py）
+            response = self.llm.complete('suggestions', call['messages'])
+            result = self._finish_suggestion_call(call, response, session)
+            if result is not None:
+                return result
+        except Exception as e:
+            print(f"❌ AI建议获取失败: {e}")
+        
+        return self._suggestion_fallback(call)
+    
+    async def _get_ai_suggestions_json_async(self, payload: FramePayload, analysis: dict,
+                                             session: PhotographySession) -> list:
+        """获取AI建议的异步版本"""
+        call = await asyncio.to_thread(self._prepare_suggestion_call, payload, analysis, session)
+        if call['cached']:
+            return call['cached']
+        
+        try:
+            response = await self.llm.complete_async('suggestions', call['messages'])
+            result = self._finish_suggestion_call(call, response, session)
+            if result is not None:
+                return result
+        except Exception as e:
+            print(f"❌ AI建议获取失败: {e}")
+        
+        return self._suggestion_fallback(call)
+    
+    def _history_summary(self, analysis: dict, intent: str = None) -> str:
+        """一帧画面在会话历史中的文字摘要（完整prompt只在当前请求中发送，历史中保存摘要即可）"""
+        level = "水平" if analysis.get('is_level', True) else f"倾斜{abs(analysis.get('tilt_angle', 0)):.1f}°"
+        summary = f"[画面 {analysis.get('width')}x{analysis.get('height')}，亮度{analysis.get('brightness_level', '未知')}，{level}"
+        if intent:
+            summary += f"，拍摄{intent}"
+        return summary + "] 请给出拍摄建议"
+    
+    def _prepare_suggestion_call(self, payload: FramePayload, analysis: dict,
+                                 session: PhotographySession) -> Dict:
+        """准备建议请求：检查缓存并构建请求参数"""
+        intent = session.user_photography_intent
+        call = {
+            'cache_key': self.get_cache_key(analysis, intent),
+            'prompt': self._create_non_level_prompt(analysis, intent),
+            'system': self._suggestion_system_message(intent),
+            'summary': self._history_summary(analysis, intent),
+            'intent': intent,
+            'analysis': analysis,
+            'base64_image': None,
+            'image_bytes': None,
+            'cached': None,
+            'messages': None
+        }
+        
+        # 检查缓存
+        call['cached'] = self.get_cached_result(call['cache_key'])
+        if call['cached']:
+            return call
+        
+        # 缓存未命中时才缩小编码图片（同一帧的其他请求复用编码结果）
+        call['image_bytes'] = payload.encoded('suggestions')
+        call['base64_image'] = payload.base64('suggestions')
+        messages = self._build_suggestion_messages(call, session)
+        
+        # 🐛 DEBUG: Print full prompt being sent to LLM
+        print("=" * 80)
+        print("🤖 FULL PROMPT SENT TO LLM:")
+        print("=" * 80)
+        print(call['prompt'])
+        print("=" * 80)
+        if intent:
+            print(f"📸 USER PHOTOGRAPHY INTENT: {intent}")
             print("=" * 80)
-            print(prompt)
+        
+        call['messages'] = messages
+        return call
+    
+    def _finish_suggestion_call(self, call: Dict, response, session: PhotographySession):
+        """解析建议响应，记录历史并缓存；没有可用建议时返回None"""
+        self._record_model(call['analysis'], 'suggestions', response)
+        return self._finish_suggestion_text(call, response.choices[0].message.content.strip(), session)
+    
+    def _finish_suggestion_text(self, call: Dict, response_text: str, session: PhotographySession):
+        """解析建议响应文本（普通或流式请求的完整输出），记录历史并缓存；没有可用建议时返回None"""
+        intent = call['intent']
+        
+        print(f"🤖 AI原始响应: {response_text[:200]}...")
+        
+        # 🐛 DEBUG: Print full LLM response
+        print("=" * 80)
+        print("🤖 FULL LLM RESPONSE:")
+        print("=" * 80)
+        print(response_text)
+        print("=" * 80)
+        
+        # 🐛 DEBUG: Check if user intent is referenced in response
+        if intent and response_text:
+            intent_mentioned = intent in response_text
+            print(f"🎯 USER INTENT REFERENCED IN RESPONSE: {intent_mentioned}")
+            if not intent_mentioned:
+                print(f"⚠️  WARNING: User intent '{intent}' NOT found in LLM response!")
             print("=" * 80)
-            if self.user_photography_intent:
-                print(f"📸 USER PHOTOGRAPHY INTENT: {self.user_photography_intent}")
-                print("=" * 80)
+        
+        # 尝试解析JSON
+        try:
+            # 提取JSON部分（可能包含```json```标记）
+            json_text = self._extract_json_from_response(response_text)
+            ai_data = json.loads(json_text)
             
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                max_tokens=350,  # 减少token数量
-                temperature=0.7,  # 提高创造性
-                timeout=10  # 减少超时时间
-            )
+            if 'suggestions' in ai_data and isinstance(ai_data['suggestions'], list):
+                # 验证和标准化方向和强度
+                validated_suggestions = self._validate_suggestions(ai_data['suggestions'])
+                
+                # 🐛 DEBUG: Validate each suggestion references user intent
+                if intent:
+                    print("=" * 80)
+                    print("🔍 VALIDATING SUGGESTIONS REFERENCE USER INTENT:")
+                    print("=" * 80)
+                    for i, suggestion in enumerate(validated_suggestions, 1):
+                        action_has_intent = intent in suggestion.get('action', '')
+                        reason_has_intent = intent in suggestion.get('reason', '')
+                        has_intent = action_has_intent or reason_has_intent
+                        
+                        print(f"建议 {i}:")
+                        print(f"  Action: {suggestion.get('action', 'N/A')}")
+                        print(f"  Reason: {suggestion.get('reason', 'N/A')}")
+                        print(f"  🎯 References '{intent}': {has_intent}")
+                        if not has_intent:
+                            print(f"  ⚠️  WARNING: Suggestion {i} does NOT reference user intent!")
+                        print()
+                    print("=" * 80)
+                
+                # 添加消息到历史记录
+                session.add_frame_exchange(call['summary'], call['image_bytes'], response_text)
+                
+                # 缓存结果
+                self.set_cached_result(call['cache_key'], validated_suggestions)
+                return validated_suggestions
             
-            response_text = response.choices[0].message.content.strip()
-            print(f"🤖 AI原始响应: {response_text[:200]}...")
+        except json.JSONDecodeError as e:
+            print(f"⚠️ JSON解析失败: {e}")
+            print(f"原始响应: {response_text}")
             
-            # 🐛 DEBUG: Print full LLM response
-            print("=" * 80)
-            print("🤖 FULL LLM RESPONSE:")
-            print("=" * 80)
-            print(response_text)
-            print("=" * 80)
+            # 检查是否是AI拒绝响应
+            if "sorry" in response_text.lower() or "can't help" in response_text.lower():
+                print("🤖 AI拒绝了请求，使用本地建议")
+                fallback_result = self._get_fallback_suggestions(call)
+            else:
+                # 降级处理：尝试从文本中提取建议
+                fallback_result = self._parse_text_to_suggestions(response_text)
             
-            # 🐛 DEBUG: Check if user intent is referenced in response
-            if self.user_photography_intent and response_text:
-                intent_mentioned = self.user_photography_intent in response_text
-                print(f"🎯 USER INTENT REFERENCED IN RESPONSE: {intent_mentioned}")
-                if not intent_mentioned:
-                    print(f"⚠️  WARNING: User intent '{self.user_photography_intent}' NOT found in LLM response!")
-                print("=" * 80)
+            # 添加消息到历史记录（即使解析失败）
+            session.add_frame_exchange(call['summary'], call['image_bytes'], response_text)
             
-            # 尝试解析JSON
-            try:
-                # 提取JSON部分（可能包含```json```标记）
-                json_text = self._extract_json_from_response(response_text)
-                ai_data = json.loads(json_text)
-                
-                if 'suggestions' in ai_data and isinstance(ai_data['suggestions'], list):
-                    # 验证和标准化方向和强度
-                    validated_suggestions = []
-                    for suggestion in ai_data['suggestions']:
-                        if isinstance(suggestion, dict) and 'action' in suggestion and 'direction' in suggestion:
-                            validated_direction = self._validate_direction(suggestion['direction'])
-                            validated_intensity = self._validate_intensity(suggestion.get('intensity', 3))
-                            validated_suggestions.append({
-                                "step": suggestion.get('step', len(validated_suggestions) + 1),
-                                "action": suggestion['action'],
-                                "direction": validated_direction,
-                                "intensity": validated_intensity,
-                                "reason": suggestion.get('reason', '改善画面效果')
-                            })
-                    
-                    # 🐛 DEBUG: Validate each suggestion references user intent
-                    if self.user_photography_intent:
-                        print("=" * 80)
-                        print("🔍 VALIDATING SUGGESTIONS REFERENCE USER INTENT:")
-                        print("=" * 80)
-                        for i, suggestion in enumerate(validated_suggestions, 1):
-                            action_has_intent = self.user_photography_intent in suggestion.get('action', '')
-                            reason_has_intent = self.user_photography_intent in suggestion.get('reason', '')
-                            has_intent = action_has_intent or reason_has_intent
-                            
-                            print(f"建议 {i}:")
-                            print(f"  Action: {suggestion.get('action', 'N/A')}")
-                            print(f"  Reason: {suggestion.get('reason', 'N/A')}")
-                            print(f"  🎯 References '{self.user_photography_intent}': {has_intent}")
-                            if not has_intent:
-                                print(f"  ⚠️  WARNING: Suggestion {i} does NOT reference user intent!")
-                            print()
-                        print("=" * 80)
-                    
-                    # 添加消息到历史记录
-                    self.add_to_message_history("user", prompt, base64_image)
-                    self.add_to_message_history("assistant", response_text)
-                    
-                    # 缓存结果
-                    self.set_cached_result(cache_key, validated_suggestions)
-                    return validated_suggestions
-                
-            except json.JSONDecodeError as e:
-                print(f"⚠️ JSON解析失败: {e}")
-                print(f"原始响应: {response_text}")
-                
-                # 检查是否是AI拒绝响应
-                if "sorry" in response_text.lower() or "can't help" in response_text.lower():
-                    print("🤖 AI拒绝了请求，使用默认建议")
-                    fallback_result = self._get_fallback_suggestions()
-                else:
-                    # 降级处理：尝试从文本中提取建议
-                    fallback_result = self._parse_text_to_suggestions(response_text)
-                
-                # 添加消息到历史记录（即使解析失败）
-                self.add_to_message_history("user", prompt, base64_image)
-                self.add_to_message_history("assistant", response_text)
-                
-                self.set_cached_result(cache_key, fallback_result)
-                return fallback_result
-                
+            # 不缓存（与 _suggestion_fallback 相同）：一次格式错误的响应不应让同一画面在缓存有效期内都得到降级结果
+            return fallback_result
+        
+        return None
+    
+    def _suggestion_fallback(self, call: Dict) -> list:
+        """AI建议不可用时返回本地建议（不缓存：本地建议只需几毫秒，模型恢复后同一画面可以重新请求AI建议）"""
+        return self._get_fallback_suggestions(call)
+    
+    def _build_suggestion_messages(self, call: Dict, session: PhotographySession) -> list:
+        """构建建议请求的消息数组
+        
+        顺序从稳定到多变：固定的系统消息（人设、格式、知识、拍摄意图指导）→ 历史记录 → 当前画面的参数和图片，
+        前面不变的部分可以被服务商的prompt缓存命中
+        """
+        history = session.get_message_history()  # 复制历史消息
+        history_length = len(history)
+        messages = [call['system']] + history
+        
+        # 添加当前用户消息
+        current_message = {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": call['prompt']},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{call['base64_image']}"}
+                }
+            ]
+        }
+        messages.append(current_message)
+        
+        print(f"使用消息历史 (会话: {session.session_id}): {history_length} 条历史消息 + 1 条新消息")
+        return messages
+    
+    def _validate_suggestions(self, raw_suggestions: list, default_reason: str = '改善画面效果') -> list:
+        """验证AI返回的建议列表，标准化方向和强度"""
+        validated_suggestions = []
+        for suggestion in raw_suggestions:
+            if isinstance(suggestion, dict) and 'action' in suggestion and 'direction' in suggestion:
+                validated_suggestions.append({
+                    "step": suggestion.get('step', len(validated_suggestions) + 1),
+                    "action": suggestion['action'],
+                    "direction": self._validate_direction(suggestion['direction']),
+                    "intensity": self._validate_intensity(suggestion.get('intensity', 3)),
+                    "reason": suggestion.get('reason', default_reason)
+                })
+        return validated_suggestions
+    
+    def _ai_check_level_and_suggestions(self, payload: FramePayload, analysis: dict,
+                                        session: PhotographySession) -> tuple:
+        """combined模式：一次AI请求同时返回水平判断和拍摄建议
+        
+        返回 (水平检查结果, 建议列表)，格式与 _ai_check_level_only 和
+        _get_ai_suggestions_json 的返回值一致
+        """
+        call = self._prepare_combined_call(payload, analysis, session)
+        if call['cached']:
+            return call['cached']['level'], call['cached']['suggestions']
+        
+        try:
+            response = self.llm.complete('combined', call['messages'])
+            return self._finish_combined_call(call, response, session)
         except Exception as e:
-            print(f"❌ AI建议获取失败: {e}")
+            print(f"❌ AI合并请求失败: {e}")
+            return self._default_level_result(), self._get_fallback_suggestions(call)
+    
+    async def _ai_check_level_and_suggestions_async(self, payload: FramePayload, analysis: dict,
+                                                    session: PhotographySession) -> tuple:
+        """combined模式的异步版本"""
+        call = await asyncio.to_thread(self._prepare_combined_call, payload, analysis, session)
+        if call['cached']:
+            return call['cached']['level'], call['cached']['suggestions']
+        
+        try:
+            response = await self.llm.complete_async('combined', call['messages'])
+            return self._finish_combined_call(call, response, session)
+        except Exception as e:
+            print(f"❌ AI合并请求失败: {e}")
+            return self._default_level_result(), self._get_fallback_suggestions(call)
+    
+    def _default_level_result(self) -> Dict:
+        """AI水平判断不可用时的默认结果（认为水平，fallback标记表示不是AI的判断）"""
+        return {'is_level': True, 'direction': 'level', 'fallback': True}
+    
+    def _prepare_combined_call(self, payload: FramePayload, analysis: dict,
+                               session: PhotographySession) -> Dict:
+        """准备combined请求：检查缓存并构建请求参数"""
+        intent = session.user_photography_intent
+        call = {
+            # 与两次调用模式的缓存分开存放，因为结果里包含水平判断
+            'cache_key': self.get_cache_key(analysis, intent, kind='combined'),
+            'prompt': self._create_combined_prompt(analysis, intent),
+            'system': self._suggestion_system_message(intent, combined=True),
+            'summary': self._history_summary(analysis, intent),
+            'intent': intent,
+            'analysis': analysis,
+            'base64_image': None,
+            'image_bytes': None,
+            'cached': None,
+            'messages': None
+        }
+        
+        call['cached'] = self.get_cached_result(call['cache_key'])
+        if call['cached']:
+            return call
+        
+        call['image_bytes'] = payload.encoded('suggestions')
+        call['base64_image'] = payload.base64('suggestions')
+        call['messages'] = self._build_suggestion_messages(call, session)
+        return call
+    
+    def _finish_combined_call(self, call: Dict, response, session: PhotographySession) -> tuple:
+        """解析combined响应，返回 (水平检查结果, 建议列表)"""
+        self._record_model(call['analysis'], 'combined', response)
+        response_text = response.choices[0].message.content.strip()
+        print(f"🤖 AI合并响应: {response_text[:200]}...")
+        
+        ai_data = json.loads(self._extract_json_from_response(response_text))
+        
+        # 没有返回水平字段时沿用二次检查失败时的默认值
+        level_answer = str(ai_data.get('level', '')).strip()
+        level_result = self._parse_level_answer(level_answer) if level_answer else self._default_level_result()
+        
+        suggestions = []
+        if isinstance(ai_data.get('suggestions'), list):
+            suggestions = self._validate_suggestions(ai_data['suggestions'])
+        
+        if suggestions:
+            # 添加消息到历史记录
+            session.add_frame_exchange(call['summary'], call['image_bytes'], response_text)
             
-            # 如果是网络错误，尝试重试一次
-            if "timeout" in str(e).lower() or "connection" in str(e).lower():
-                print("🔄 检测到网络问题，尝试重试...")
-                try:
-                    response = self.client.chat.completions.create(
-                        model=self.model_name,
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                                    }
-                                ]
-                            }
-                        ],
-                        max_tokens=600,
-                        temperature=0.7,
-                        timeout=20  # 增加超时时间
-                    )
-                    
-                    response_text = response.choices[0].message.content.strip()
-                    print(f"🤖 重试成功，AI原始响应: {response_text[:200]}...")
-                    
-                    # 尝试解析JSON
-                    try:
-                        json_text = self._extract_json_from_response(response_text)
-                        ai_data = json.loads(json_text)
-                        
-                        if 'suggestions' in ai_data and isinstance(ai_data['suggestions'], list):
-                            validated_suggestions = []
-                            for suggestion in ai_data['suggestions']:
-                                if isinstance(suggestion, dict) and 'action' in suggestion and 'direction' in suggestion:
-                                    validated_suggestions.append({
-                                        "step": suggestion.get('step', len(validated_suggestions) + 1),
-                                        "action": suggestion['action'],
-                                        "direction": self._validate_direction(suggestion['direction']),
-                                        "intensity": self._validate_intensity(suggestion.get('intensity', 3)),
-                                        "reason": suggestion.get('reason', '基于画面分析')
-                                    })
-                            
-                            if validated_suggestions:
-                                # 添加消息到历史记录（重试成功）
-                                self.add_to_message_history("user", prompt, base64_image)
-                                self.add_to_message_history("assistant", response_text)
-                                
-                                self.set_cached_result(cache_key, validated_suggestions)
-                                return validated_suggestions
-                    except:
-                        pass
-                except Exception as retry_error:
-                    print(f"❌ 重试也失败了: {retry_error}")
-        
-        # 返回默认建议
-        fallback_result = self._get_fallback_suggestions()
-        self.set_cached_result(cache_key, fallback_result)
-        return fallback_result
+            self.set_cached_result(call['cache_key'], {'level': level_result, 'suggestions': suggestions})
+            return level_result, suggestions
+        
+        print("⚠️ AI合并响应中没有有效建议，使用本地建议")
+        return level_result, self._get_fallback_suggestions(call)
     
     def _extract_json_from_response(self, response_text: str) -> str:
         """从AI响应中提取JSON部分"""
@@ -1265,38 +1603,9 @@ intensity字段必须是1-5的整数，表示动作幅度：
         
         return suggestions
     
-    def _get_fallback_suggestions(self) -> list:
-        """获取默认建议（当AI失败时）"""
-        return [
-            {
-                "step": 1,
-                "action": "调整拍摄角度，寻找最佳构图位置",
-                "direction": "left",
-                "intensity": 3,
-                "reason": "优化构图布局"
-            },
-            {
-                "step": 2,
-                "action": "调整拍摄高度，尝试不同视角",
-                "direction": "down",
-                "intensity": 2,
-                "reason": "增加画面层次感"
-            },
-            {
-                "step": 3,
-                "action": "调整焦距，突出主体元素",
-                "direction": "up",
-                "intensity": 2,
-                "reason": "增强主体表现力"
-            },
-            {
-                "step": 4,
-                "action": "微调位置，平衡画面元素",
-                "direction": "right",
-                "intensity": 2,
-                "reason": "完善整体构图"
-            }
-        ]
+    def _get_fallback_suggestions(self, call: Dict) -> list:
+        """获取本地建议（当AI失败时）：由本地规则引擎根据画面特征和拍摄意图生成"""
+        return self.local_guidance.suggest(call['analysis'], call['intent'])
 
 def main():
     """测试摄影agent"""
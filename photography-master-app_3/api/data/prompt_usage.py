@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+prompt token用量和服务商prompt缓存命中统计
+建议请求的前缀（人设、输出格式、知识、拍摄意图指导）固定不变，服务商可以缓存这部分的计算结果，
+缓存命中的token数在响应的 usage 字段中返回：
+
+- OpenAI兼容格式：usage.prompt_tokens_details.cached_tokens
+- 部分服务商：usage.cache_read_input_tokens
+
+PromptUsageTracker 按请求类型（suggestions / combined / level）累计prompt token数和缓存命中的token数。
+"""
+
+import threading
+
+
+def _field(value, name):
+    """读取响应对象或字典中的字段"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def cached_prompt_tokens(usage) -> int:
+    """从usage字段中读取缓存命中的prompt token数"""
+    cached = _field(_field(usage, 'prompt_tokens_details'), 'cached_tokens')
+    if cached is None:
+        cached = _field(usage, 'cache_read_input_tokens')
+    return int(cached or 0)
+
+
+class PromptUsageTracker:
+    """按请求类型统计prompt token用量和缓存命中（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def record(self, kind: str, usage):
+        """记录一次响应的usage，返回缓存命中的token数（响应没有usage时返回None）"""
+        if usage is None:
+            return None
+        prompt_tokens = int(_field(usage, 'prompt_tokens') or 0)
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            stats = self._kinds.setdefault(kind, {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0,
+                                                  'cache_hits': 0})
+            stats['requests'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_tokens'] += cached
+            if cached:
+                stats['cache_hits'] += 1
+        if prompt_tokens:
+            print(f"prompt用量 ({kind}): {prompt_tokens} tokens，缓存命中 {cached} tokens")
+        return cached
+
+    def get_stats(self):
+        """获取用量统计信息"""
+        with self._lock:
+            return {
+                kind: dict(stats, cached_ratio=round(stats['cached_tokens'] / stats['prompt_tokens'], 3)
+                           if stats['prompt_tokens'] else None)
+                for kind, stats in self._kinds.items()
+            }
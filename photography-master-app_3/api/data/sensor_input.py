@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+设备传感器水平输入
+手机的加速度计已经知道设备的横滚角（roll），客户端随画面一起上传时，
+直接用它判断是否水平，跳过基于画面的水平检测和AI水平二次检查。
+
+约定：roll 单位为度，右侧抬高为正（与水平检测的 right_high 一致）；pitch 为俯仰角（度，仰拍为正）；
+sensor_timestamp 为传感器读数时间（Unix时间，秒或毫秒），仅作记录。
+
+读数是否过期按服务器收到读数的时间（received_at）判断，不使用客户端时间戳：
+设备时钟与服务器相差几秒很常见，按客户端时间判断会让这类设备的所有读数都被丢弃。
+"""
+
+import time
+
+from horizon_detector import level_result
+
+# roll/pitch 的合理范围（度）
+MAX_SENSOR_ANGLE = 180.0
+
+
+def _parse_angle(value, name: str):
+    """解析角度字段，返回 (角度, 错误信息)"""
+    try:
+        angle = float(value)
+    except (TypeError, ValueError):
+        return None, f"传感器字段 {name} 必须是数字"
+    if not -MAX_SENSOR_ANGLE <= angle <= MAX_SENSOR_ANGLE:
+        return None, f"传感器字段 {name} 超出范围（-180~180度）"
+    return angle, None
+
+
+def parse_sensor_data(roll, pitch=None, timestamp=None):
+    """解析客户端上传的传感器数据
+
+    返回 (sensor, error_message)：未提供 roll 时 sensor 为None；
+    sensor['received_at'] 记录服务器收到读数的时间，用于判断读数是否过期
+    """
+    if roll is None or roll == '':
+        return None, None
+
+    roll, error = _parse_angle(roll, 'roll')
+    if error:
+        return None, error
+
+    sensor = {'roll': roll, 'pitch': None, 'timestamp': None, 'received_at': time.time()}
+
+    if pitch is not None and pitch != '':
+        sensor['pitch'], error = _parse_angle(pitch, 'pitch')
+        if error:
+            return None, error
+
+    if timestamp is not None and timestamp != '':
+        try:
+            timestamp = float(timestamp)
+        except (TypeError, ValueError):
+            return None, "传感器字段 sensor_timestamp 必须是数字"
+        # 兼容毫秒时间戳（JavaScript的 Date.now()）
+        if timestamp > 1e12:
+            timestamp /= 1000.0
+        sensor['timestamp'] = timestamp
+
+    return sensor, None
+
+
+def sensor_age(sensor: dict, now: float = None) -> float:
+    """读数自服务器收到以来经过的秒数"""
+    return (time.time() if now is None else now) - sensor['received_at']
+
+
+def is_sensor_fresh(sensor: dict, max_age_seconds: float, now: float = None) -> bool:
+    """读数是否仍可使用（max_age_seconds 为0或None时不限制）"""
+    return not max_age_seconds or sensor_age(sensor, now) <= max_age_seconds
+
+
+def sensor_level_info(sensor: dict, tolerance: float) -> dict:
+    """根据传感器横滚角生成水平检测结果（格式与画面检测相同，置信度为1）"""
+    return level_result(sensor['roll'], 1.0, tolerance)
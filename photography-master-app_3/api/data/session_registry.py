@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+会话状态管理
+每个客户端（手机）拥有独立的轻量会话状态：消息历史、拍摄意图、会话是否开始。
+OpenAI客户端、知识库、缓存等重量级资源仍由 PhotographyAgent 在所有会话间共享。
+"""
+
+import base64
+import time
+import threading
+from collections import OrderedDict, deque
+from config import Config
+from conversation_history import ConversationHistory
+from blob_store import BlobStore
+
+# 所有会话共享的历史图片存储（相同图片只保存一份，见 blob_store.py）
+history_blob_store = BlobStore(Config.HISTORY_BLOB_STORE_MAX_BYTES)
+
+
+class PhotographySession:
+    """单个客户端的拍摄会话状态"""
+
+    def __init__(self, session_id: str, max_history_length: int = None, blob_store: BlobStore = None):
+        self.session_id = session_id
+        self.blob_store = blob_store or history_blob_store
+        self.created_at = time.time()
+        self.last_access = self.created_at
+
+        # 同一会话可能有多个请求并发到达（Flask threaded模式），修改状态时加锁
+        self.lock = threading.RLock()
+
+        # 消息历史记录（按token和图片字节预算管理，见 conversation_history.py）
+        self.max_history_length = max_history_length or Config.MAX_HISTORY_LENGTH
+        self.message_history = self._new_history()
+
+        # 会话状态
+        self.session_started = False
+        self.user_photography_intent = None  # 用户想拍摄的内容
+
+        # 上一次真正分析过的帧（帧差门控用，见 frame_gate.py）
+        self.last_analyzed_frame = None
+
+        # 最近几帧的水平读数和该会话上一次AI水平检查的结论（水平检查级联策略用，见 level_cascade.py）
+        self.level_readings = deque(maxlen=Config.CASCADE_STABLE_FRAMES)
+        self.last_ai_level = None
+
+        # 最近一次估算的内存占用；变化时通知 size_listener(session, 变化量)（由 SessionRegistry 设置，维护总量）
+        self.size_listener = None
+        self._size = 0
+
+    def touch(self):
+        """更新最近访问时间"""
+        self.last_access = time.time()
+
+    def _new_history(self) -> ConversationHistory:
+        return ConversationHistory(
+            self.blob_store,
+            max_messages=self.max_history_length,
+            token_budget=Config.HISTORY_TOKEN_BUDGET,
+            max_image_bytes=Config.HISTORY_MAX_IMAGE_BYTES,
+            full_image_turns=Config.HISTORY_FULL_IMAGE_TURNS,
+            thumbnail_turns=Config.HISTORY_THUMBNAIL_TURNS,
+            thumbnail_side=Config.HISTORY_THUMBNAIL_SIDE
+        )
+
+    def add_to_message_history(self, role: str, content: str, image_data: str = None):
+        """添加消息到历史记录（image_data 为base64编码的图片，以原始字节存入共享存储）"""
+        image_bytes = base64.b64decode(image_data) if role == "user" and image_data else None
+        with self.lock:
+            self.message_history.add(role, content, image_bytes)
+            history_length = len(self.message_history)
+        self.refresh_size()
+
+        print(f"添加消息到历史 (会话: {self.session_id}, 角色: {role}, 历史长度: {history_length})")
+
+    def add_frame_exchange(self, summary: str, image_bytes: bytes, response_text: str):
+        """添加一轮画面分析到历史记录：用户消息只保存画面摘要，AI建议与上一轮相同时不重复保存"""
+        with self.lock:
+            added = self.message_history.add_exchange(summary, image_bytes, response_text)
+            history_length = len(self.message_history)
+        self.refresh_size()
+
+        if added:
+            print(f"添加画面分析到历史 (会话: {self.session_id}, 历史长度: {history_length})")
+        else:
+            print(f"建议与上一轮相同，只更新历史中的画面 (会话: {self.session_id})")
+
+    def get_message_history(self) -> list:
+        """获取预算内的消息历史副本（构建请求时使用，避免与并发写入冲突）"""
+        with self.lock:
+            return self.message_history.messages()
+
+    def clear_message_history(self):
+        """清空消息历史记录"""
+        with self.lock:
+            self.message_history.clear()
+            self.session_started = False
+            self.user_photography_intent = None
+            self.last_analyzed_frame = None
+        self.refresh_size()
+        print(f"已清空消息历史记录和会话状态 (会话: {self.session_id})")
+
+    def get_message_history_summary(self):
+        """获取消息历史记录摘要"""
+        with self.lock:
+            history = self.message_history.all_messages()
+            sent_messages = len(self.message_history.messages())
+            estimated_tokens = self.message_history.estimated_tokens()
+            image_bytes = self.message_history.image_bytes()
+        return {
+            "session_id": self.session_id,
+            "total_messages": len(history),
+            "sent_messages": sent_messages,  # 在token预算内、会随请求发送的消息数
+            "estimated_tokens": estimated_tokens,
+            "image_bytes": image_bytes,
+            "messages_preview": [
+                {
+                    "role": msg["role"],
+                    "has_image": isinstance(msg.get("content"), list) and any(
+                        item.get("type") == "image_url" for item in msg.get("content", [])
+                    ),
+                    "text_preview": (
+                        msg["content"][:50] + "..." if isinstance(msg["content"], str) and len(msg["content"]) > 50
+                        else (
+                            msg["content"][0]["text"][:50] + "..." if isinstance(msg.get("content"), list) and len(msg["content"]) > 0 and "text" in msg["content"][0] and len(msg["content"][0]["text"]) > 50
+                            else (
+                                msg["content"][0]["text"] if isinstance(msg.get("content"), list) and len(msg["content"]) > 0 and "text" in msg["content"][0]
+                                else msg["content"] if isinstance(msg["content"], str)
+                                else "No text content"
+                            )
+                        )
+                    )
+                }
+                for msg in history[-5:]  # 显示最后5条消息
+            ]
+        }
+
+    def start_conversation(self):
+        """开始新的拍摄会话"""
+        with self.lock:
+            if self.session_started:
+                return "会话已经开始，可以直接告诉我你想拍摄什么！"
+            self.clear_message_history()
+            self.session_started = True
+
+        # 添加初始对话
+        greeting_message = """你好！我是你的AI摄影助手 📸
+
+在开始拍摄之前，请告诉我：你想拍摄什么内容呢？
+
+比如：
+🌅 风景照片（日出、山景、海景等）
+👤 人像照片（朋友、家人、自拍等）
+🍕 美食照片（餐厅菜品、家常菜等）
+🏗️ 建筑照片（古建筑、现代建筑等）
+🌸 花草照片（公园、花园等）
+🐱 宠物照片
+📚 产品照片（物品展示等）
+
+或者其他任何你想拍的内容！了解你的拍摄意图后，我可以提供更精准的构图和拍摄建议。"""
+
+        self.add_to_message_history("assistant", greeting_message)
+        print(f"已开始新的拍摄会话 (会话: {self.session_id})")
+        return greeting_message
+
+    def set_photography_intent(self, intent: str):
+        """设置用户的拍摄意图"""
+        with self.lock:
+            self.user_photography_intent = intent
+        self.add_to_message_history("user", f"我想拍摄：{intent}")
+
+        # AI确认并提供预期指导
+        confirmation_message = f"""很好！我了解你想拍摄 **{intent}** 📸
+
+现在请把相机对准你想拍的场景，我会实时分析画面并提供专业的拍摄建议，包括：
+• 构图调整
+• 角度优化
+• 位置移动
+• 光线利用
+
+开始拍摄吧！我会根据你的拍摄意图给出最合适的建议。"""
+
+        self.add_to_message_history("assistant", confirmation_message)
+        print(f"用户拍摄意图已设置 (会话: {self.session_id}): {intent}")
+        return confirmation_message
+
+    def release(self):
+        """会话被移除时释放历史图片在共享存储中的引用"""
+        with self.lock:
+            self.message_history.clear()
+
+    def estimated_size(self) -> int:
+        """估算会话占用的内存（字节），主要来自历史消息中的图片（共享的图片按引用数分摊）"""
+        with self.lock:
+            return self.message_history.estimated_size()
+
+    def refresh_size(self):
+        """重新估算内存占用，有变化时通知 size_listener（在会话锁外调用，避免与注册表锁形成环）"""
+        with self.lock:
+            size = self.message_history.estimated_size()
+            delta = size - self._size
+            self._size = size
+        if delta and self.size_listener is not None:
+            self.size_listener(self, delta)
+
+
+class SessionRegistry:
+    """会话注册表：按客户端会话ID管理会话，支持TTL过期、LRU淘汰和总内存上限"""
+
+    def __init__(self, ttl_seconds: float = None, max_sessions: int = None, max_total_bytes: int = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.SESSION_TTL_SECONDS
+        self.max_sessions = max_sessions if max_sessions is not None else Config.MAX_SESSIONS
+        self.max_total_bytes = max_total_bytes if max_total_bytes is not None else Config.SESSION_MAX_TOTAL_BYTES
+
+        # 按最近访问顺序排列（最旧的在前），淘汰时从头部弹出
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted_count = 0
+
+        # 所有会话估算内存的运行总量：会话历史变化时由 _on_session_resized 更新，淘汰时减去
+        # （每个会话计入总量的部分记在 _accounted 中，与总量在同一把锁下修改）
+        self.total_bytes = 0
+        self._accounted = {}
+
+    def get_session(self, session_id: str) -> PhotographySession:
+        """获取会话（不存在时创建），并刷新其LRU位置"""
+        with self._lock:
+            evicted = self._evict_expired()
+
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = PhotographySession(session_id)
+                session.size_listener = self._on_session_resized
+                self._sessions[session_id] = session
+                self._accounted[session_id] = 0
+                print(f"创建新会话: {session_id} (当前会话数: {len(self._sessions)})")
+            else:
+                self._sessions.move_to_end(session_id)
+            session.touch()
+
+            evicted += self._evict_over_capacity(keep=session_id)
+
+        # 释放历史图片需要会话锁，放在注册表锁外进行
+        for evicted_session in evicted:
+            evicted_session.release()
+        return session
+
+    def remove_session(self, session_id: str) -> bool:
+        """删除会话"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._drop(session_id)
+        if session is None:
+            return False
+        session.release()
+        return True
+
+    def _on_session_resized(self, session: PhotographySession, delta: int):
+        """会话估算内存变化时更新总量（已被淘汰的会话不再计入）"""
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                self._accounted[session.session_id] += delta
+                self.total_bytes += delta
+
+    def _drop(self, session_id: str) -> PhotographySession:
+        """从注册表移除会话并从总量中减去它计入的部分（调用方持有锁）"""
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= self._accounted.pop(session_id, 0)
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict_expired(self) -> list:
+        """淘汰超过TTL未访问的会话（LRU顺序下过期会话都在头部），返回被淘汰的会话"""
+        now = time.time()
+        evicted = []
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.ttl_seconds:
+                break
+            evicted.append(self._drop(session_id))
+            self.evicted_count += 1
+            print(f"会话已过期并清理: {session_id}")
+        return evicted
+
+    def _evict_over_capacity(self, keep: str) -> list:
+        """超过会话数或内存上限时，按LRU顺序淘汰最久未使用的会话，返回被淘汰的会话"""
+        evicted = []
+        while len(self._sessions) > self.max_sessions:
+            evicted.append(self._evict_oldest(keep))
+
+        if self.max_total_bytes:
+            while self.total_bytes > self.max_total_bytes and len(self._sessions) > 1:
+                evicted.append(self._evict_oldest(keep))
+        return evicted
+
+    def _evict_oldest(self, keep: str) -> PhotographySession:
+        """淘汰最久未使用的会话"""
+        session_id = next(iter(self._sessions))
+        if session_id == keep:
+            # 当前请求的会话不淘汰，移到末尾后继续
+            self._sessions.move_to_end(session_id)
+            session_id = next(iter(self._sessions))
+        self.evicted_count += 1
+        print(f"会话因容量限制被淘汰: {session_id}")
+        return self._drop(session_id)
+
+    def get_stats(self):
+        """获取会话统计信息"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        # 共享图片的分摊大小会随其他会话的引用变化，统计时重新估算一次，校准运行总量
+        for session in sessions:
+            session.refresh_size()
+        return {
+            "active_sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "estimated_bytes": self.total_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "evicted_sessions": self.evicted_count,
+            "history_images": history_blob_store.get_stats()
+        }
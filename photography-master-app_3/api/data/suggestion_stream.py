@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+流式建议解析
+模型流式输出 {"suggestions": [{...}, {...}]} 时，逐段喂入文本，
+每当 suggestions 数组中的一个对象完整闭合就立即解析出来，无需等待整个响应结束。
+"""
+
+import json
+
+
+class SuggestionStreamParser:
+    """增量解析 suggestions 数组中的建议对象（识别字符串和转义，忽略```json```等包裹文本）"""
+
+    ARRAY_KEY = '"suggestions"'
+
+    def __init__(self):
+        self.buffer = ''
+        self._pos = 0  # 下一个待扫描字符的位置
+        self._in_array = False
+        self._finished = False
+        self._depth = 0  # 数组内对象的花括号深度
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    @property
+    def finished(self) -> bool:
+        """suggestions 数组是否已经闭合"""
+        return self._finished
+
+    def feed(self, text: str) -> list:
+        """喂入一段新文本，返回本次新闭合的建议对象列表"""
+        self.buffer += text
+        completed = []
+
+        if not self._in_array and not self._finished:
+            self._find_array_start()
+
+        while self._in_array and self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == '{':
+                if self._depth == 0:
+                    self._object_start = self._pos - 1
+                self._depth += 1
+            elif char == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    suggestion = self._parse_object(self.buffer[self._object_start:self._pos])
+                    if suggestion is not None:
+                        completed.append(suggestion)
+                    self._object_start = None
+            elif char == ']' and self._depth == 0:
+                self._in_array = False
+                self._finished = True
+
+        return completed
+
+    def _find_array_start(self):
+        """定位 "suggestions" 键之后的数组起始位置"""
+        key_index = self.buffer.find(self.ARRAY_KEY)
+        if key_index < 0:
+            return
+        bracket_index = self.buffer.find('[', key_index + len(self.ARRAY_KEY))
+        if bracket_index < 0:
+            return
+        self._in_array = True
+        self._pos = bracket_index + 1
+
+    def _parse_object(self, text: str):
+        """解析单个建议对象，格式不正确时返回None"""
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return value if isinstance(value, dict) else None
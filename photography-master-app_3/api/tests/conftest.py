@@ -0,0 +1,10 @@
+import os
+import sys
+
+# 与 api_server.py 相同：api/ 和 api/data/ 下的模块按顶层模块导入
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.join(API_DIR, 'data'))
+
+# 仓库根目录下的实拍截图
+DEMO_IMAGES_DIR = os.path.join(API_DIR, '..', '..', 'images')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""历史图片的共享存储：按内容去重、引用计数和字节上限"""
+
+import cv2
+import numpy as np
+
+from blob_store import BlobStore
+
+
+def jpeg_bytes(seed: int, side: int = 256) -> bytes:
+    """随机噪声图片（压缩率低，大小稳定）"""
+    image = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_blob_store_deduplicates_and_counts_references():
+    store = BlobStore(max_bytes=10 ** 6)
+    data = jpeg_bytes(0)
+    key = store.put(data)
+    assert store.put(data) == key
+    assert store.get_stats()['blobs'] == 1 and store.get_stats()['references'] == 2
+    assert store.shared_size(key) == len(data) / 2
+
+    store.release(key)
+    assert store.get(key) == data
+    store.release(key)
+    assert store.get(key) is None
+    assert store.total_bytes == 0
+
+
+def test_blob_store_evicts_least_recently_used_over_budget():
+    first, second, third = jpeg_bytes(1), jpeg_bytes(2), jpeg_bytes(3)
+    store = BlobStore(max_bytes=len(first) + len(second) + len(third) - 1)
+    keys = [store.put(first), store.put(second)]
+    store.get(keys[0])
+    store.put(third)
+
+    assert store.get(keys[1]) is None
+    assert store.get(keys[0]) == first
+    assert store.evicted == 1
+    assert store.total_bytes <= store.max_bytes
+
+
+def test_stale_release_does_not_free_a_re_stored_blob():
+    store = BlobStore(max_bytes=10)
+    old_key = store.put(b'A' * 8)
+    store.put(b'B' * 8)  # 超出预算，淘汰仍被引用的A
+    assert store.get(old_key) is None
+
+    new_key = store.put(b'A' * 8)
+    assert new_key != old_key
+    # 旧持有者释放被淘汰的引用，不影响新持有者
+    store.release(old_key)
+    assert store.get(new_key) == b'A' * 8
+    assert store.shared_size(old_key) == 0
+    assert store.shared_size(new_key) == 8
+
+    # 重新存入A时B已被淘汰，释放A后存储为空
+    store.release(new_key)
+    assert store.get(new_key) is None
+    assert store.total_bytes == 0
+
+
+def test_deduplicated_puts_share_one_generation():
+    store = BlobStore(max_bytes=10 ** 6)
+    first = store.put(b'frame')
+    second = store.put(b'frame')
+    assert first == second
+    store.release(first)
+    assert store.get(second) == b'frame'
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""SQLite缓存后端：按哈希分段查找、LRU/TTL裁剪、分段表的级联删除和重建，以及内存缓存未命中时的回退"""
+
+import random
+import sqlite3
+import time
+
+import pytest
+
+from cache_backend import SQLiteCacheBackend
+from perceptual_cache import PerceptualCache, hamming_distance
+
+
+def flip_bits(phash: int, count: int, seed: int = 0) -> int:
+    """翻转 count 个不同的位"""
+    for bit in random.Random(seed).sample(range(64), count):
+        phash ^= 1 << bit
+    return phash
+
+
+BASE_HASH = 0x0123456789ABCDEF
+
+
+@pytest.fixture
+def backend(tmp_path):
+    # flush_interval 很长，写入只在测试调用 flush() 时提交
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.db'), max_entries=3, ttl_seconds=60, max_distance=6,
+                                 flush_interval=3600)
+    yield backend
+    backend.close()
+
+
+def count_rows(backend: SQLiteCacheBackend, table: str) -> int:
+    conn = sqlite3.connect(backend.path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def put(backend: SQLiteCacheBackend, namespace: str, phash: int, result, timestamp: float = None):
+    backend.put({'namespace': namespace, 'phash': f"{phash:016x}", 'result': result,
+                 'timestamp': timestamp if timestamp is not None else time.time()})
+
+
+def test_backend_find_returns_closest_within_threshold(backend):
+    put(backend, 'ns', flip_bits(BASE_HASH, 5, seed=1), 'far')
+    put(backend, 'ns', flip_bits(BASE_HASH, 2, seed=2), 'near')
+    put(backend, 'other', BASE_HASH, 'other namespace')
+    backend.flush()
+
+    record = backend.find('ns', BASE_HASH, 6, 0)
+    assert record['result'] == 'near'
+    assert hamming_distance(BASE_HASH, int(record['phash'], 16)) == 2
+    assert backend.find('ns', flip_bits(BASE_HASH, 20, seed=3), 6, 0) is None
+    assert backend.find('ns', BASE_HASH, 6, time.time() + 1) is None
+
+
+def test_backend_trims_least_recently_accessed(backend):
+    now = time.time()
+    hashes = [flip_bits(BASE_HASH, 30, seed=i) for i in range(4)]
+    for index, phash in enumerate(hashes):
+        put(backend, 'ns', phash, index, timestamp=now - 10 + index)
+    # 最早写入的一条刚被访问过，应保留；次早的一条被裁剪
+    backend.touch('ns', hashes[0])
+    backend.flush()
+
+    assert count_rows(backend, 'cache_entries') == 3
+    assert backend.find('ns', hashes[0], 0, 0)['result'] == 0
+    assert backend.find('ns', hashes[1], 0, 0) is None
+    # 被裁剪的记录的分段随之级联删除
+    assert count_rows(backend, 'cache_bands') == 3 * len(backend._blocks)
+
+
+def test_backend_drops_expired_entries(backend):
+    put(backend, 'ns', BASE_HASH, 'expired', timestamp=time.time() - 120)
+    put(backend, 'ns', ~BASE_HASH & (2 ** 64 - 1), 'fresh')
+    backend.flush()
+
+    assert count_rows(backend, 'cache_entries') == 1
+    assert count_rows(backend, 'cache_bands') == len(backend._blocks)
+
+
+def test_backend_overwrite_keeps_one_set_of_bands(backend):
+    put(backend, 'ns', BASE_HASH, 'first')
+    backend.flush()
+    put(backend, 'ns', BASE_HASH, 'second')
+    backend.flush()
+
+    assert backend.find('ns', BASE_HASH, 0, 0)['result'] == 'second'
+    assert count_rows(backend, 'cache_bands') == len(backend._blocks)
+
+
+def test_bands_are_rebuilt_when_threshold_changes(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    backend = SQLiteCacheBackend(path, max_entries=10, ttl_seconds=60, max_distance=6, flush_interval=3600)
+    put(backend, 'ns', BASE_HASH, 'cached')
+    backend.flush()
+    backend.close()
+
+    backend = SQLiteCacheBackend(path, max_entries=10, ttl_seconds=60, max_distance=10, flush_interval=3600)
+    try:
+        assert count_rows(backend, 'cache_bands') == 11
+        assert backend.find('ns', flip_bits(BASE_HASH, 10), 10, 0)['result'] == 'cached'
+    finally:
+        backend.close()
+
+
+def test_memory_miss_falls_back_to_backend(backend):
+    writer = PerceptualCache(max_distance=6, max_entries=10, ttl_seconds=60, backend=backend)
+    writer.set('ns', BASE_HASH, {'level': '水平'})
+    writer.flush()
+
+    # 另一个进程（或重启后）的内存缓存为空，从后端读到结果并放入内存
+    reader = PerceptualCache(max_distance=6, max_entries=10, ttl_seconds=60, backend=backend)
+    assert reader.get('ns', flip_bits(BASE_HASH, 3)) == {'level': '水平'}
+    assert reader.get_stats()['backend_hits'] == 1
+    assert len(reader) == 1
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""熔断器状态转换：closed -> open -> half_open -> closed / open，以及手动重置"""
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'time', fake.time)
+    return fake
+
+
+def make_breaker(**settings) -> CircuitBreaker:
+    options = dict(window_seconds=30, min_requests=4, error_rate_threshold=0.5, slow_call_seconds=8,
+                   slow_rate_threshold=0.8, open_seconds=15, half_open_probes=2)
+    options.update(settings)
+    return CircuitBreaker('model:level', **options)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.min_requests):
+        breaker.allow()
+        breaker.record(False)
+
+
+def test_opens_only_after_min_requests(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+
+def test_error_rate_below_threshold_stays_closed(clock):
+    breaker = make_breaker()
+    for success in (True, True, True, False, True, False):
+        breaker.record(success)
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_open_the_breaker(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(True, latency=9.0)
+    assert breaker.state == OPEN
+
+
+def test_outcomes_outside_window_are_ignored(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 31
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_open_rejects_until_open_seconds_pass(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.allow()
+    assert excinfo.value.retry_after == pytest.approx(15)
+    assert breaker.rejecting()
+    assert breaker.rejected == 1
+
+    clock.now += 15
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.rejecting()
+
+
+def test_half_open_limits_probes_and_closes_on_success(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 15
+    breaker.allow()
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.get_stats()['window_requests'] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 15
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_releases_probes_that_never_reported(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 15
+    breaker.allow()
+    breaker.allow()
+    # 探测请求一直没有结果（如流式请求被中断），超过 open_seconds 后重新放行
+    clock.now += 15
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+def test_results_recorded_while_open_are_ignored(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    breaker.record(True)
+    assert breaker.state == OPEN
+
+
+def test_transitions_are_recorded(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 15
+    breaker.allow()
+    breaker.record(True)
+    breaker.record(True)
+    assert [(t['from'], t['to']) for t in breaker.get_stats()['transitions']] == [
+        (CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_registry_reset(clock):
+    registry = CircuitBreakerRegistry(min_requests=1)
+    breaker = registry.get('model', 'level')
+    assert registry.get('model', 'level') is breaker
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    assert registry.reset('model:level')
+    assert breaker.state == CLOSED
+    assert not registry.reset('missing:level')
+
+    breaker.record(False)
+    registry.get('model', 'suggestions').record(False)
+    assert registry.reset()
+    assert {stats['state'] for stats in registry.get_stats()['breakers'].values()} == {CLOSED}
+
+
+def test_abandoned_probe_is_returned(clock):
+    breaker = make_breaker(half_open_probes=1)
+    trip(breaker)
+    clock.now += 15
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.abandon()
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == CLOSED
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""会话历史：图片按轮次和字节预算降级、重复回复不追加、按token预算截取最新的消息"""
+
+import cv2
+import numpy as np
+
+from blob_store import BlobStore
+from conversation_history import ConversationHistory, estimate_image_tokens, estimate_text_tokens
+
+
+def jpeg_bytes(seed: int, side: int = 256) -> bytes:
+    """随机噪声图片（压缩率低，大小稳定）"""
+    image = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def make_history(blob_store: BlobStore, **options) -> ConversationHistory:
+    settings = dict(max_messages=20, token_budget=100000, max_image_bytes=10 ** 7, full_image_turns=1,
+                    thumbnail_turns=1, thumbnail_side=64)
+    settings.update(options)
+    return ConversationHistory(blob_store, **settings)
+
+
+def test_older_images_degrade_to_thumbnails_then_text():
+    store = BlobStore(max_bytes=10 ** 7)
+    history = make_history(store)
+    for index in range(3):
+        history.add_exchange(f"画面{index}", jpeg_bytes(index), f"建议{index}")
+
+    kinds = [turn['image_kind'] for turn in history._turns if turn['role'] == 'user']
+    assert kinds == [None, 'thumbnail', 'full']
+    # 降级为纯文字的图片已释放，存储中只剩缩略图和原图
+    assert store.get_stats()['blobs'] == 2
+    assert history.messages()[0] == {'role': 'user', 'content': '画面0'}
+
+
+def test_image_byte_budget_degrades_oldest_images():
+    store = BlobStore(max_bytes=10 ** 7)
+    image = jpeg_bytes(0)
+    history = make_history(store, full_image_turns=5, max_image_bytes=int(len(image) * 1.5))
+    history.add_exchange("画面0", image, "建议0")
+    history.add_exchange("画面1", jpeg_bytes(1), "建议1")
+
+    assert history.image_bytes() <= history.max_image_bytes
+    assert history._turns[-2]['image_kind'] == 'full'
+    assert history._turns[0]['image_kind'] != 'full'
+
+
+def test_identical_reply_replaces_previous_frame():
+    store = BlobStore(max_bytes=10 ** 7)
+    history = make_history(store)
+    assert history.add_exchange("画面0", jpeg_bytes(0), "保持当前构图")
+    assert not history.add_exchange("画面1", jpeg_bytes(1), "保持当前构图")
+
+    assert len(history) == 2
+    assert history._turns[0]['text'] == "画面1"
+    assert store.get_stats()['blobs'] == 1
+
+
+def test_token_budget_keeps_newest_messages():
+    history = make_history(BlobStore(max_bytes=10 ** 6))
+    for index in range(5):
+        history.add('user', f"第{index}条消息的内容")
+    budget = sum(turn['tokens'] for turn in history._turns[-2:])
+
+    messages = history.messages(token_budget=budget)
+    assert [message['content'] for message in messages] == ["第3条消息的内容", "第4条消息的内容"]
+
+
+def test_token_estimates():
+    assert estimate_text_tokens("把手机向左移动") == 7
+    assert estimate_text_tokens("move left") == 3
+    assert estimate_image_tokens(750, 1) == 1
+    assert estimate_image_tokens(4000, 3000) == 1600
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""模型调用网关：响应缓存、请求合并（含调用方被取消或出错时的处理）、对冲请求和熔断拒绝"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from llm_gateway import DeadlineExceeded, LLMGateway
+
+PROFILES = {'level': {'max_tokens': 10, 'temperature': 0, 'timeout': 5}}
+MESSAGES = [{'role': 'user', 'content': '画面是否水平？'}]
+
+
+class FakeResponse:
+    usage = None
+
+    def __init__(self, model: str):
+        self.model = model
+
+
+class FakeUpstream:
+    """替代 async_client.chat.completions.create：按 delay 延迟返回，记录调用和正在进行的请求数"""
+
+    def __init__(self, delay: float = 0.05, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.active = 0
+        self.cancelled = 0
+
+    async def create(self, **params):
+        self.calls += 1
+        self.active += 1
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return FakeResponse(params['model'])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+def make_gateway(upstream: FakeUpstream, **options) -> LLMGateway:
+    gateway = LLMGateway('http://127.0.0.1:9', 'test-key', 'model-a', PROFILES, **options)
+    gateway.async_client.chat.completions.create = upstream.create
+    return gateway
+
+
+def test_waiter_completes_when_leader_is_cancelled():
+    upstream = FakeUpstream(delay=0.2)
+    gateway = make_gateway(upstream)
+
+    async def scenario():
+        leader = asyncio.create_task(gateway.complete_async('level', MESSAGES))
+        await asyncio.sleep(0.02)
+        waiter = asyncio.create_task(gateway.complete_async('level', MESSAGES))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(waiter, 2)
+
+    response = asyncio.run(scenario())
+    assert response.model == 'model-a'
+    # 等待者重新发起了请求，合并表中没有残留的 future
+    assert upstream.calls == 2
+    assert gateway.get_stats()['inflight'] == 0
+    assert gateway.get_stats()['calls']['level']['coalesced'] == 1
+
+
+def test_cancelled_waiter_does_not_affect_leader():
+    upstream = FakeUpstream(delay=0.1)
+    gateway = make_gateway(upstream)
+
+    async def scenario():
+        leader = asyncio.create_task(gateway.complete_async('level', MESSAGES))
+        await asyncio.sleep(0.02)
+        waiter = asyncio.create_task(gateway.complete_async('level', MESSAGES))
+        await asyncio.sleep(0.02)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await asyncio.wait_for(leader, 2)
+
+    assert asyncio.run(scenario()).model == 'model-a'
+    assert upstream.calls == 1
+    assert gateway.get_stats()['inflight'] == 0
+
+
+def test_leader_error_is_shared_with_waiters():
+    upstream = FakeUpstream(delay=0.05, error=ValueError('bad request'))
+    gateway = make_gateway(upstream)
+
+    async def scenario():
+        return await asyncio.gather(gateway.complete_async('level', MESSAGES),
+                                    gateway.complete_async('level', MESSAGES), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert upstream.calls == 1
+    assert gateway.get_stats()['inflight'] == 0
+
+
+def test_identical_requests_hit_the_response_cache():
+    upstream = FakeUpstream()
+    gateway = make_gateway(upstream)
+
+    async def scenario():
+        first = await gateway.complete_async('level', MESSAGES)
+        # 只有空白不同的消息规范化后是同一个请求
+        second = await gateway.complete_async('level', [{'role': 'user', 'content': '画面是否水平？  '}])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+    assert upstream.calls == 1
+    assert gateway.get_stats()['calls']['level']['cache_hits'] == 1
+
+
+def test_hedge_tasks_are_cancelled_with_the_caller():
+    upstream = FakeUpstream(delay=0.05)
+    gateway = make_gateway(upstream, hedge_min_samples=1, hedge_min_delay=0.05, min_attempt_seconds=0.1)
+
+    async def scenario():
+        # 先积累一个延迟样本，之后的请求超过 p95 就会发出对冲请求
+        await gateway.complete_async('level', MESSAGES, cache=False)
+        upstream.delay = 1.0
+        task = asyncio.create_task(gateway.complete_async('level', MESSAGES, cache=False))
+        await asyncio.sleep(0.2)
+        active_before = upstream.active
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return active_before
+
+    assert asyncio.run(scenario()) == 2
+    assert upstream.active == 0
+    assert upstream.cancelled == 2
+    assert gateway.get_stats()['calls']['level']['hedged'] == 1
+
+
+def test_hedge_delay_uses_samples_of_the_routed_model():
+    upstream = FakeUpstream()
+    gateway = make_gateway(upstream, hedge_min_samples=3, hedge_min_delay=0.01, min_attempt_seconds=0.1)
+    for _ in range(3):
+        gateway._record_latency('level', 'model-a', 0.2)
+
+    deadline = gateway.deadline('level')
+    assert gateway._hedge_delay('level', 'model-a', deadline) == pytest.approx(0.2)
+    # 其他候选模型没有样本，不使用 model-a 的延迟对冲
+    assert gateway._hedge_delay('level', 'model-b', deadline) is None
+
+
+class SyncUpstream:
+    """替代 client.chat.completions.create（同步）：第 n 次调用延迟 delays[n]（超出时用最后一个），记录最大并发数"""
+
+    def __init__(self, *delays: float):
+        self.delays = delays
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def create(self, **params):
+        with self._lock:
+            delay = self.delays[min(self.calls, len(self.delays) - 1)]
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(delay)
+            return FakeResponse(f"{params['model']}#{delay}")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def make_sync_gateway(upstream: SyncUpstream, **options) -> LLMGateway:
+    gateway = LLMGateway('http://127.0.0.1:9', 'test-key', 'model-a', PROFILES,
+                         **dict(dict(hedge_min_samples=1, hedge_min_delay=0.05, min_attempt_seconds=0.1), **options))
+    gateway.client.chat.completions.create = upstream.create
+    # 积累一个延迟样本，之后超过 hedge_min_delay 的尝试会发出对冲请求
+    gateway._record_latency('level', 'model-a', 0.01)
+    return gateway
+
+
+def test_sync_hedge_returns_first_success():
+    upstream = SyncUpstream(1.0, 0.05)
+    gateway = make_sync_gateway(upstream)
+
+    start = time.time()
+    response = gateway.complete('level', MESSAGES, cache=False)
+    assert response.model == 'model-a#0.05'
+    assert time.time() - start < 0.5
+    stats = gateway.get_stats()['calls']['level']
+    assert (stats['hedged'], stats['hedge_wins']) == (1, 1)
+
+
+def test_sync_primaries_do_not_queue_behind_the_hedge_pool():
+    upstream = SyncUpstream(0.3)
+    gateway = make_sync_gateway(upstream, hedge_workers=1)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=6) as callers:
+        responses = list(callers.map(lambda _: gateway.complete('level', MESSAGES, cache=False), range(6)))
+    assert len(responses) == 6
+    # 主请求都立即开始；对冲线程只有一个，其他调用不排队对冲
+    assert time.time() - start < 0.55
+    assert upstream.max_active == 7
+    assert gateway.get_stats()['calls']['level']['hedged'] == 1
+
+
+class FlakyUpstream(FakeUpstream):
+    """前 failures 次调用抛出可重试的超时错误"""
+
+    def __init__(self, failures: int, **options):
+        super().__init__(**options)
+        self.failures = failures
+
+    async def create(self, **params):
+        if self.calls < self.failures:
+            self.calls += 1
+            raise TimeoutError('upstream timeout')
+        return await super().create(**params)
+
+
+def test_retryable_errors_are_retried_within_the_deadline():
+    upstream = FlakyUpstream(failures=1, delay=0.01)
+    gateway = make_gateway(upstream, retry_base_delay=0.01, min_attempt_seconds=0.1)
+
+    assert asyncio.run(gateway.complete_async('level', MESSAGES)).model == 'model-a'
+    assert upstream.calls == 2
+    assert gateway.get_stats()['calls']['level']['retries'] == 1
+
+
+def test_retries_stop_at_max_retries():
+    upstream = FlakyUpstream(failures=5, delay=0.01)
+    gateway = make_gateway(upstream, max_retries=2, retry_base_delay=0.01, min_attempt_seconds=0.1)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(gateway.complete_async('level', MESSAGES))
+    assert upstream.calls == 3
+    assert gateway.get_stats()['calls']['level']['errors'] == 1
+
+
+def test_open_breaker_rejects_without_calling_upstream():
+    upstream = FakeUpstream()
+    breakers = CircuitBreakerRegistry(min_requests=1, open_seconds=60)
+    gateway = make_gateway(upstream, circuit_breakers=breakers)
+    breakers.get('model-a', 'level').record(False)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(gateway.complete_async('level', MESSAGES))
+    assert upstream.calls == 0
+    assert gateway.degraded('level')
+    stats = gateway.get_stats()['calls']['level']
+    assert stats['rejected'] == 1 and stats['errors'] == 0
+
+
+class FakeChunk:
+    usage = None
+
+
+def half_open_gateway(upstream: FakeUpstream = None):
+    """熔断器处于 half_open、只放行一个探测请求的网关"""
+    breakers = CircuitBreakerRegistry(min_requests=1, open_seconds=0, half_open_probes=1)
+    gateway = make_gateway(upstream or FakeUpstream(), circuit_breakers=breakers)
+    breaker = breakers.get('model-a', 'level')
+    breaker.record(False)
+    return gateway, breaker
+
+
+def test_disconnected_sync_stream_returns_the_probe():
+    gateway, breaker = half_open_gateway()
+    gateway.client.chat.completions.create = lambda **params: iter([FakeChunk(), FakeChunk(), FakeChunk()])
+
+    stream = gateway.stream('level', MESSAGES)
+    next(stream)
+    assert breaker.state == 'half_open'
+    stream.close()  # 客户端断开时 Flask 关闭生成器
+
+    # 探测名额已归还，下一个请求可以继续探测
+    breaker.allow()
+    stats = gateway.get_stats()['calls']['level']
+    assert (stats['cancelled'], stats['errors'], stats['requests']) == (1, 0, 1)
+    assert gateway.router.get_stats()['level']['models']['model-a']['requests'] == 0
+
+
+def test_disconnected_async_stream_returns_the_probe():
+    gateway, breaker = half_open_gateway()
+
+    async def chunks():
+        for _ in range(3):
+            await asyncio.sleep(0)
+            yield FakeChunk()
+
+    async def create(**params):
+        return chunks()
+
+    gateway.async_client.chat.completions.create = create
+
+    async def scenario():
+        stream = gateway.stream_async('level', MESSAGES)
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    assert gateway.get_stats()['calls']['level']['cancelled'] == 1
+
+
+def test_cancelled_probe_request_returns_the_probe():
+    upstream = FakeUpstream(delay=1.0)
+    gateway, breaker = half_open_gateway(upstream)
+
+    async def scenario():
+        task = asyncio.create_task(gateway.complete_async('level', MESSAGES))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    breaker.allow()
+    stats = gateway.get_stats()['calls']['level']
+    assert (stats['cancelled'], stats['errors']) == (1, 0)
+
+
+class TricklingStream:
+    """每隔 interval 秒产出一个chunk的上游流"""
+
+    def __init__(self, count: int, interval: float):
+        self.count = count
+        self.interval = interval
+        self.closed = False
+
+    def __iter__(self):
+        for _ in range(self.count):
+            if self.closed:
+                return
+            time.sleep(self.interval)
+            yield FakeChunk()
+
+    async def __aiter__(self):
+        for _ in range(self.count):
+            if self.closed:
+                return
+            await asyncio.sleep(self.interval)
+            yield FakeChunk()
+
+    def close(self):
+        self.closed = True
+
+
+def deadline_gateway() -> LLMGateway:
+    profiles = {'level': dict(PROFILES['level'], deadline=0.2)}
+    return LLMGateway('http://127.0.0.1:9', 'test-key', 'model-a', profiles)
+
+
+def test_sync_stream_is_aborted_at_the_deadline():
+    gateway = deadline_gateway()
+    upstream = TricklingStream(count=20, interval=0.05)
+    gateway.client.chat.completions.create = lambda **params: upstream
+
+    received = 0
+    with pytest.raises(DeadlineExceeded):
+        for _ in gateway.stream('level', MESSAGES):
+            received += 1
+    assert upstream.closed
+    assert 2 <= received < 6
+    assert gateway.get_stats()['calls']['level']['errors'] == 1
+
+
+def test_async_stream_is_aborted_at_the_deadline():
+    gateway = deadline_gateway()
+    upstream = TricklingStream(count=20, interval=0.05)
+
+    async def create(**params):
+        return upstream
+
+    async def close():
+        upstream.closed = True
+
+    upstream.close = close
+    gateway.async_client.chat.completions.create = create
+
+    async def scenario():
+        return [chunk async for chunk in gateway.stream_async('level', MESSAGES)]
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+    assert upstream.closed
+    assert gateway.get_stats()['calls']['level']['errors'] == 1
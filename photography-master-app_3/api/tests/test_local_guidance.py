@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""本地规则建议引擎：用实拍截图检查阈值校准和补足逻辑"""
+
+import os
+
+import pytest
+
+from conftest import DEMO_IMAGES_DIR
+from config import Config
+from image_features import decode_for_analysis, extract_features
+from local_guidance import GENERIC_TIPS, LocalGuidanceEngine
+
+DEMO_IMAGES = ('demo1.png', 'demo2.jpeg')
+GENERIC_ACTIONS = {tip[0] for tips in GENERIC_TIPS.values() for tip in tips}
+
+
+def demo_analysis(name: str) -> dict:
+    """按 PhotographyAgent 的本地分析流程（没有传感器数据时的解码尺寸）计算特征"""
+    path = os.path.join(DEMO_IMAGES_DIR, name)
+    if not os.path.exists(path):
+        pytest.skip(f"缺少示例图片: {name}")
+    with open(path, 'rb') as f:
+        gray, _ = decode_for_analysis(f.read(), Config.ANALYSIS_DECODE_TARGET_SIDE)
+    features = extract_features(gray, ('brightness', 'sharpness', 'histogram', 'composition'))
+    return {
+        'brightness': features['brightness'],
+        'sharpness': features['sharpness'],
+        'highlights_clipped': features['histogram']['highlights_clipped'],
+        'shadows_clipped': features['histogram']['shadows_clipped'],
+        'composition': features['composition'],
+    }
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return LocalGuidanceEngine(max_items=Config.MAX_ADVICE_ITEMS)
+
+
+def test_feature_rule_fires_on_demo_image(engine):
+    fired = []
+    for name in DEMO_IMAGES:
+        suggestions = engine.suggest(demo_analysis(name))
+        fired.extend(s['action'] for s in suggestions if s['action'] not in GENERIC_ACTIONS)
+    assert fired, "示例图片上没有任何规则触发，只返回了通用建议"
+
+
+@pytest.mark.parametrize('name', DEMO_IMAGES)
+@pytest.mark.parametrize('intent', [None, '人像', '风景', '美食', '建筑'])
+def test_demo_suggestions_are_topped_up(engine, name, intent):
+    suggestions = engine.suggest(demo_analysis(name), intent)
+    assert len(suggestions) == Config.MAX_ADVICE_ITEMS
+    assert [s['step'] for s in suggestions] == list(range(1, Config.MAX_ADVICE_ITEMS + 1))
+    assert len({s['action'] for s in suggestions}) == len(suggestions)
+
+
+def test_no_features_falls_back_to_full_generic_list(engine):
+    suggestions = engine.suggest({})
+    assert len(suggestions) == Config.MAX_ADVICE_ITEMS
+    assert all(s['action'] in GENERIC_ACTIONS for s in suggestions)
+
+
+def test_single_subject_is_detected_but_uniform_frame_is_not(engine):
+    # 离散度阈值介于单个大主体（约等于半径）和没有主体的画面之间
+    subject = {'subject_x': 0.8, 'subject_y': 0.8, 'subject_spread': 0.35}
+    suggestions = engine.suggest({'composition': subject})
+    assert suggestions[0]['action'] not in GENERIC_ACTIONS
+    uniform = dict(subject, subject_spread=0.41, balance_x=0.0)
+    assert all(s['action'] in GENERIC_ACTIONS for s in engine.suggest({'composition': uniform}))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""模型路由：候选顺序、按期望成功耗时选择、跳过熔断和错误率过高的模型"""
+
+from config import model_list
+from model_router import (
+    REASON_BEST, REASON_EXPLORE, REASON_FALLBACK, REASON_ONLY, REASON_PREFERRED, ModelRouter
+)
+
+ROUTES = {'level': ['fast', 'main']}
+
+
+def make_router(**options) -> ModelRouter:
+    return ModelRouter(ROUTES, 'main', **dict({'explore_rate': 0.0}, **options))
+
+
+def record(router: ModelRouter, model: str, latency: float, success: bool = True, times: int = 3):
+    for _ in range(times):
+        router.record('level', model, latency, success)
+
+
+def test_unconfigured_call_type_uses_default_model():
+    router = make_router()
+    assert router.choose('suggestions') == ('main', REASON_ONLY)
+
+
+def test_prefers_first_candidate_without_samples():
+    router = make_router()
+    assert router.choose('level') == ('fast', REASON_PREFERRED)
+
+
+def test_chooses_lowest_expected_latency():
+    router = make_router()
+    record(router, 'fast', 2.0)
+    record(router, 'main', 0.5)
+    assert router.choose('level') == ('main', REASON_BEST)
+
+
+def test_errors_raise_the_score():
+    router = make_router(max_error_rate=1.0)
+    record(router, 'fast', 0.5)
+    record(router, 'main', 0.8)
+    record(router, 'fast', 0.5, success=False, times=3)
+    assert router.choose('level') == ('main', REASON_BEST)
+
+
+def test_skips_models_with_high_error_rate():
+    router = make_router()
+    record(router, 'fast', 0.1, success=False, times=5)
+    assert router.choose('level')[0] == 'main'
+
+
+def test_skips_unavailable_models_and_falls_back():
+    router = make_router()
+    assert router.choose('level', available=lambda model: model != 'fast') == ('main', REASON_PREFERRED)
+    assert router.choose('level', available=lambda model: False) == ('fast', REASON_FALLBACK)
+
+
+def test_explore_picks_another_healthy_model():
+    router = make_router(explore_rate=1.0)
+    assert router.choose('level') == ('main', REASON_EXPLORE)
+    assert router.choose('level', available=lambda model: model != 'main') == ('fast', REASON_PREFERRED)
+    stats = router.get_stats()['level']['models']
+    assert stats['main']['chosen'] == {REASON_EXPLORE: 1}
+
+
+def test_model_list_parsing():
+    assert model_list('minimax/minimax-01') == ['minimax/minimax-01']
+    assert model_list(' fast , main,,') == ['fast', 'main']
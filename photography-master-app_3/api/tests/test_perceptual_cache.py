@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""感知哈希缓存：汉明距离阈值内的近似查找、LRU淘汰和TTL过期"""
+
+import random
+import time
+
+import cv2
+import numpy as np
+
+from perceptual_cache import PerceptualCache, dhash, hamming_distance
+
+
+def flip_bits(phash: int, count: int, seed: int = 0) -> int:
+    """翻转 count 个不同的位"""
+    for bit in random.Random(seed).sample(range(64), count):
+        phash ^= 1 << bit
+    return phash
+
+
+BASE_HASH = 0x0123456789ABCDEF
+
+
+def test_memory_cache_finds_near_duplicates_within_threshold():
+    cache = PerceptualCache(max_distance=6, max_entries=10, ttl_seconds=60)
+    cache.set('suggestions', BASE_HASH, 'cached')
+
+    assert cache.get('suggestions', flip_bits(BASE_HASH, 6)) == 'cached'
+    assert cache.get('suggestions', flip_bits(BASE_HASH, 7)) is None
+    assert cache.get('level', BASE_HASH) is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['near_duplicate_hits'], stats['misses']) == (1, 1, 2)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = PerceptualCache(max_distance=2, max_entries=2, ttl_seconds=60)
+    first, second, third = BASE_HASH, ~BASE_HASH & (2 ** 64 - 1), 0
+    cache.set('ns', first, 1)
+    cache.set('ns', second, 2)
+    cache.get('ns', first)
+    cache.set('ns', third, 3)
+
+    assert len(cache) == 2
+    assert cache.get('ns', second) is None
+    assert cache.get('ns', first) == 1
+    # 被淘汰的项也从分段索引中删除
+    assert all(('ns', second) not in keys for keys in cache._index.values())
+
+
+def test_memory_cache_ignores_expired_entries():
+    cache = PerceptualCache(max_distance=2, max_entries=10, ttl_seconds=60)
+    cache.set('ns', BASE_HASH, 'old', timestamp=time.time() - 61)
+    assert cache.get('ns', BASE_HASH) is None
+
+
+def test_dhash_is_stable_for_near_identical_frames():
+    # 渐变背景上的几个主体，接近手持拍摄的画面结构
+    scene = np.tile(np.linspace(40, 200, 640, dtype=np.uint8), (480, 1))
+    cv2.circle(scene, (220, 260), 90, 240, -1)
+    cv2.rectangle(scene, (400, 80), (560, 300), 20, -1)
+    rng = np.random.default_rng(0)
+    noisy = cv2.add(scene, rng.integers(0, 4, scene.shape, dtype=np.uint8))
+    shifted = np.roll(scene, 3, axis=1)
+
+    assert hamming_distance(dhash(scene), dhash(noisy)) <= 6
+    assert hamming_distance(dhash(scene), dhash(shifted)) <= 6
+    assert hamming_distance(dhash(scene), dhash(255 - scene)) > 32
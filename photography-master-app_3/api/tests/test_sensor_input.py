@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""传感器输入：字段解析，以及按服务器收到读数的时间判断是否过期"""
+
+import time
+
+from sensor_input import is_sensor_fresh, parse_sensor_data, sensor_age
+
+
+def test_parses_angles_and_millisecond_timestamp():
+    sensor, error = parse_sensor_data('3.5', '-10', '1700000000000')
+    assert error is None
+    assert (sensor['roll'], sensor['pitch'], sensor['timestamp']) == (3.5, -10.0, 1700000000.0)
+
+    assert parse_sensor_data(None) == (None, None)
+    assert parse_sensor_data('200')[0] is None
+    assert parse_sensor_data('1', timestamp='abc')[1] == "传感器字段 sensor_timestamp 必须是数字"
+
+
+def test_device_clock_skew_does_not_drop_readings():
+    # 设备时钟比服务器慢一小时，读数仍然有效
+    sensor, error = parse_sensor_data(2.0, timestamp=time.time() - 3600)
+    assert error is None
+    assert sensor is not None
+    assert is_sensor_fresh(sensor, max_age_seconds=5)
+
+
+def test_freshness_uses_server_receive_time():
+    sensor, _ = parse_sensor_data(2.0, timestamp=time.time())
+    later = sensor['received_at'] + 6
+
+    assert sensor_age(sensor, now=later) == 6
+    assert not is_sensor_fresh(sensor, max_age_seconds=5, now=later)
+    assert is_sensor_fresh(sensor, max_age_seconds=0, now=later)
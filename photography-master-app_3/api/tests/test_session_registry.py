@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""会话注册表：按会话隔离状态、内存运行总量和超出上限时的淘汰"""
+
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+import session_registry
+from blob_store import BlobStore
+from session_registry import SessionRegistry
+
+
+def jpeg_bytes(seed: int, side: int = 256) -> bytes:
+    """随机噪声图片（压缩率低，大小稳定）"""
+    image = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+@pytest.fixture
+def blob_store(monkeypatch):
+    # 会话默认使用进程内共享的存储，测试中换成独立的一份
+    store = BlobStore(max_bytes=10 ** 7)
+    monkeypatch.setattr(session_registry, 'history_blob_store', store)
+    return store
+
+
+def add_image_turn(registry: SessionRegistry, session_id: str, seed: int):
+    image = base64.b64encode(jpeg_bytes(seed)).decode('utf-8')
+    registry.get_session(session_id).add_to_message_history('user', '画面', image)
+
+
+def test_sessions_are_isolated(blob_store):
+    registry = SessionRegistry(ttl_seconds=600, max_sessions=10, max_total_bytes=0)
+    registry.get_session('a').set_photography_intent('人像')
+
+    assert registry.get_session('a') is registry.get_session('a')
+    assert registry.get_session('b').user_photography_intent is None
+    assert len(registry) == 2
+
+
+def test_expired_and_over_count_sessions_are_evicted(blob_store):
+    registry = SessionRegistry(ttl_seconds=600, max_sessions=2, max_total_bytes=0)
+    for session_id in ('a', 'b', 'c'):
+        registry.get_session(session_id)
+    assert set(registry._sessions) == {'b', 'c'}
+
+    registry.get_session('b').last_access -= 601
+    registry.get_session('c')
+    assert 'b' in registry._sessions
+    registry._sessions['b'].last_access -= 601
+    registry.get_session('c')
+    assert set(registry._sessions) == {'c'}
+    assert registry.evicted_count == 2
+
+
+def test_registry_tracks_total_bytes(blob_store):
+    registry = SessionRegistry(ttl_seconds=600, max_sessions=10, max_total_bytes=0)
+    add_image_turn(registry, 'a', 0)
+    add_image_turn(registry, 'b', 1)
+    sizes = [registry.get_session(session_id).estimated_size() for session_id in ('a', 'b')]
+    assert registry.total_bytes == sum(sizes)
+
+    registry.get_session('a').clear_message_history()
+    assert registry.total_bytes == sizes[1] + registry.get_session('a').estimated_size()
+
+    assert registry.remove_session('b')
+    assert registry.total_bytes == registry.get_session('a').estimated_size()
+    assert blob_store.get_stats()['blobs'] == 0
+
+
+def test_registry_evicts_sessions_over_byte_budget(blob_store):
+    registry = SessionRegistry(ttl_seconds=600, max_sessions=10, max_total_bytes=len(jpeg_bytes(0)) * 2)
+    for index, session_id in enumerate(('a', 'b', 'c')):
+        add_image_turn(registry, session_id, index)
+    # 内存超出上限后，下一次访问时淘汰最久未使用的会话
+    registry.get_session('c')
+
+    assert 'a' not in registry._sessions
+    assert registry.total_bytes <= registry.max_total_bytes
+    assert registry.total_bytes == sum(session.estimated_size() for session in registry._sessions.values())
+    assert registry.evicted_count == 1
@@ -85,11 +85,11 @@ export function CameraPage({ onClose, initialMode = "自动" }: CameraPageProps)
     if (isHealthy && videoRef.current) {
       console.log('SUCCESS: API server connected and ready!')
       console.log('Starting live camera frame analysis...')
-      console.log('Analysis interval: Every 3 seconds')
+      console.log('Frame interval: Every second (stale frames are dropped server-side)')
       setIsAnalyzing(true)
       
-      // Start periodic analysis every 3 seconds for more responsive feedback
-      const stopAnalysis = photographyApi.startPeriodicAnalysis(videoRef.current, 3000, (guidance) => {
+      // Stream frames over the live channel; the server only analyzes the newest one
+      const stopAnalysis = photographyApi.startLiveAnalysis(videoRef.current, 1000, (guidance) => {
         setCurrentGuidance(guidance)
         setLastAnalysisTime(new Date())
       })
@@ -99,7 +99,7 @@ export function CameraPage({ onClose, initialMode = "自动" }: CameraPageProps)
       setLastAnalysisTime(new Date())
       
       // Log session start with emphasis
-      console.log('LIVE PROCESSING ACTIVE - Camera frames will be sent to API every 3 seconds')
+      console.log('LIVE PROCESSING ACTIVE - Camera frames are streamed to /api/ws/camera')
       console.log('Check your API server logs to see incoming requests')
       console.log('====================================================')
     } else {
@@ -19,6 +19,16 @@ interface PhotographyGuidanceResponse {
   message?: string;
 }
 
+/**
+ * Device orientation reading sent with a frame. When present the server uses the
+ * roll angle for leveling instead of detecting the horizon in the image.
+ */
+interface DeviceSensorReading {
+  roll: number;       // degrees, positive when the right side is raised
+  pitch?: number;     // degrees, positive when tilted up
+  timestamp?: number; // ms since epoch (Date.now())
+}
+
 interface ApiError {
   status: string;
   message: string;
@@ -66,7 +76,7 @@ class PhotographyApiService {
   /**
    * Analyze an image and get photography guidance
    */
-  async analyzeImage(imageBlob: Blob): Promise<PhotographyGuidanceResponse | null> {
+  async analyzeImage(imageBlob: Blob, sensor?: DeviceSensorReading): Promise<PhotographyGuidanceResponse | null> {
     console.log('🎯 analyzeImage() called with blob size:', imageBlob.size, 'bytes');
     
     if (this.isProcessing) {
@@ -81,6 +91,11 @@ class PhotographyApiService {
     try {
       const formData = new FormData();
       formData.append('image', imageBlob, `camera-frame-${Date.now()}.jpg`);
+      if (sensor) {
+        formData.append('roll', String(sensor.roll));
+        if (sensor.pitch !== undefined) formData.append('pitch', String(sensor.pitch));
+        formData.append('sensor_timestamp', String(sensor.timestamp ?? Date.now()));
+      }
       
       console.log('📤 Sending image to API...', {
         size: `${(imageBlob.size / 1024).toFixed(1)}KB`,
@@ -90,6 +105,9 @@ class PhotographyApiService {
       const response = await fetch(`${this.baseUrl}/api/analyze`, {
         method: 'POST',
         body: formData,
+        headers: {
+          'X-Session-ID': this.getSessionId(),
+        },
       });
 
       if (!response.ok) {
@@ -117,6 +135,75 @@ class PhotographyApiService {
     }
   }
 
+  /**
+   * Analyze an image with streamed guidance (Server-Sent Events).
+   * Each suggestion is delivered through onSuggestion as soon as the model finishes it;
+   * the full response (same shape as analyzeImage) is returned at the end.
+   */
+  async analyzeImageStream(
+    imageBlob: Blob,
+    onSuggestion: (suggestion: NonNullable<PhotographyGuidanceResponse['data']>['suggestions'][number]) => void
+  ): Promise<PhotographyGuidanceResponse | null> {
+    const formData = new FormData();
+    formData.append('image', imageBlob, `camera-frame-${Date.now()}.jpg`);
+
+    try {
+      const response = await fetch(`${this.baseUrl}/api/analyze/stream`, {
+        method: 'POST',
+        body: formData,
+        headers: {
+          'X-Session-ID': this.getSessionId(),
+        },
+      });
+
+      if (!response.ok || !response.body) {
+        console.error(`❌ Streaming API error: HTTP ${response.status}`);
+        this.logToApiHistory('error', `HTTP ${response.status}: streaming analysis failed`);
+        return null;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let result: PhotographyGuidanceResponse | null = null;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // SSE messages are separated by a blank line
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary >= 0) {
+          const message = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          boundary = buffer.indexOf('\n\n');
+
+          const event = message.match(/^event: (.*)$/m)?.[1];
+          const data = message.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+
+          const payload = JSON.parse(data);
+          if (event === 'suggestion') {
+            onSuggestion(payload);
+          } else if (event === 'done') {
+            result = payload as PhotographyGuidanceResponse;
+          } else if (event === 'error') {
+            console.error('❌ Streaming analysis error:', payload.error);
+            this.logToApiHistory('error', payload.error);
+          }
+        }
+      }
+
+      return result;
+    } catch (error) {
+      console.error('❌ Streaming API Call Failed:', error);
+      const errorMessage = error instanceof Error ? error.message : 'Unknown error';
+      this.logToApiHistory('error', `Network error: ${errorMessage}`);
+      return null;
+    }
+  }
+
   /**
    * Format and log the guidance response in a readable way
    */
@@ -305,7 +392,87 @@ class PhotographyApiService {
       clearInterval(intervalId);
     };
   }
+
+  /**
+   * Start live analysis over a WebSocket connection.
+   * Frames are pushed as binary JPEG messages; the server only analyzes the newest
+   * pending frame, so slow responses never build a backlog. Falls back to
+   * periodic HTTP analysis if the WebSocket cannot be opened.
+   */
+  startLiveAnalysis(videoElement: HTMLVideoElement, intervalMs: number = 1000, onGuidanceReceived?: (guidance: any) => void): () => void {
+    const wsUrl = `${this.baseUrl.replace(/^http/, 'ws')}/api/ws/camera?session_id=${encodeURIComponent(this.getSessionId())}`;
+    const canvas = document.createElement('canvas');
+    const context = canvas.getContext('2d');
+    let intervalId: number | undefined;
+    let stopFallback: (() => void) | null = null;
+    let stopped = false;
+    let opened = false;
+    let frameCount = 0;
+
+    console.log(`🔌 Opening live camera channel: ${wsUrl}`);
+    const socket = new WebSocket(wsUrl);
+    socket.binaryType = 'arraybuffer';
+
+    const sendFrame = () => {
+      if (socket.readyState !== WebSocket.OPEN || !context) return;
+      if (!videoElement.videoWidth || !videoElement.videoHeight) {
+        console.log('📹 Camera not ready yet, skipping frame...');
+        return;
+      }
+      canvas.width = videoElement.videoWidth;
+      canvas.height = videoElement.videoHeight;
+      context.drawImage(videoElement, 0, 0);
+      canvas.toBlob((blob) => {
+        if (blob && socket.readyState === WebSocket.OPEN) {
+          frameCount++;
+          socket.send(blob);
+        }
+      }, 'image/jpeg', 0.8);
+    };
+
+    socket.onopen = () => {
+      opened = true;
+      console.log(`🔄 LIVE ANALYSIS STARTED: sending a frame every ${intervalMs / 1000} seconds`);
+      intervalId = setInterval(sendFrame, intervalMs);
+    };
+
+    socket.onmessage = (event) => {
+      try {
+        const message = JSON.parse(event.data);
+        if (message.type === 'guidance') {
+          this.logGuidanceResponse(message as PhotographyGuidanceResponse);
+          console.log(`📊 Live frames: ${JSON.stringify(message.frames)}`);
+          if (onGuidanceReceived && message.data) {
+            onGuidanceReceived(message.data);
+          }
+        } else if (message.type === 'error') {
+          console.error('❌ Live channel error:', message.message);
+          this.logToApiHistory('error', message.message);
+        }
+      } catch (error) {
+        console.error('❌ Invalid live channel message:', error);
+      }
+    };
+
+    socket.onclose = () => {
+      clearInterval(intervalId);
+      if (!opened && !stopped) {
+        console.log('⚠️ Live channel unavailable, falling back to periodic HTTP analysis');
+        stopFallback = this.startPeriodicAnalysis(videoElement, Math.max(intervalMs, 3000), onGuidanceReceived);
+      }
+    };
+
+    // Return cleanup function
+    return () => {
+      console.log('🛑 STOPPING LIVE ANALYSIS');
+      console.log(`📊 Total frames sent: ${frameCount}`);
+      stopped = true;
+      clearInterval(intervalId);
+      if (stopFallback) stopFallback();
+      socket.close();
+    };
+  }
 }
 
 export const photographyApi = new PhotographyApiService();
-export type { PhotographyGuidanceResponse, ApiError }; 
\ No newline at end of file
+export type { PhotographyGuidanceResponse, ApiError, DeviceSensorReading }; 
\ No newline at end of file
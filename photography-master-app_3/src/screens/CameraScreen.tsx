@@ -52,6 +52,9 @@ const getApiBaseUrl = (): string => {
 
 const API_BASE_URL = getApiBaseUrl()
 
+// Per-app-launch session ID so the server keeps this phone's intent and history separate
+const SESSION_ID = `session_${Date.now()}_${Math.random().toString(36).substring(2, 11)}`
+
 // Route params type
 type RootStackParamList = {
   Camera: {
@@ -127,6 +130,7 @@ const CameraScreen = () => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-Session-ID': SESSION_ID,
         },
         body: JSON.stringify({
           intent: textInput.trim()
@@ -424,6 +428,7 @@ const CameraScreen = () => {
         body: formData,
         headers: {
           'X-Priority': 'high', // Signal for faster processing
+          'X-Session-ID': SESSION_ID,
         },
         // Don't set Content-Type for FormData in React Native - let fetch handle it
       })